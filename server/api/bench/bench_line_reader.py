@@ -0,0 +1,101 @@
+"""
+Benchmark: LineReader vs. the former read(1) loop of gfls_generator
+
+usage: bench_line_reader.py [-n LINES] [--subprocess]
+"""
+import argparse
+import asyncio
+import tempfile
+import time
+
+import gfarm_http_gateway as gw
+
+
+LINE = (b"-rw-r--r-- 1 user1 gfarmadm 123456 Jun 01 09:00:00 2024"
+        b" file_%08d.dat\n")
+
+
+def make_data(nlines):
+    return b"".join(LINE % i for i in range(nlines))
+
+
+async def read1_loop(stream):
+    # the loop used before LineReader
+    count = 0
+    buffer = b""
+    is_reading = True
+    while is_reading:
+        chunk = await stream.read(1)
+        if not chunk:
+            is_reading = False
+            if len(buffer) > 0:
+                buffer += b"\n"
+        else:
+            buffer += chunk
+        if b"\r" in buffer or b"\n" in buffer:
+            line = buffer.decode("utf-8", errors="replace").strip()
+            buffer = b""
+            if line:
+                count += 1
+    return count
+
+
+async def line_reader(stream):
+    count = 0
+    async for line in gw.LineReader(stream):
+        if line.strip():
+            count += 1
+    return count
+
+
+async def open_stream(data, path, use_subprocess):
+    if use_subprocess:
+        p = await asyncio.create_subprocess_exec(
+            "cat", path,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE)
+        return p.stdout, p
+    stream = asyncio.StreamReader()
+    stream.feed_data(data)
+    stream.feed_eof()
+    return stream, None
+
+
+async def run(func, data, path, use_subprocess):
+    stream, p = await open_stream(data, path, use_subprocess)
+    t0 = time.perf_counter()
+    t0_cpu = time.process_time()
+    count = await func(stream)
+    elapsed = time.perf_counter() - t0
+    cpu = time.process_time() - t0_cpu
+    if p is not None:
+        await p.wait()
+    return count, elapsed, cpu
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--lines", type=int, default=100000)
+    parser.add_argument("--subprocess", action="store_true",
+                        help="read from a pipe of cat(1)")
+    opts = parser.parse_args()
+
+    data = make_data(opts.lines)
+    with tempfile.NamedTemporaryFile() as f:
+        f.write(data)
+        f.flush()
+        results = {}
+        for name, func in (("read(1) loop", read1_loop),
+                           ("LineReader", line_reader)):
+            count, elapsed, cpu = await run(func, data, f.name,
+                                            opts.subprocess)
+            assert count == opts.lines, (name, count)
+            results[name] = elapsed
+            print(f"{name:>14}: {count} lines, {elapsed:.3f} s"
+                  f" (cpu {cpu:.3f} s, {count / elapsed:,.0f} lines/s)")
+    speedup = results["read(1) loop"] / results["LineReader"]
+    print(f"speedup: x{speedup:.1f} ({len(data) / 1024 / 1024:.1f} MiB)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,153 @@
+"""
+Benchmark: request latency of GET /dir and GET /file
+           (gfstat before gfls/gfexport vs. the single-process probe)
+
+Fake gfstat/gfls/gfexport commands sleep DELAY seconds to simulate
+process startup and authentication with gfmd.
+
+usage: bench_probe.py [-n REQUESTS] [--delay SEC]
+"""
+import argparse
+import asyncio
+import base64
+import contextlib
+import os
+import shutil
+import tempfile
+import time
+from unittest.mock import patch
+
+import httpx
+
+import gfarm_http_gateway as gw
+
+
+FAKE_GFSTAT = """#!/bin/sh
+echo x >> "{log}"
+sleep {delay}
+cat <<EOF
+File: "$1"
+Size: 1048576         Filetype: regular file
+Mode: (0644)        Uid: ( user1)  Gid: (gfarmadm)
+Inode: 12345        Gen: 1
+Links: 1            Ncopy: 1
+Access: 2025-02-10 18:27:33.191688265 +0000
+Modify: 2025-02-10 18:27:31.071120060 +0000
+Change: 2025-02-10 18:15:09.400000000 +0900
+EOF
+"""
+
+FAKE_GFLS = """#!/bin/sh
+echo x >> "{log}"
+sleep {delay}
+for path; do :; done
+echo "-rw-r--r-- 1 user1 gfarmadm 1048576 Jun 01 09:00:00 2024 $path"
+"""
+
+FAKE_GFEXPORT = """#!/bin/sh
+echo x >> "{log}"
+sleep {delay}
+head -c 1048576 /dev/zero
+"""
+
+
+def setup_fake_commands(bindir, delay, logfile):
+    for name, script in (("gfstat", FAKE_GFSTAT),
+                         ("gfls", FAKE_GFLS),
+                         ("gfexport", FAKE_GFEXPORT)):
+        path = os.path.join(bindir, name)
+        with open(path, "w") as f:
+            f.write(script.replace("{log}", logfile)
+                    .replace("{delay}", str(delay)))
+        os.chmod(path, 0o755)
+    # set_env() passes PATH to gf* commands
+    os.environ["PATH"] = bindir + ":" + os.environ["PATH"]
+
+
+def sequential_gfls_generator(orig):
+    # the former flow of dir_list: gfstat, then gfls
+    async def wrapper(env, path, is_file, **kwargs):
+        if is_file is None:
+            _, is_file, _ = await gw.file_size(env, path)
+        async for entry in orig(env, path, is_file, **kwargs):
+            yield entry
+    return wrapper
+
+
+def sequential_file_export(orig_file_size, orig_gfexport):
+    # the former flow of file_export: gfstat, then gfexport
+    done = asyncio.Event()
+
+    async def file_size(env, path):
+        done.clear()
+        try:
+            return await orig_file_size(env, path)
+        finally:
+            done.set()
+
+    async def gfexport(env, path):
+        await done.wait()
+        return await orig_gfexport(env, path)
+
+    return (patch("gfarm_http_gateway.file_size", file_size),
+            patch("gfarm_http_gateway.gfexport", gfexport))
+
+
+def count_spawns(logfile):
+    with open(logfile) as f:
+        n = len(f.readlines())
+    open(logfile, "w").close()
+    return n
+
+
+async def measure(client, url, nreq, logfile):
+    count_spawns(logfile)
+    t0 = time.perf_counter()
+    for _ in range(nreq):
+        response = await client.get(url)
+        assert response.status_code == 200, response.text
+    elapsed = time.perf_counter() - t0
+    return elapsed / nreq, count_spawns(logfile) / nreq
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--requests", type=int, default=20)
+    parser.add_argument("--delay", type=float, default=0.05)
+    opts = parser.parse_args()
+
+    bindir = tempfile.mkdtemp()
+    logfile = os.path.join(bindir, "spawn.log")
+    open(logfile, "w").close()
+    setup_fake_commands(bindir, opts.delay, logfile)
+    gw.stat_cache.ttl = 0  # measure without the cache
+    auth = base64.b64encode(b"user1:pass1").decode()
+    headers = {"Authorization": f"Basic {auth}"}
+    transport = httpx.ASGITransport(app=gw.app)
+    try:
+        async with httpx.AsyncClient(transport=transport, headers=headers,
+                                     base_url="http://bench") as client:
+            for url, patchers in (
+                    ("/dir/bench/file.dat",
+                     (patch("gfarm_http_gateway.gfls_generator",
+                            sequential_gfls_generator(gw.gfls_generator)),)),
+                    ("/file/bench/file.dat",
+                     sequential_file_export(gw.file_size, gw.gfexport))):
+                with contextlib.ExitStack() as stack:
+                    for p in patchers:
+                        stack.enter_context(p)
+                    old, old_spawns = await measure(
+                        client, url, opts.requests, logfile)
+                new, new_spawns = await measure(
+                    client, url, opts.requests, logfile)
+                print(f"{url}:")
+                print(f"  sequential: {old * 1000:7.1f} ms/request"
+                      f" ({old_spawns:.1f} spawns)")
+                print(f"       probe: {new * 1000:7.1f} ms/request"
+                      f" ({new_spawns:.1f} spawns)")
+    finally:
+        shutil.rmtree(bindir)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
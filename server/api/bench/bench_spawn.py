@@ -0,0 +1,84 @@
+"""
+Benchmark: spawns/sec of gf_spawn() (fork vs. posix_spawn)
+
+RSS of the process is inflated by BALLAST MiB to show the cost of
+copying page tables by fork().
+
+usage: bench_spawn.py [-c CONCURRENCY ...] [-r ROUNDS] [--ballast MiB]
+"""
+import argparse
+import asyncio
+import os
+import resource
+import time
+
+import gfarm_http_gateway as gw
+
+
+def make_ballast(mib):
+    ballast = bytearray(mib * 1024 * 1024)
+    # touch each page
+    for i in range(0, len(ballast), 4096):
+        ballast[i] = 1
+    return ballast
+
+
+def rss_mib():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def request(env, rounds, spawn_times):
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        p = await gw.gf_spawn(
+            "true",
+            env=env,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE)
+        spawn_times.append(time.perf_counter() - t0)
+        await p.communicate()
+
+
+async def run(concurrency, rounds):
+    env = {"PATH": os.environ["PATH"]}
+    spawn_times = []
+    t0 = time.perf_counter()
+    await asyncio.gather(*[request(env, rounds, spawn_times)
+                           for _ in range(concurrency)])
+    elapsed = time.perf_counter() - t0
+    return len(spawn_times) / elapsed, sum(spawn_times) / len(spawn_times)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", "--concurrency", type=int, nargs="+",
+                        default=[50, 200, 1000])
+    parser.add_argument("-r", "--rounds", type=int, default=3,
+                        help="spawns per concurrent request")
+    parser.add_argument("--ballast", type=int, default=1024,
+                        help="MiB to add to RSS")
+    opts = parser.parse_args()
+
+    # 3 pipes (6 fds) per process at most
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    # measure spawns without admission control
+    gw.spawn_limiter.max_total = 0
+    gw.spawn_limiter.max_per_user = 0
+
+    ballast = make_ballast(opts.ballast)
+    print(f"RSS: {rss_mib():.0f} MiB")
+    for concurrency in opts.concurrency:
+        for name, posix_spawn in (("fork", False), ("posix_spawn", True)):
+            gw.POSIX_SPAWN = posix_spawn
+            rate, latency = await run(concurrency, opts.rounds)
+            print(f"concurrency {concurrency:5d}: {name:>11}:"
+                  f" {rate:8.1f} spawns/s"
+                  f" (spawn call {latency * 1000:.2f} ms)")
+    del ballast
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,155 @@
+"""
+Benchmark: event loop latency during concurrent GET /file
+           (GFARM_HTTP_ASYNC_GFEXPORT=yes vs. no, and the former
+            sync mode reading the pipe on the event loop)
+
+A fake gfexport writes SIZE MiB in 1 MiB chunks with a short sleep
+between chunks like a slow file system node.
+
+usage: bench_sync_gfexport.py [-c CONCURRENCY] [-s SIZE]
+"""
+import argparse
+import asyncio
+import base64
+import contextlib
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from unittest.mock import patch
+
+import httpx
+
+import gfarm_http_gateway as gw
+
+
+FAKE_GFSTAT = """#!/bin/sh
+cat <<EOF
+File: "$1"
+Size: {size}         Filetype: regular file
+Mode: (0644)        Uid: ( user1)  Gid: (gfarmadm)
+Inode: 12345        Gen: 1
+Links: 1            Ncopy: 1
+Access: 2025-02-10 18:27:33.191688265 +0000
+Modify: 2025-02-10 18:27:31.071120060 +0000
+Change: 2025-02-10 18:15:09.400000000 +0900
+EOF
+"""
+
+FAKE_GFEXPORT = """#!/bin/sh
+i=0
+while [ $i -lt {mib} ]; do
+    head -c 1048576 /dev/zero
+    sleep 0.01
+    i=$((i + 1))
+done
+"""
+
+TICK = 0.005
+
+
+class BlockingPipeReader:
+    # the former sync mode: read the pipe on the event loop
+    def __init__(self, f, executor, first_size=1, size=gw.BUFSIZE,
+                 maxsize=None):
+        self._f = f
+        self._n = first_size
+        self._size = size
+
+    async def read(self):
+        d = self._f.read(self._n)
+        self._n = self._size
+        return d
+
+    async def close(self):
+        pass
+
+
+async def blocking_wait(p):
+    return p.wait()
+
+
+def setup_fake_commands(bindir, mib):
+    for name, script in (("gfstat", FAKE_GFSTAT), ("gfexport", FAKE_GFEXPORT)):
+        path = os.path.join(bindir, name)
+        with open(path, "w") as f:
+            f.write(script.replace("{size}", str(mib * 1024 * 1024))
+                    .replace("{mib}", str(mib)))
+        os.chmod(path, 0o755)
+    # set_env() passes PATH to gf* commands
+    os.environ["PATH"] = bindir + ":" + os.environ["PATH"]
+
+
+async def ticker(lags, stop):
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - t0 - TICK)
+
+
+async def download(client, url):
+    nbytes = 0
+    async with client.stream("GET", url) as response:
+        assert response.status_code == 200, response.status_code
+        async for chunk in response.aiter_raw():
+            nbytes += len(chunk)
+    return nbytes
+
+
+async def run(client, concurrency):
+    lags = []
+    stop = asyncio.Event()
+    tick_task = asyncio.create_task(ticker(lags, stop))
+    t0 = time.perf_counter()
+    await asyncio.gather(*[download(client, f"/file/bench/{i}.dat")
+                           for i in range(concurrency)])
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    await tick_task
+    lags.sort()
+    p99 = lags[int(len(lags) * 0.99)]
+    return elapsed, statistics.mean(lags), p99, lags[-1]
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", "--concurrency", type=int, default=8)
+    parser.add_argument("-s", "--size", type=int, default=64,
+                        help="MiB per download")
+    opts = parser.parse_args()
+
+    bindir = tempfile.mkdtemp()
+    setup_fake_commands(bindir, opts.size)
+    gw.stat_cache.ttl = 0
+    auth = base64.b64encode(b"user1:pass1").decode()
+    headers = {"Authorization": f"Basic {auth}"}
+    transport = httpx.ASGITransport(app=gw.app)
+    try:
+        async with httpx.AsyncClient(transport=transport, headers=headers,
+                                     base_url="http://bench",
+                                     timeout=None) as client:
+            for name, async_gfexport, blocking in (
+                    ("async", True, False),
+                    ("sync", False, False),
+                    ("sync (former)", False, True)):
+                gw.ASYNC_GFEXPORT = async_gfexport
+                with contextlib.ExitStack() as stack:
+                    if blocking:
+                        stack.enter_context(patch(
+                            "gfarm_http_gateway.ThreadedPipeReader",
+                            BlockingPipeReader))
+                        stack.enter_context(patch(
+                            "gfarm_http_gateway.sync_wait", blocking_wait))
+                    elapsed, mean, p99, worst = await run(
+                        client, opts.concurrency)
+                print(f"{name:>13}: {opts.concurrency} x {opts.size} MiB"
+                      f" in {elapsed:.2f} s,"
+                      f" event loop lag: mean {mean * 1000:.2f} ms,"
+                      f" p99 {p99 * 1000:.2f} ms, max {worst * 1000:.2f} ms")
+    finally:
+        shutil.rmtree(bindir)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
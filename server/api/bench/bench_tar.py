@@ -0,0 +1,91 @@
+"""
+Benchmark: POST /tar (tar, gzip, zstd) vs. POST /zip (deflate, store)
+
+The same fake commands as bench_zip.py: many small files, and a large
+text file of BIG MiB.
+
+usage: bench_tar.py [-n FILES] [-s SIZE] [-l LATENCY] [-b BIG]
+"""
+import argparse
+import asyncio
+import base64
+import os
+import shutil
+import tempfile
+import time
+
+import httpx
+
+import gfarm_http_gateway as gw
+from bench_zip import setup_fake_commands
+
+MODES = (
+    ("zip (deflate)", "/zip", {}),
+    ("zip (store)", "/zip", {"store": True}),
+    ("tar", "/tar", {}),
+    ("tar (gzip)", "/tar", {"compression": "gzip"}),
+    ("tar (zstd)", "/tar", {"compression": "zstd"}),
+)
+
+
+async def download(client, url, form):
+    nbytes = 0
+    data = {"paths": ["/bench"], **form}
+    async with client.stream("POST", url, data=data) as response:
+        assert response.status_code == 200, response.status_code
+        async for chunk in response.aiter_raw():
+            nbytes += len(chunk)
+    return nbytes
+
+
+async def run(client):
+    for name, url, form in MODES:
+        if (form.get("compression") == "zstd"
+                and shutil.which("zstd") is None):
+            continue
+        t0 = time.perf_counter()
+        nbytes = await download(client, url, form)
+        elapsed = time.perf_counter() - t0
+        print(f"  {name:>13}: {elapsed:7.2f} s, {nbytes:12d} bytes")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--files", type=int, default=10000)
+    parser.add_argument("-s", "--size", type=int, default=4096,
+                        help="bytes per file")
+    parser.add_argument("-l", "--latency", type=float, default=5,
+                        help="ms before gfexport writes")
+    parser.add_argument("-b", "--big", type=int, default=256,
+                        help="MiB of the large file")
+    opts = parser.parse_args()
+
+    bindir = tempfile.mkdtemp()
+    # set_env() passes PATH to gf* commands
+    os.environ["PATH"] = bindir + ":" + os.environ["PATH"]
+    gw.stat_cache.ttl = 0
+    gw.spawn_limiter.max_per_user = 0
+    auth = base64.b64encode(b"user1:pass1").decode()
+    headers = {"Authorization": f"Basic {auth}"}
+    transport = httpx.ASGITransport(app=gw.app)
+    try:
+        async with httpx.AsyncClient(transport=transport, headers=headers,
+                                     base_url="http://bench",
+                                     timeout=None) as client:
+            setup_fake_commands(bindir, opts.files, opts.size,
+                                opts.latency)
+            print(f"{opts.files} files x {opts.size} bytes,"
+                  f" gfexport latency {opts.latency} ms")
+            await run(client)
+
+            size = opts.big * 1024 * 1024
+            data = base64.b64encode(os.urandom(size * 3 // 4))
+            setup_fake_commands(bindir, 1, len(data), 0, data)
+            print(f"1 file x {opts.big} MiB (text)")
+            await run(client)
+    finally:
+        shutil.rmtree(bindir)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,188 @@
+"""
+Benchmark: throughput of GET /file, PUT /file and POST /copy
+           (StreamReader/StreamWriter pipes vs. transfer pipes,
+            and splice() for POST /copy)
+
+Fake gfexport writes SIZE MiB of zeros and fake gfreg discards its
+input, so the gateway is the bottleneck.
+
+Allocations are buffer objects (bytes) created to receive data from
+pipes: os.read() (asyncio pipe transports and PipeReader.read()) and
+StreamReader.read().  readinto() of pooled buffers allocates nothing.
+
+usage: bench_transfer.py [-n REQUESTS] [-s SIZE]
+"""
+import argparse
+import asyncio
+import base64
+import contextlib
+import os
+import shutil
+import tempfile
+import time
+from unittest.mock import patch
+
+import httpx
+
+import gfarm_http_gateway as gw
+
+
+FAKE_GFSTAT = """#!/bin/sh
+cat <<EOF
+File: "$1"
+Size: {size}         Filetype: regular file
+Mode: (0644)        Uid: ( user1)  Gid: (gfarmadm)
+Inode: 12345        Gen: 1
+Links: 1            Ncopy: 1
+Access: 2025-02-10 18:27:33.191688265 +0000
+Modify: 2025-02-10 18:27:31.071120060 +0000
+Change: 2025-02-10 18:15:09.400000000 +0900
+EOF
+"""
+
+FAKE_GFEXPORT = """#!/bin/sh
+exec head -c {size} /dev/zero
+"""
+
+FAKE_GFREG = """#!/bin/sh
+exec cat > /dev/null
+"""
+
+FAKE_TRUE = """#!/bin/sh
+exit 0
+"""
+
+
+def setup_fake_commands(bindir, size):
+    for name, script in (("gfstat", FAKE_GFSTAT),
+                         ("gfexport", FAKE_GFEXPORT),
+                         ("gfreg", FAKE_GFREG),
+                         ("gfmv", FAKE_TRUE),
+                         ("gfcksum", FAKE_TRUE)):
+        path = os.path.join(bindir, name)
+        with open(path, "w") as f:
+            f.write(script.replace("{size}", str(size)))
+        os.chmod(path, 0o755)
+    # set_env() passes PATH to gf* commands
+    os.environ["PATH"] = bindir + ":" + os.environ["PATH"]
+
+
+class AllocationCounter:
+    def __init__(self):
+        self.count = 0
+        self._os_read = os.read
+        self._stream_read = asyncio.StreamReader.read
+
+    def os_read(self, fd, n):
+        data = self._os_read(fd, n)
+        if data:
+            self.count += 1
+        return data
+
+    async def stream_read(self, reader, n=-1):
+        data = await self._stream_read(reader, n)
+        if data:
+            self.count += 1
+        return data
+
+    @contextlib.contextmanager
+    def counting(self):
+        counter = self
+
+        async def stream_read(reader, n=-1):
+            return await counter.stream_read(reader, n)
+
+        with patch("os.read", self.os_read), \
+             patch.object(asyncio.StreamReader, "read", stream_read):
+            yield
+
+
+def stream_pipes(orig):
+    # the former pipes: StreamReader/StreamWriter of the default size
+    async def gf_spawn(command, *args, env, stdin, stdout, stderr):
+        if stdin is gw.TRANSFER_PIPE:
+            stdin = asyncio.subprocess.PIPE
+        if stdout is gw.TRANSFER_PIPE:
+            stdout = asyncio.subprocess.PIPE
+        return await orig(command, *args, env=env, stdin=stdin,
+                          stdout=stdout, stderr=stderr)
+    return patch("gfarm_http_gateway.gf_spawn", gf_spawn)
+
+
+async def download(client, size):
+    nbytes = 0
+    async with client.stream("GET", "/file/bench/src.dat") as response:
+        assert response.status_code == 200, response.status_code
+        async for chunk in response.aiter_raw():
+            nbytes += len(chunk)
+    assert nbytes == size, nbytes
+
+
+async def upload(client, size):
+    chunk = bytes(gw.BUFSIZE)
+
+    async def body():
+        for _ in range(size // len(chunk)):
+            yield chunk
+
+    response = await client.put("/file/bench/dst.dat", content=body())
+    assert response.status_code == 200, response.text
+
+
+async def copy(client, size):
+    response = await client.post("/copy", json={
+        "source": "/bench/src.dat", "destination": "/bench/dst.dat"})
+    assert response.status_code == 200, response.text
+    assert '"done": true' in response.text, response.text
+
+
+async def measure(client, func, nreq, size):
+    counter = AllocationCounter()
+    t0 = time.perf_counter()
+    with counter.counting():
+        for _ in range(nreq):
+            await func(client, size)
+    elapsed = time.perf_counter() - t0
+    total = nreq * size
+    return total / elapsed / 1e6, counter.count / (total / 1e9)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--requests", type=int, default=4)
+    parser.add_argument("-s", "--size", type=int, default=256,
+                        help="MiB per request")
+    opts = parser.parse_args()
+    size = opts.size * 1024 * 1024
+
+    bindir = tempfile.mkdtemp()
+    setup_fake_commands(bindir, size)
+    gw.stat_cache.ttl = 0
+    auth = base64.b64encode(b"user1:pass1").decode()
+    headers = {"Authorization": f"Basic {auth}"}
+    transport = httpx.ASGITransport(app=gw.app)
+    try:
+        async with httpx.AsyncClient(transport=transport, headers=headers,
+                                     base_url="http://bench",
+                                     timeout=None) as client:
+            for name, func in (("download", download),
+                               ("upload", upload),
+                               ("copy", copy)):
+                print(f"{name}: {opts.requests} x {opts.size} MiB")
+                modes = [("stream pipes", stream_pipes(gw.gf_spawn)),
+                         ("transfer pipes", patch.object(
+                             gw.splice_copier, "max_threads", 0))]
+                if func is copy:
+                    modes.append(("splice", contextlib.nullcontext()))
+                for mode, patcher in modes:
+                    with patcher:
+                        rate, allocs = await measure(
+                            client, func, opts.requests, size)
+                    print(f"  {mode:>14}: {rate:8.1f} MB/s,"
+                          f" {allocs:8.0f} allocations/GB")
+    finally:
+        shutil.rmtree(bindir)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
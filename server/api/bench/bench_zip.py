@@ -0,0 +1,216 @@
+"""
+Benchmark: POST /zip
+  - a directory of many small files
+    (GFARM_HTTP_ZIP_PREFETCH_FILES=0 vs. read-ahead)
+  - a large file: event loop lag while deflating
+    (on the event loop vs. in a thread, and store)
+  - a slow client: peak memory of the buffered archive
+    (GFARM_HTTP_ZIP_BUFFER_CHUNKS unlimited vs. limited)
+
+Fake gfls lists FILES files of SIZE bytes, and fake gfexport sleeps
+LATENCY ms (gfmd RPCs and the connection to gfsd) before writing the
+file.  The large file is text (base64) of BIG MiB.  The slow client
+reads a chunk every SLOW ms over TCP from uvicorn (ASGITransport
+buffers whole responses).
+
+usage: bench_zip.py [-n FILES] [-s SIZE] [-l LATENCY] [-d DEPTH ...]
+                    [-b BIG] [-w SLOW]
+"""
+import argparse
+import asyncio
+import base64
+import contextlib
+import os
+import shutil
+import statistics
+import tempfile
+import time
+import tracemalloc
+from unittest.mock import patch
+
+import httpx
+import uvicorn
+
+import gfarm_http_gateway as gw
+
+
+FAKE_GFSTAT = """#!/bin/sh
+cat <<EOF
+File: "$1"
+Size: 0             Filetype: directory
+Mode: (0755)        Uid: ( user1)  Gid: (gfarmadm)
+Inode: 12345        Gen: 1
+Links: 2            Ncopy: 1
+Access: 2025-02-10 18:27:33.191688265 +0000
+Modify: 2025-02-10 18:27:31.071120060 +0000
+Change: 2025-02-10 18:15:09.400000000 +0900
+EOF
+"""
+
+FAKE_GFLS = """#!/bin/sh
+exec cat {listing}
+"""
+
+FAKE_GFEXPORT = """#!/bin/sh
+{sleep}
+if [ -f {data} ]; then
+    exec cat {data}
+fi
+exec head -c {size} /dev/zero
+"""
+
+ENTRY = "{mode} 1 user1 gfarmadm {size} Feb 10 18:27:31 2025 {name}\n"
+
+TICK = 0.005
+
+
+def setup_fake_commands(bindir, nfiles, size, latency, data=None):
+    # data: contents of the files (default: zeros)
+    listing = os.path.join(bindir, "listing")
+    with open(listing, "w") as f:
+        for name in (".", ".."):
+            f.write(ENTRY.format(mode="drwxr-xr-x", size=0, name=name))
+        for i in range(nfiles):
+            f.write(ENTRY.format(mode="-rw-r--r--", size=size,
+                                 name=f"f{i:06d}"))
+    datafile = os.path.join(bindir, "data")
+    if data is not None:
+        with open(datafile, "wb") as f:
+            f.write(data)
+    elif os.path.exists(datafile):
+        os.remove(datafile)
+    sleep = f"sleep {latency / 1000}" if latency > 0 else ""
+    for name, script in (("gfstat", FAKE_GFSTAT),
+                         ("gfls", FAKE_GFLS),
+                         ("gfexport", FAKE_GFEXPORT)):
+        path = os.path.join(bindir, name)
+        with open(path, "w") as f:
+            f.write(script.replace("{listing}", listing)
+                    .replace("{sleep}", sleep)
+                    .replace("{data}", datafile)
+                    .replace("{size}", str(size)))
+        os.chmod(path, 0o755)
+
+
+async def ticker(lags, stop):
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - t0 - TICK)
+
+
+async def inline(func, *args, **kwargs):
+    # the former mode: deflate on the event loop
+    return func(*args, **kwargs)
+
+
+async def download(client, form=None, slow=0):
+    nbytes = 0
+    data = {"paths": ["/bench"], **(form or {})}
+    async with client.stream("POST", "/zip", data=data) as response:
+        assert response.status_code == 200, response.status_code
+        async for chunk in response.aiter_raw():
+            nbytes += len(chunk)
+            if slow > 0:
+                await asyncio.sleep(slow / 1000)
+    return nbytes
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--files", type=int, default=10000)
+    parser.add_argument("-s", "--size", type=int, default=4096,
+                        help="bytes per file")
+    parser.add_argument("-l", "--latency", type=float, default=5,
+                        help="ms before gfexport writes")
+    parser.add_argument("-d", "--depth", type=int, nargs="+",
+                        default=[0, 8, 32],
+                        help="GFARM_HTTP_ZIP_PREFETCH_FILES")
+    parser.add_argument("-b", "--big", type=int, default=256,
+                        help="MiB of the large file")
+    parser.add_argument("-w", "--slow", type=float, default=20,
+                        help="ms for the slow client to read a chunk")
+    opts = parser.parse_args()
+
+    bindir = tempfile.mkdtemp()
+    # set_env() passes PATH to gf* commands
+    os.environ["PATH"] = bindir + ":" + os.environ["PATH"]
+    setup_fake_commands(bindir, opts.files, opts.size, opts.latency)
+    gw.stat_cache.ttl = 0
+    gw.spawn_limiter.max_per_user = 0
+    auth = base64.b64encode(b"user1:pass1").decode()
+    headers = {"Authorization": f"Basic {auth}"}
+    transport = httpx.ASGITransport(app=gw.app)
+    print(f"{opts.files} files x {opts.size} bytes,"
+          f" gfexport latency {opts.latency} ms")
+    try:
+        async with httpx.AsyncClient(transport=transport, headers=headers,
+                                     base_url="http://bench",
+                                     timeout=None) as client:
+            for depth in opts.depth:
+                gw.ZIP_PREFETCH_FILES = depth
+                t0 = time.perf_counter()
+                nbytes = await download(client)
+                elapsed = time.perf_counter() - t0
+                print(f"  read-ahead {depth:3d} files:"
+                      f" {elapsed:7.2f} s,"
+                      f" {opts.files / elapsed:8.1f} files/s"
+                      f" ({nbytes} bytes)")
+
+            size = opts.big * 1024 * 1024
+            data = base64.b64encode(os.urandom(size * 3 // 4))
+            setup_fake_commands(bindir, 1, len(data), 0, data)
+            print(f"1 file x {opts.big} MiB (text)")
+            for name, form, patcher in (
+                    ("deflate (event loop)", None,
+                     patch("asyncio.to_thread", inline)),
+                    ("deflate (thread)", None, contextlib.nullcontext()),
+                    ("store", {"store": True}, contextlib.nullcontext())):
+                lags = []
+                stop = asyncio.Event()
+                tick_task = asyncio.create_task(ticker(lags, stop))
+                t0 = time.perf_counter()
+                with patcher:
+                    nbytes = await download(client, form)
+                elapsed = time.perf_counter() - t0
+                stop.set()
+                await tick_task
+                lags.sort()
+                print(f"  {name:>20}: {elapsed:6.2f} s,"
+                      f" {nbytes / elapsed / 1e6:7.1f} MB/s,"
+                      f" event loop lag: mean"
+                      f" {statistics.mean(lags) * 1000:.2f} ms,"
+                      f" max {lags[-1] * 1000:.2f} ms")
+
+        server = uvicorn.Server(uvicorn.Config(
+            gw.app, host="127.0.0.1", port=0, log_level="warning"))
+        server_task = asyncio.create_task(server.serve())
+        while not server.started:
+            await asyncio.sleep(0.01)
+        port = server.servers[0].sockets[0].getsockname()[1]
+        async with httpx.AsyncClient(headers=headers,
+                                     base_url=f"http://127.0.0.1:{port}",
+                                     timeout=None) as client:
+            print(f"slow client: 1 file x {opts.big} MiB (store),"
+                  f" {opts.slow} ms per chunk")
+            for max_chunks in (2 ** 30, 16, 4):
+                gw.ZIP_BUFFER_CHUNKS = max_chunks
+                tracemalloc.start()
+                t0 = time.perf_counter()
+                nbytes = await download(client, {"store": True},
+                                        opts.slow)
+                elapsed = time.perf_counter() - t0
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                name = ("unlimited" if max_chunks == 2 ** 30
+                        else f"{max_chunks} chunks")
+                print(f"  {name:>20}: {elapsed:6.2f} s,"
+                      f" peak memory {peak / 1024 / 1024:7.1f} MiB")
+        server.should_exit = True
+        await server_task
+    finally:
+        shutil.rmtree(bindir)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,10 +1,18 @@
 import asyncio
 import base64
 import bz2
+import concurrent.futures
+import contextlib
+import contextvars
+import email.utils
 from datetime import datetime
+import fcntl
+import functools
 import gzip
+import hashlib
 import json
 import logging
+import math
 import mimetypes
 import os
 from pprint import pformat as pf
@@ -26,12 +34,15 @@ from typing import (
     Callable)
 import urllib
 import re
+import tarfile
 import tempfile
 import shutil
 import zipfile
-from collections import deque
+import zlib
+from collections import deque, OrderedDict
 import threading
 import stat
+import struct
 
 from loguru import logger
 
@@ -54,6 +65,7 @@ from fastapi.responses import (PlainTextResponse,
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from starlette.middleware.sessions import SessionMiddleware
+from starlette.requests import ClientDisconnect
 
 from cryptography.fernet import Fernet
 
@@ -169,8 +181,31 @@ conf_required_keys = [
     "GFARM_HTTP_SASL_MECHANISM_FOR_PASSWORD",
     "GFARM_HTTP_ALLOW_ANONYMOUS",
     "GFARM_HTTP_ASYNC_GFEXPORT",
+    "GFARM_HTTP_SYNC_GFEXPORT_THREADS",
+    "GFARM_HTTP_PIPE_SIZE",
+    "GFARM_HTTP_COPY_SPLICE_THREADS",
+    "GFARM_HTTP_COPY_PARALLEL",
+    "GFARM_HTTP_BATCH_CONCURRENCY",
+    "GFARM_HTTP_ZIP_PREFETCH_FILES",
+    "GFARM_HTTP_ZIP_PREFETCH_SIZE",
+    "GFARM_HTTP_ZIP_BUFFER_CHUNKS",
     "GFARM_HTTP_SESSION_MAX_AGE",
     "GFARM_HTTP_RECURSIVE_MAX_DEPTH",
+    "GFARM_HTTP_DIR_SNAPSHOT_TTL",
+    "GFARM_HTTP_DIR_SNAPSHOT_MAX_PER_USER",
+    "GFARM_HTTP_STAT_CACHE_TTL",
+    "GFARM_HTTP_STAT_CACHE_SIZE",
+    "GFARM_HTTP_POSIX_SPAWN",
+    "GFARM_HTTP_SPAWN_MAX",
+    "GFARM_HTTP_SPAWN_MAX_PER_USER",
+    "GFARM_HTTP_SPAWN_QUEUE_SIZE",
+    "GFARM_HTTP_SPAWN_QUEUE_TIMEOUT",
+    "GFARM_HTTP_CONTENT_CACHE_DIR",
+    "GFARM_HTTP_CONTENT_CACHE_SIZE",
+    "GFARM_HTTP_CONTENT_CACHE_MAX_FILE_SIZE",
+    "GFARM_HTTP_UPLOAD_DIR",
+    "GFARM_HTTP_UPLOAD_TTL",
+    "GFARM_HTTP_UPLOAD_DIGEST_TYPE",
     "GFARM_HTTP_TMPDIR"
 ]
 
@@ -193,6 +228,16 @@ del env_dict
 del conf_dict
 del merged_dict
 
+
+def conf_int(key, default):
+    value = getattr(conf, key)
+    try:
+        return int(value)
+    except Exception as e:
+        logger.warning(f"Invalid value for {key}: {str(e)}")
+        return default
+
+
 GFARM_HTTP_DEBUG = str2bool(conf.GFARM_HTTP_DEBUG)
 GFARM_CONFIG_FILE = str2none(conf.GFARM_HTTP_GFARM_CONFIG_FILE)
 
@@ -253,6 +298,52 @@ except Exception as e:
     logger.warning("Invalid value for SESSION_MAX_AGE: " + {str(e)})
     RECURSIVE_MAX_DEPTH = 16
 
+# sec.
+DIR_SNAPSHOT_TTL = conf_int("GFARM_HTTP_DIR_SNAPSHOT_TTL", 60)
+DIR_SNAPSHOT_MAX_PER_USER = conf_int(
+    "GFARM_HTTP_DIR_SNAPSHOT_MAX_PER_USER", 4)
+
+# sec. (0: disable the cache)
+STAT_CACHE_TTL = conf_int("GFARM_HTTP_STAT_CACHE_TTL", 5)
+STAT_CACHE_SIZE = conf_int("GFARM_HTTP_STAT_CACHE_SIZE", 10000)
+
+POSIX_SPAWN = str2bool(conf.GFARM_HTTP_POSIX_SPAWN)
+
+# number of gf* processes (0: unlimited)
+SPAWN_MAX = conf_int("GFARM_HTTP_SPAWN_MAX", 256)
+SPAWN_MAX_PER_USER = conf_int("GFARM_HTTP_SPAWN_MAX_PER_USER", 32)
+SPAWN_QUEUE_SIZE = conf_int("GFARM_HTTP_SPAWN_QUEUE_SIZE", 1024)
+# sec. (0: no timeout)
+SPAWN_QUEUE_TIMEOUT = conf_int("GFARM_HTTP_SPAWN_QUEUE_TIMEOUT", 30)
+
+# KiB (0: the default size of the OS)
+PIPE_SIZE = conf_int("GFARM_HTTP_PIPE_SIZE", 1024)
+# copies by splice() at the same time (0: disable splice)
+COPY_SPLICE_THREADS = conf_int("GFARM_HTTP_COPY_SPLICE_THREADS", 16)
+
+COPY_PARALLEL = conf_int("GFARM_HTTP_COPY_PARALLEL", 8)
+
+BATCH_CONCURRENCY = conf_int("GFARM_HTTP_BATCH_CONCURRENCY", 8)
+
+# files read ahead by /zip and /tar (0: disable)
+ZIP_PREFETCH_FILES = conf_int("GFARM_HTTP_ZIP_PREFETCH_FILES", 8)
+# MiB
+ZIP_PREFETCH_SIZE = conf_int("GFARM_HTTP_ZIP_PREFETCH_SIZE", 64)
+# chunks of BUFSIZE buffered for a /zip response
+ZIP_BUFFER_CHUNKS = conf_int("GFARM_HTTP_ZIP_BUFFER_CHUNKS", 16)
+
+CONTENT_CACHE_DIR = str2none(conf.GFARM_HTTP_CONTENT_CACHE_DIR)
+# MiB
+CONTENT_CACHE_SIZE = conf_int("GFARM_HTTP_CONTENT_CACHE_SIZE", 1024)
+CONTENT_CACHE_MAX_FILE_SIZE = conf_int(
+    "GFARM_HTTP_CONTENT_CACHE_MAX_FILE_SIZE", 256)
+
+UPLOAD_DIR = conf.GFARM_HTTP_UPLOAD_DIR
+# sec.
+UPLOAD_TTL = conf_int("GFARM_HTTP_UPLOAD_TTL", 60 * 60 * 24)
+# None: the digest type of Gfarm
+UPLOAD_DIGEST_TYPE = str2none(conf.GFARM_HTTP_UPLOAD_DIGEST_TYPE)
+
 TMPDIR = conf.GFARM_HTTP_TMPDIR
 
 
@@ -275,6 +366,15 @@ def conf_check_invalid():
        and OIDC_REDIRECT_URI_PAGE != "auth":
         logger.error("INVALID: GFARM_HTTP_OIDC_REDIRECT_URI_PAGE")
         error = True
+    if COPY_PARALLEL < 1:
+        logger.error("INVALID: GFARM_HTTP_COPY_PARALLEL")
+        error = True
+    if BATCH_CONCURRENCY < 1:
+        logger.error("INVALID: GFARM_HTTP_BATCH_CONCURRENCY")
+        error = True
+    if ZIP_BUFFER_CHUNKS < 1:
+        logger.error("INVALID: GFARM_HTTP_ZIP_BUFFER_CHUNKS")
+        error = True
     if error:
         exit_error()
 
@@ -458,8 +558,12 @@ app.add_middleware(
     allow_origins=ORIGINS,
     allow_credentials=True,
     # allow_methods=["*"],
-    allow_methods=["GET", "POST", "PUT", "DELETE"],
+    allow_methods=["GET", "POST", "PUT", "DELETE", "PATCH"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Total-Count",
+                    "Accept-Ranges", "Content-Range", "ETag",
+                    "Location", "Upload-Offset", "Upload-Length",
+                    "Repr-Digest"],
 )
 
 # https://www.starlette.io/middleware/#sessionmiddleware
@@ -1406,6 +1510,15 @@ def parse_gfstat(file_info_str):
     return Stat.model_validate(file_info)  # Pydantic V2
 
 
+GFSTAT_RECORD = re.compile(r"^(?=\s*File:)", re.MULTILINE)
+
+
+def parse_gfstats(stdout):
+    # output of gfstat for multiple paths: a record begins with "File:"
+    return [parse_gfstat(record)
+            for record in GFSTAT_RECORD.split(stdout) if record.strip()]
+
+
 def from_rwx(rwx, highchar):
     perm = 0
     highbit = 0
@@ -1530,9 +1643,596 @@ def parse_gfcksum(data):
 
 
 #############################################################################
+# Spawn gf* commands
+#
+# fork() of this process copies its page tables, so it gets slower as
+# RSS grows.  subprocess uses posix_spawn() (vfork semantics) instead
+# when the executable is an absolute path and close_fds is False.
+# close_fds is not needed because Python opens every fd as
+# non-inheritable (PEP 446).
+
+@functools.lru_cache(maxsize=256)
+def gf_executable(command, path):
+    return shutil.which(command, path=path)
+
+
+def spawn_kwargs(command, env):
+    if POSIX_SPAWN:
+        executable = gf_executable(command, env.get("PATH", os.defpath))
+        if executable is not None:
+            return {"executable": executable, "close_fds": False}
+    # ex. not found: raise FileNotFoundError as usual
+    return {"close_fds": True}
+
+
+class SpawnRejected(HTTPException):
+    pass
+
+
+class SpawnLimiter:
+    """
+    Admission control of gf* processes.
+
+    A process starts while the number of running processes is below
+    the global limit and the per-user limit.  Otherwise the request
+    waits in a FIFO queue until a process exits.  A waiter blocked only
+    by its per-user limit does not block the waiters of other users.
+
+    When the queue is full, the request is rejected with 429 (the user
+    has reached the per-user limit) or 503, and with 503 when it has
+    waited longer than the timeout.  (0: unlimited)
+    """
+    def __init__(self, max_total: int, max_per_user: int,
+                 queue_size: int, timeout: int):
+        self.max_total = max_total
+        self.max_per_user = max_per_user
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.running = 0
+        self.running_per_user = {}
+        self._waiters = deque()  # (user, n, future)
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = {429: 0, 503: 0}
+        self.max_queue_depth = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.wait_time_avg = 0.0  # exponential moving average
+
+    def _admissible(self, user, n=1):
+        if 0 < self.max_total < self.running + n:
+            return False
+        return not (0 < self.max_per_user
+                    < self.running_per_user.get(user, 0) + n)
+
+    def _start(self, user, n=1):
+        self.running += n
+        self.running_per_user[user] = self.running_per_user.get(user, 0) + n
+        self.admitted += 1
+
+    def release(self, user, n=1):
+        if n <= 0:
+            return
+        self.running -= n
+        remaining = self.running_per_user.pop(user) - n
+        if remaining > 0:
+            self.running_per_user[user] = remaining
+        for waiter in list(self._waiters):
+            if 0 < self.max_total <= self.running:
+                break
+            wuser, wn, fut = waiter
+            if fut.done():  # timeout or cancelled
+                continue
+            if self._admissible(wuser, wn):
+                self._waiters.remove(waiter)
+                self._start(wuser, wn)
+                fut.set_result(None)
+
+    def available(self, user):
+        """
+        Return the number of processes the user can start now, or None
+        if unlimited.
+        """
+        limits = []
+        if self.max_total > 0:
+            limits.append(self.max_total - self.running)
+        if self.max_per_user > 0:
+            limits.append(self.max_per_user
+                          - self.running_per_user.get(user, 0))
+        return max(0, min(limits)) if limits else None
+
+    def _reject(self, code, user, message):
+        self.rejected[code] += 1
+        logger.warning(f"gf* process admission: user={user}: {message}"
+                       f" (running={self.running},"
+                       f" queued={len(self._waiters)})")
+        retry_after = max(1, math.ceil(self.wait_time_avg))
+        return SpawnRejected(
+            status_code=code,
+            detail=message,
+            headers={"Retry-After": str(retry_after)})
+
+    async def acquire(self, user, n=1):
+        if self._admissible(user, n):
+            self._start(user, n)
+            return
+        if len(self._waiters) >= self.queue_size:
+            if not (0 < self.max_total <= self.running):
+                code = status.HTTP_429_TOO_MANY_REQUESTS
+            else:
+                code = status.HTTP_503_SERVICE_UNAVAILABLE
+            raise self._reject(code, user, "Too many requests")
+
+        fut = asyncio.get_running_loop().create_future()
+        waiter = (user, n, fut)
+        self._waiters.append(waiter)
+        self.queued += 1
+        self.max_queue_depth = max(self.max_queue_depth, len(self._waiters))
+        t0 = time.monotonic()
+        try:
+            await asyncio.wait_for(fut, self.timeout or None)
+        except BaseException as e:
+            if fut.done() and not fut.cancelled():
+                self.release(user, n)  # admitted, but not used
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                raise self._reject(status.HTTP_503_SERVICE_UNAVAILABLE,
+                                   user, "Timeout waiting for a process")
+            raise
+        finally:
+            wait_time = time.monotonic() - t0
+            self.wait_time_total += wait_time
+            self.wait_time_max = max(self.wait_time_max, wait_time)
+            self.wait_time_avg = self.wait_time_avg * 0.9 + wait_time * 0.1
+
+    async def reserve(self, user, n):
+        """
+        Acquire n slots at once, and return a SpawnReservation of them.
+        n is capped by the limits.
+        """
+        if self.max_per_user > 0:
+            n = min(n, self.max_per_user)
+        if self.max_total > 0:
+            n = min(n, self.max_total)
+        await self.acquire(user, n)
+        return SpawnReservation(self, user, n)
+
+    def stats(self):
+        return {
+            "running": self.running,
+            "running_users": len(self.running_per_user),
+            "queue_depth": len(self._waiters),
+            "max_queue_depth": self.max_queue_depth,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected_429": self.rejected[429],
+            "rejected_503": self.rejected[503],
+            "wait_time_total": round(self.wait_time_total, 3),
+            "wait_time_max": round(self.wait_time_max, 3),
+            "wait_time_avg": round(self.wait_time_avg, 3),
+        }
+
+
+class SpawnReservation:
+    """
+    Slots of SpawnLimiter reserved at once for the processes running
+    together in a pipeline.  Acquiring them one by one while holding
+    the others can deadlock when many pipelines of a user wait for the
+    per-user limit.  gf_spawn() in use() takes a reserved slot first,
+    and the slot returns to the reservation when the process exits.
+    """
+    def __init__(self, limiter, user, n):
+        self.limiter = limiter
+        self.user = user
+        self.free = n
+        self.closed = False
+
+    def take(self, user):
+        if self.closed or user != self.user or self.free <= 0:
+            return False
+        self.free -= 1
+        return True
+
+    def put_back(self):
+        if self.closed:
+            self.limiter.release(self.user)
+        else:
+            self.free += 1
+
+    def close(self):
+        # the slots of running processes are released when they exit
+        if not self.closed:
+            self.closed = True
+            self.limiter.release(self.user, self.free)
+            self.free = 0
+
+    @contextlib.contextmanager
+    def use(self):
+        token = spawn_reservation.set(self)
+        try:
+            yield self
+        finally:
+            spawn_reservation.reset(token)
+
+
+spawn_limiter = SpawnLimiter(SPAWN_MAX, SPAWN_MAX_PER_USER,
+                             SPAWN_QUEUE_SIZE, SPAWN_QUEUE_TIMEOUT)
+
+# SpawnReservation used by gf_spawn()
+spawn_reservation = contextvars.ContextVar("spawn_reservation",
+                                           default=None)
+
+# keep references to tasks releasing the limit
+spawn_release_tasks = set()
+
+
+def release_spawn_slot(user, reservation):
+    if reservation is None:
+        spawn_limiter.release(user)
+    else:
+        reservation.put_back()
+
+
+async def release_on_exit(proc, user, reservation):
+    try:
+        await proc.wait()
+    except Exception:
+        pass  # ex. a process without wait() in unit tests
+    finally:
+        release_spawn_slot(user, reservation)
+
+
+async def gf_spawn(command, *args, env, stdin, stdout, stderr):
+    user = get_user_from_env(env)
+    reservation = spawn_reservation.get()
+    if reservation is None or not reservation.take(user):
+        reservation = None
+        await spawn_limiter.acquire(user)
+    stdin_w = stdout_r = None
+    child_fds = []
+    try:
+        if stdin is TRANSFER_PIPE:
+            stdin, stdin_w = transfer_pipe()
+            child_fds.append(stdin)
+        if stdout is TRANSFER_PIPE:
+            stdout_r, stdout = transfer_pipe()
+            child_fds.append(stdout)
+        proc = await asyncio.create_subprocess_exec(
+            command, *args,
+            env=env,
+            stdin=stdin,
+            stdout=stdout,
+            stderr=stderr,
+            **spawn_kwargs(command, env))
+    except BaseException:
+        for fd in (stdin_w, stdout_r):
+            if fd is not None:
+                os.close(fd)
+        release_spawn_slot(user, reservation)
+        raise
+    finally:
+        for fd in child_fds:
+            os.close(fd)
+    # proc.stdin/stdout is None for a fd
+    if stdin_w is not None:
+        proc.stdin = PipeWriter(stdin_w)
+    if stdout_r is not None:
+        proc.stdout = PipeReader(stdout_r)
+    task = asyncio.create_task(release_on_exit(proc, user, reservation))
+    spawn_release_tasks.add(task)
+    task.add_done_callback(spawn_release_tasks.discard)
+    return proc
+
+
+def sync_gf_spawn(args, env, stdin, stdout, stderr):
+    p = subprocess.Popen(
+        args, shell=False,
+        env=env,
+        stdin=stdin,
+        stdout=stdout,
+        stderr=stderr,
+        **spawn_kwargs(args[0], env))
+    if p.stdout is not None:
+        set_pipe_size(p.stdout.fileno())
+    return p
+
+
+#############################################################################
+# pipes to transfer file contents
+
+# BUFSIZE = 1
+# BUFSIZE = 65536
+BUFSIZE = 1024 * 1024
+
+# stdin/stdout of gf_spawn(): a pipe of PIPE_SIZE read by PipeReader
+# or written by PipeWriter instead of StreamReader/StreamWriter
+TRANSFER_PIPE = object()
+
+
+def set_pipe_size(fd):
+    if PIPE_SIZE <= 0 or not hasattr(fcntl, "F_SETPIPE_SZ"):
+        return
+    try:
+        fcntl.fcntl(fd, fcntl.F_SETPIPE_SZ, PIPE_SIZE * 1024)
+    except OSError:
+        # ex. EPERM: over /proc/sys/fs/pipe-max-size
+        pass
+
+
+def transfer_pipe():
+    r, w = os.pipe()
+    set_pipe_size(w)
+    return r, w
+
+
+class PipeReader:
+    """
+    Read end of a transfer pipe.
+
+    read() returns bytes like StreamReader.read().  readinto() reads
+    into a buffer of the caller without allocating a new object.
+    """
+    def __init__(self, fd):
+        os.set_blocking(fd, False)
+        self._fd = fd
+        self._loop = asyncio.get_running_loop()
+
+    async def _wait(self):
+        fut = self._loop.create_future()
+        self._loop.add_reader(
+            self._fd, lambda: fut.done() or fut.set_result(None))
+        try:
+            await fut
+        finally:
+            self._loop.remove_reader(self._fd)
+
+    async def read(self, n=BUFSIZE):
+        while self._fd >= 0:
+            try:
+                data = os.read(self._fd, n)
+            except BlockingIOError:
+                await self._wait()
+                continue
+            if not data:
+                self.close()
+            return data
+        return b""
+
+    async def readinto(self, buf):
+        while self._fd >= 0:
+            try:
+                n = os.readv(self._fd, [buf])
+            except BlockingIOError:
+                await self._wait()
+                continue
+            if n == 0:
+                self.close()
+            return n
+        return 0
+
+    def fileno(self):
+        return self._fd
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def __del__(self):
+        self.close()
+
+
+class PipeWriter:
+    """
+    Write end of a transfer pipe.
+
+    write() does not copy the data.  The data must not be modified
+    until drain() returns.
+    """
+    def __init__(self, fd):
+        os.set_blocking(fd, False)
+        self._fd = fd
+        self._loop = asyncio.get_running_loop()
+        self._pending = None
+
+    def write(self, data):
+        if self._fd < 0:
+            raise ConnectionResetError("Connection lost")
+        if self._pending is not None:
+            # not drained: keep the order
+            self._pending = memoryview(bytes(self._pending) + bytes(data))
+            return
+        self._pending = memoryview(data).cast("B")
+        self._flush()
+
+    def _flush(self):
+        try:
+            while self._pending is not None:
+                n = os.write(self._fd, self._pending)
+                if n < len(self._pending):
+                    self._pending = self._pending[n:]
+                else:
+                    self._pending = None
+        except BlockingIOError:
+            pass
+        except (BrokenPipeError, ConnectionResetError) as e:
+            self.close()
+            raise ConnectionResetError("Connection lost") from e
+
+    async def _wait(self):
+        fut = self._loop.create_future()
+        self._loop.add_writer(
+            self._fd, lambda: fut.done() or fut.set_result(None))
+        try:
+            await fut
+        finally:
+            self._loop.remove_writer(self._fd)
+
+    async def drain(self):
+        while self._pending is not None:
+            if self._fd < 0:
+                raise ConnectionResetError("Connection lost")
+            await self._wait()
+            self._flush()
+
+    def fileno(self):
+        return self._fd
+
+    def close(self):
+        self._pending = None
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def __del__(self):
+        self.close()
+
+
+class BufferPool:
+    """
+    Free list of preallocated buffers for transfers.
+    """
+    def __init__(self, size, max_free):
+        self.size = size
+        self.max_free = max_free
+        self._free = []
+
+    def get(self):
+        if self._free:
+            return self._free.pop()
+        return bytearray(self.size)
+
+    def put(self, buf):
+        if len(self._free) < self.max_free:
+            self._free.append(buf)
+
+
+buffer_pool = BufferPool(BUFSIZE, 64)
+
+
+async def pipe_readinto(reader, buf):
+    if isinstance(reader, PipeReader):
+        return await reader.readinto(buf)
+    # StreamReader
+    data = await reader.read(len(buf))
+    buf[:len(data)] = data
+    return len(data)
+
+
+def close_transfer_pipe(f):
+    if isinstance(f, (PipeReader, PipeWriter)):
+        f.close()
+
+
+class CopyProgress:
+    def __init__(self, copied=0):
+        self.copied = copied
+
+
+async def copy_pipe(reader, writer, progress, digest=None):
+    """
+    Copy from reader (gfexport) to writer (gfreg) until EOF, and
+    update digest (hashlib object) by the data.
+    """
+    async def update_digest(data):
+        if digest is not None:
+            # hashlib releases the GIL
+            await asyncio.to_thread(digest.update, data)
+
+    # double buffering: read the next chunk from gfexport
+    # while writing (and hashing) the current chunk to gfreg
+    bufs = [buffer_pool.get(), buffer_pool.get()]
+    views = [memoryview(buf) for buf in bufs]
+    i = 0
+    n = await pipe_readinto(reader, bufs[i])
+    while n > 0:
+        chunk = views[i][:n]
+        writer.write(chunk)
+        progress.copied += n
+        i ^= 1
+        n, _, _ = await asyncio.gather(
+            pipe_readinto(reader, bufs[i]),
+            writer.drain(),
+            update_digest(chunk))
+    for buf in bufs:
+        buffer_pool.put(buf)
+
+
+class SpliceCopier:
+    """
+    Copy between transfer pipes by splice(2) in threads without
+    passing the data through Python.  (Linux only)
+
+    When all threads are busy, copy_pipe() is used instead.
+    """
+    def __init__(self, max_threads: int, size: int):
+        self.max_threads = max_threads
+        self.size = size
+        self.running = 0
+        self.copies = 0
+        self.fallbacks = 0
+        self._executor = None
+
+    def available(self, reader, writer):
+        if (self.max_threads <= 0 or not hasattr(os, "splice")
+                or not isinstance(reader, PipeReader)
+                or not isinstance(writer, PipeWriter)):
+            return False
+        if self.running >= self.max_threads:
+            self.fallbacks += 1
+            return False
+        return True
+
+    def _splice(self, rfd, wfd, progress):
+        os.set_blocking(rfd, True)
+        os.set_blocking(wfd, True)
+        try:
+            while True:
+                n = os.splice(rfd, wfd, self.size)
+                if n == 0:
+                    return
+                progress.copied += n
+        finally:
+            os.set_blocking(rfd, False)
+            os.set_blocking(wfd, False)
+
+    def _done(self, fut):
+        self.running -= 1
+
+    async def copy(self, reader, writer, progress):
+        """
+        The thread runs until EOF of reader or an error of writer, so
+        the processes must be killed before the pipes are closed when
+        the copy is abandoned.
+        """
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.max_threads, thread_name_prefix="splice")
+        self.running += 1
+        self.copies += 1
+        loop = asyncio.get_running_loop()
+        fut = loop.run_in_executor(self._executor, self._splice,
+                                   reader.fileno(), writer.fileno(),
+                                   progress)
+        fut.add_done_callback(self._done)
+        await fut
+
+    def stats(self):
+        return {
+            "running": self.running,
+            "copies": self.copies,
+            "fallbacks": self.fallbacks,
+        }
+
+
+splice_copier = SpliceCopier(COPY_SPLICE_THREADS,
+                             max(PIPE_SIZE * 1024, BUFSIZE))
+
+
 async def gfwhoami(env):
     args = []
-    return await asyncio.create_subprocess_exec(
+    return await gf_spawn(
         'gfwhoami', *args,
         env=env,
         stdin=asyncio.subprocess.DEVNULL,
@@ -1547,7 +2247,7 @@ async def gfrm(env, path, force=False, recursive=False):
     if recursive:
         args.append("-r")
     args.append(path)
-    return await asyncio.create_subprocess_exec(
+    return await gf_spawn(
         'gfrm', *args,
         env=env,
         stdin=asyncio.subprocess.DEVNULL,
@@ -1557,7 +2257,7 @@ async def gfrm(env, path, force=False, recursive=False):
 
 async def gfmv(env, src, dest):
     args = [src, dest]
-    return await asyncio.create_subprocess_exec(
+    return await gf_spawn(
         'gfmv', *args,
         env=env,
         stdin=asyncio.subprocess.DEVNULL,
@@ -1567,8 +2267,8 @@ async def gfmv(env, src, dest):
 
 def sync_gfexport(env, path):
     args = ['gfexport', path]
-    return subprocess.Popen(
-        args, shell=False, close_fds=True,
+    return sync_gf_spawn(
+        args,
         env=env,
         stdin=subprocess.DEVNULL,
         stdout=subprocess.PIPE,
@@ -1577,24 +2277,25 @@ def sync_gfexport(env, path):
 
 async def gfexport(env, path):
     args = [path]
-    return await asyncio.create_subprocess_exec(
+    return await gf_spawn(
         'gfexport', *args,
         env=env,
         stdin=asyncio.subprocess.DEVNULL,
-        stdout=asyncio.subprocess.PIPE,
+        stdout=TRANSFER_PIPE,
         stderr=asyncio.subprocess.PIPE), args
 
 
-async def gfreg(env, path, mtime):
+async def gfreg(env, path, mtime, stdin=TRANSFER_PIPE):
+    # stdin: ex. fd of a local file
     if mtime:
         args = ['-M', str(mtime)]
     else:
         args = []
     args += ['-', path]
-    return await asyncio.create_subprocess_exec(
+    return await gf_spawn(
         'gfreg', *args,
         env=env,
-        stdin=asyncio.subprocess.PIPE,
+        stdin=stdin,
         stdout=asyncio.subprocess.DEVNULL,
         stderr=asyncio.subprocess.PIPE), args
 
@@ -1618,7 +2319,7 @@ async def gfls(env,
     if effperm:
         args.append('-e')
     args.append(path)
-    return await asyncio.create_subprocess_exec(
+    return await gf_spawn(
         'gfls', *args,
         env=env,
         stdin=asyncio.subprocess.DEVNULL,
@@ -1761,6 +2462,75 @@ class Gfls_Entry:
         return new_entry
 
 
+LINE_READER_BUFSIZE = 65536
+LINE_SEPARATOR = re.compile(rb"[\r\n]")
+
+
+class LineReader:
+    """
+    Async iterator of lines from a subprocess stream.
+
+    Reads large chunks instead of one byte at a time and splits them
+    on "\\r" or "\\n" (each separator ends one line, so "\\r\\n" yields
+    an empty line after the text, as the old read(1) loops did).
+    Complete lines are decoded straight from memoryview slices of the
+    chunk; only a line spanning two chunks is copied into the pending
+    buffer.
+
+    The trailing partial line (data after the last separator) is
+    yielded at EOF when final_line is True, otherwise it is kept in
+    remainder for the caller.
+    """
+    def __init__(self, stream, initial: bytes = b"",
+                 final_line: bool = True,
+                 bufsize: int = LINE_READER_BUFSIZE):
+        self._stream = stream
+        self._initial = initial
+        self._final_line = final_line
+        self._bufsize = bufsize
+        self._pending = bytearray()
+
+    @property
+    def remainder(self) -> bytes:
+        return bytes(self._pending)
+
+    @staticmethod
+    def _decode(data) -> str:
+        return str(data, "utf-8", errors="replace")
+
+    def _split(self, chunk):
+        view = memoryview(chunk)
+        start = 0
+        for m in LINE_SEPARATOR.finditer(chunk):
+            end = m.start()
+            if self._pending:
+                self._pending += view[start:end]
+                line = self._decode(self._pending)
+                self._pending.clear()
+            else:
+                line = self._decode(view[start:end])
+            yield line
+            start = end + 1
+        if start < len(chunk):
+            self._pending += view[start:]
+        view.release()
+
+    async def __aiter__(self) -> AsyncGenerator[str, None]:
+        if self._initial:
+            for line in self._split(self._initial):
+                yield line
+        while True:
+            chunk = await self._stream.read(self._bufsize)
+            if not chunk:
+                break
+            for line in self._split(chunk):
+                yield line
+        if self._final_line and self._pending:
+            line = self._decode(self._pending)
+            self._pending.clear()
+            yield line
+
+
 async def gfls_generator(
         env,
         path,
@@ -1771,25 +2541,22 @@ async def gfls_generator(
         time_format: Literal['full', 'short'] = 'full',
         effperm: bool = False,
         ign_err: bool = False) -> AsyncGenerator[Union[str, Gfls_Entry], None]:
+    # is_file=None (long_format only): probe the type of path from the
+    # first entry instead of gfstat.  An entry for a file is printed with
+    # the path as given, but an entry in a directory never contains "/".
+    # If gfls fails before the first entry, RuntimeError is raised
+    # even if ign_err is True (the path may not exist).
+    probing = is_file is None
     dirname = os.path.dirname(path) if is_file else path
+    held = []  # messages before the first entry while probing
     p = await gfls(env, path,
                    show_hidden, recursive, long_format, time_format, effperm)
     stdout = ""
-    buffer = b""
-    is_reading = True
-    while is_reading:
-        chunk = await p.stdout.read(1)
-        if not chunk:
-            is_reading = False
-            if len(buffer) > 0:
-                buffer += b"\n"
-        else:
-            buffer += chunk
-        if b"\r" in buffer or b"\n" in buffer:
-            # print(f"buffer:{buffer}")
-            line = buffer.decode("utf-8", errors="replace").strip()
+    completed = False
+    try:
+        async for line in LineReader(p.stdout):
+            line = line.strip()
             stdout += line
-            buffer = b""
             if not line:
                 continue
             entry = Gfls_Entry.parse(line=line,
@@ -1798,25 +2565,44 @@ async def gfls_generator(
                                      full_format_time=time_format == 'full',
                                      effperm=effperm)
             if isinstance(entry, Gfls_Entry):
+                if is_file is None:
+                    is_file = "/" in entry.name
+                    if is_file:
+                        dirname = os.path.dirname(path)
+                        entry.name = os.path.basename(entry.name)
+                    for msg in held:
+                        yield msg
+                    held = None
                 entry.set_dirname(dirname)
                 yield entry
                 continue
             if recursive:
                 dirname = os.path.normpath(line[:-1])
+            elif is_file is None:
+                held.append(line)
             else:
                 yield line
+        completed = True
+    finally:
+        if not completed and p.returncode is None:
+            # the consumer stopped early (ex. client disconnected)
+            p.kill()
 
     return_code = await p.wait()
+    if probing and is_file is None and return_code != 0:
+        raise RuntimeError(stdout)
+    for msg in held or ():
+        yield msg
     if not ign_err and return_code != 0:
         raise RuntimeError(stdout)
 
 
-async def gfmkdir(env, path, p=False):
+async def gfmkdir(env, *paths, p=False):
     args = []
     if p:
         args.append('-p')
-    args.append(path)
-    return await asyncio.create_subprocess_exec(
+    args += paths
+    return await gf_spawn(
         'gfmkdir', *args,
         env=env,
         stdin=asyncio.subprocess.DEVNULL,
@@ -1826,7 +2612,7 @@ async def gfmkdir(env, path, p=False):
 
 async def gfrmdir(env, path):
     args = [path]
-    return await asyncio.create_subprocess_exec(
+    return await gf_spawn(
         'gfrmdir', *args,
         env=env,
         stdin=asyncio.subprocess.DEVNULL,
@@ -1841,7 +2627,7 @@ async def gfln(env, srcpath, linkpath, symlink):
     args.append(srcpath)
     args.append(linkpath)
 
-    return await asyncio.create_subprocess_exec(
+    return await gf_spawn(
         'gfln', *args,
         env=env,
         stdin=asyncio.subprocess.DEVNULL,
@@ -1850,13 +2636,17 @@ async def gfln(env, srcpath, linkpath, symlink):
 
 
 async def gfstat(env, path, metadata, check_symlink=None):
+    # path: a path or a list of paths
     args = []
     if metadata:
         args.append('-M')
     if check_symlink:
         args.append('-l')
-    args.append(path)
-    return await asyncio.create_subprocess_exec(
+    if isinstance(path, list):
+        args += path
+    else:
+        args.append(path)
+    return await gf_spawn(
         'gfstat', *args,
         env=env,
         stdin=asyncio.subprocess.DEVNULL,
@@ -1866,7 +2656,7 @@ async def gfstat(env, path, metadata, check_symlink=None):
 
 async def gfchmod(env, path, mode):
     args = [mode, path]
-    return await asyncio.create_subprocess_exec(
+    return await gf_spawn(
         'gfchmod', *args,
         env=env,
         stdin=asyncio.subprocess.DEVNULL,
@@ -1884,7 +2674,7 @@ async def gfcksum(env,
     if host:
         args.extend(["-h", host])
 
-    return await asyncio.create_subprocess_exec(
+    return await gf_spawn(
         'gfcksum', *args,
         env=env,
         stdin=asyncio.subprocess.DEVNULL,
@@ -1912,7 +2702,7 @@ async def gfptar(env,
         args.extend([f"-{cmd}", outdir, "-C", basedir, "--"])
         args.extend(src)
 
-    return await asyncio.create_subprocess_exec(
+    return await gf_spawn(
         'gfptar', *args,
         env=env,
         stdin=asyncio.subprocess.DEVNULL,
@@ -1920,13 +2710,24 @@ async def gfptar(env,
         stderr=asyncio.subprocess.PIPE), args
 
 
+async def gfpcopy(env, src, destdir, parallel):
+    # src is copied to destdir/basename(src)
+    args = ['-j', str(parallel), f"gfarm://{src}", f"gfarm://{destdir}"]
+    return await gf_spawn(
+        'gfpcopy', *args,
+        env=env,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE), args
+
+
 async def gfuser(env, username: str = None, cmd: str = None):
     args = []
     if cmd:
         args.append(f"-{cmd}")
     if username:
         args.append(username)
-    return await asyncio.create_subprocess_exec(
+    return await gf_spawn(
         'gfuser', *args,
         env=env,
         stdin=asyncio.subprocess.DEVNULL,
@@ -1940,7 +2741,7 @@ async def gfgroup(env, groupname: str = None, cmd: str = None):
         args.append(f"-{cmd}")
     if groupname is not None:
         args.append(groupname)
-    return await asyncio.create_subprocess_exec(
+    return await gf_spawn(
         'gfgroup', *args,
         env=env,
         stdin=asyncio.subprocess.DEVNULL,
@@ -1965,7 +2766,7 @@ async def gfsetfacl(env, path,
     elif acl_file is not None:
         args.extend(["-M", acl_file])
     args.append(path)
-    return await asyncio.create_subprocess_exec(
+    return await gf_spawn(
         'gfsetfacl', *args,
         env=env,
         stdin=asyncio.subprocess.PIPE,
@@ -1975,7 +2776,7 @@ async def gfsetfacl(env, path,
 
 async def gfgetfacl(env, path):
     args = [path]
-    return await asyncio.create_subprocess_exec(
+    return await gf_spawn(
         'gfgetfacl', *args,
         env=env,
         stdin=asyncio.subprocess.DEVNULL,
@@ -2012,27 +2813,200 @@ async def get_groupuser(env, groupname):
     return parts[1:]
 
 
-async def file_size(env, path, extend=False):
-    metadata = False
-    proc = await gfstat(env, path, metadata)
+class StatCache:
+    """
+    LRU cache of gfstat results for file_size().
+
+    Entries are keyed by (credential, path): the credential is a digest
+    of the SASL mechanism, user and password (or access token) in env,
+    so a result is reused only by requests that authenticated as the
+    same Gfarm user in the same way.  Only successful results are
+    cached.
+
+    Paths changed by this gateway are invalidated for all users (with
+    their descendants and parent directories).  A result of gfstat
+    started before an invalidation is not stored.
+    """
+    def __init__(self, ttl: int, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (cred, path) -> (expire, Stat)
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.max_entries > 0
+
+    @staticmethod
+    def _credential(env):
+        mech = env.get("GFARM_SASL_MECHANISMS")
+        user = env.get("GFARM_SASL_USER")
+        passwd = env.get("GFARM_SASL_PASSWORD")
+        if passwd is None and mech != "ANONYMOUS":
+            return None  # ex. token file (JWT_USER_PATH)
+        s = f"{mech}\0{user}\0{passwd}"
+        return hashlib.sha256(s.encode()).hexdigest()
+
+    def _key(self, env, path):
+        cred = self._credential(env)
+        if cred is None:
+            return None
+        return cred, os.path.normpath(path)
+
+    def get(self, env, path) -> Optional[Stat]:
+        if not self.enabled:
+            return None
+        key = self._key(env, path)
+        item = self._entries.get(key) if key else None
+        if item is None or item[0] < time.monotonic():
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def put(self, env, path, st: Stat, generation: int):
+        if not self.enabled or generation != self.generation:
+            return
+        key = self._key(env, path)
+        if key is None:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, st)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, *paths):
+        self.generation += 1
+        targets = set()
+        for path in paths:
+            if not path:
+                continue
+            path = os.path.normpath(path)
+            targets.add(path)
+            targets.add(os.path.dirname(path))
+        if not targets or not self._entries:
+            return
+        prefixes = tuple(p.rstrip("/") + "/" for p in targets)
+        for key in list(self._entries):
+            _, path = key
+            if path in targets or path.startswith(prefixes):
+                del self._entries[key]
+                self.invalidations += 1
+
+    def clear(self):
+        self.generation += 1
+        self._entries.clear()
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+        }
+
+
+stat_cache = StatCache(STAT_CACHE_TTL, STAT_CACHE_SIZE)
+
+
+async def file_stat(env, path):
+    # return None if the path does not exist
+    st = stat_cache.get(env, path)
+    if st is None:
+        generation = stat_cache.generation
+        metadata = False
+        proc = await gfstat(env, path, metadata)
+        elist = []
+        stderr_task = asyncio.create_task(log_stderr("gfstat", proc, elist))
+        data = await proc.stdout.read()
+        stdout = data.decode()
+        await stderr_task
+        return_code = await proc.wait()
+        if return_code == 0:
+            st = parse_gfstat(stdout)
+            stat_cache.put(env, path, st, generation)
+    return st
+
+
+# paths per gfstat
+STAT_BATCH_SIZE = 256
+
+
+async def gfstat_many(env, paths, metadata):
+    """
+    Run gfstat for paths at once, and return ({path: Stat},
+    {path: error message}, stderr lines).
+    """
+    proc = await gfstat(env, paths, metadata)
     elist = []
     stderr_task = asyncio.create_task(log_stderr("gfstat", proc, elist))
     data = await proc.stdout.read()
-    stdout = data.decode()
     await stderr_task
-    return_code = await proc.wait()
-    if return_code != 0:
+    await proc.wait()
+    # the records are printed for the paths that succeeded
+    given = {os.path.normpath(path): path for path in paths}
+    stats = {}
+    for st in parse_gfstats(data.decode()):
+        path = given.get(os.path.normpath(st.File or ""))
+        if path is not None:
+            stats[path] = st
+    errors = {}
+    for path in paths:
+        if path in stats:
+            continue
+        # ex. "gfstat: PATH: no such file or directory"
+        emsg = [e for e in elist if f"{path}:" in e]
+        errors[path] = emsg[-1] if emsg else "gfstat failed"
+    return stats, errors, elist
+
+
+def stat_batches(paths):
+    return [paths[i:i + STAT_BATCH_SIZE]
+            for i in range(0, len(paths), STAT_BATCH_SIZE)]
+
+
+async def file_stats(env, paths):
+    """
+    file_stat() for many paths by a gfstat for STAT_BATCH_SIZE paths.
+    Return {path: Stat or None}.
+    """
+    result = {}
+    misses = []
+    for path in dict.fromkeys(paths):
+        result[path] = stat_cache.get(env, path)
+        if result[path] is None:
+            misses.append(path)
+    generation = stat_cache.generation
+    for stats, _, _ in await asyncio.gather(
+            *[gfstat_many(env, batch, False)
+              for batch in stat_batches(misses)]):
+        for path, st in stats.items():
+            result[path] = st
+            stat_cache.put(env, path, st, generation)
+    return result
+
+
+async def file_size(env, path, extend=False):
+    st = await file_stat(env, path)
+    if st is None:
         existing = False
         is_file = False
         size = 0
+        mtime = None
     else:
-        st = parse_gfstat(stdout)
         existing = True
         is_file = (st.Filetype == "regular file")
         size = st.Size
+        mtime = st.ModifySeconds
     logger.debug(f"file_size: {existing}, {is_file}, {size}")
     if extend:
-        return existing, is_file, size, int(st.ModifySeconds)
+        return existing, is_file, size, mtime
     else:
         return existing, is_file, size
 
@@ -2047,6 +3021,26 @@ async def can_access(env, path, check_perm="w"):
     return False
 
 
+async def stored_checksum(env, method, apiname, path, elist):
+    """
+    Return (checksum of parse_gfcksum(), None) stored for path, or
+    (None, warning message).
+    """
+    opname = "gfcksum"
+    log_operation(env, method, apiname, opname, path)
+    proc_cksum, _ = await gfcksum(env, paths=[path])
+    stdout = await read_proc_output(opname, proc_cksum, elist)
+    if stdout is None:
+        return None, "gfcksum failed"
+    cksums = parse_gfcksum(stdout)
+    if len(cksums) != 1:
+        return None, "no checksum"
+    cksum = cksums[0]
+    if cksum["cksum_type"] not in hashlib.algorithms_available:
+        return None, f"unsupported checksum type: {cksum['cksum_type']}"
+    return cksum, None
+
+
 async def match_checksum(env, method, apiname, src, dst, elist):
     # check sum
     paths = [src, dst]
@@ -2157,7 +3151,9 @@ def gfarm_http_error(command, code, message, stdout, elist):
     )
 
 
-async def gfarm_command_standard_response(env, proc, command):
+async def gfarm_command_standard_response(env, proc, command,
+                                          invalidate=None):
+    # invalidate: paths changed by the command (for stat_cache)
     user = get_user_from_env(env)
     ipaddr = get_client_ip_from_env(env)
     elist = []
@@ -2166,6 +3162,8 @@ async def gfarm_command_standard_response(env, proc, command):
     stdout = data.decode()
     await stderr_task
     return_code = await proc.wait()
+    if invalidate:
+        stat_cache.invalidate(*invalidate)
     if return_code != 0:
         errstr = str(elist)
         last_e = last_emsg(elist)
@@ -2212,6 +3210,147 @@ async def whoami(request: Request,
     return await gfarm_command_standard_response(env, p, opname)
 
 
+class ListingSnapshot:
+    def __init__(self, user, key, entries):
+        self.id = secrets.token_urlsafe(16)
+        self.user = user
+        self.key = key
+        self.entries = entries
+        self.created = time.monotonic()
+
+
+class ListingSnapshots:
+    """
+    Short-lived results of gfls for paginated /dir requests.
+
+    A cursor is "<snapshot id>.<offset>.<resume>".  The snapshot is
+    kept in the worker process that created it, until it expires (ttl)
+    or is evicted (max_per_user).  resume (the digest of the query
+    parameters and the sort key of the last entry sent) lets another
+    worker process, or a request after the snapshot expired, resume
+    the listing by gfls without the snapshot.
+    """
+    def __init__(self, ttl: int, max_per_user: int):
+        self.ttl = ttl
+        self.max_per_user = max(1, max_per_user)
+        self._snapshots = OrderedDict()  # id -> ListingSnapshot (by age)
+
+    def _expire(self):
+        now = time.monotonic()
+        while self._snapshots:
+            sid, snapshot = next(iter(self._snapshots.items()))
+            if now - snapshot.created <= self.ttl:
+                break
+            del self._snapshots[sid]
+
+    def add(self, user, key, entries) -> ListingSnapshot:
+        self._expire()
+        owned = [sid for sid, snapshot in self._snapshots.items()
+                 if snapshot.user == user]
+        for sid in owned[:len(owned) - self.max_per_user + 1]:
+            del self._snapshots[sid]
+        snapshot = ListingSnapshot(user, key, entries)
+        self._snapshots[snapshot.id] = snapshot
+        return snapshot
+
+    @staticmethod
+    def digest(key):
+        return hashlib.sha256(repr(key).encode()).hexdigest()[:16]
+
+    def lookup(self, cursor, user, key):
+        """
+        Return (snapshot, offset, sort key of the last entry sent) of
+        cursor, or None if cursor is invalid for the query parameters
+        (key).  snapshot is None if it is not in this worker process.
+        """
+        self._expire()
+        try:
+            sid, offset, resume = cursor.split(".")
+            offset = int(offset)
+            resume = base64.urlsafe_b64decode(
+                resume + "=" * (-len(resume) % 4))
+            digest, last_key = json.loads(resume)
+            if last_key is not None:
+                last_key = tuple(last_key)
+        except (ValueError, TypeError):
+            return None
+        if offset < 0 or digest != self.digest(key):
+            return None
+        snapshot = self._snapshots.get(sid)
+        if (snapshot is not None and snapshot.user == user
+                and snapshot.key == key
+                and offset <= len(snapshot.entries)):
+            return snapshot, offset, last_key
+        return None, offset, last_key
+
+    def cursor(self, snapshot, offset, last_key):
+        resume = json.dumps([self.digest(snapshot.key), last_key])
+        resume = base64.urlsafe_b64encode(resume.encode()).rstrip(b"=")
+        return f"{snapshot.id}.{offset}.{resume.decode()}"
+
+
+dir_snapshots = ListingSnapshots(DIR_SNAPSHOT_TTL, DIR_SNAPSHOT_MAX_PER_USER)
+
+
+def gfls_resume_offset(entries, sort_key, reverse, offset, last_key):
+    """
+    Return the offset of the next page in sorted entries listed again
+    for a cursor: the first entry after last_key, or offset if not
+    sorted.
+    """
+    if last_key is None:
+        return min(offset, len(entries))
+    for i, entry in enumerate(entries):
+        key = sort_key(entry)
+        if key < last_key if reverse else key > last_key:
+            return i
+    return len(entries)
+
+
+def gfls_sort_key(sort):
+    def key(entry):
+        if not isinstance(entry, Gfls_Entry):
+            # message lines (ex. ign_err=true) are gathered at the top
+            return (0, 0, entry)
+        if sort == 'size':
+            return (1, entry.size, entry.path)
+        if sort == 'mtime':
+            return (1, entry.mtime, entry.path)
+        return (1, 0, entry.path)
+    return key
+
+
+DIR_LIST_MEDIA_TYPES = {
+    'json': "application/json",
+    'ndjson': "application/x-ndjson",
+    'plain': "text/plain",
+}
+
+
+def dir_list_response(output_data, output_format, headers=None):
+    if output_format == 'json':
+        return JSONResponse(content=output_data, headers=headers)
+    if output_format == 'ndjson':
+        content = "".join(json.dumps(d) + "\n" for d in output_data)
+        return Response(content=content, headers=headers,
+                        media_type=DIR_LIST_MEDIA_TYPES[output_format])
+    return PlainTextResponse(content="\n".join(output_data), headers=headers)
+
+
+@app.get("/stats")
+async def gateway_stats(
+        request: Request,
+        authorization: Union[str, None] = Header(default=None)):
+    # counters of this worker process
+    await set_env(request, authorization)
+    return JSONResponse(content={
+        "stat_cache": stat_cache.stats(),
+        "spawn": spawn_limiter.stats(),
+        "content_cache": content_cache.stats(),
+        "splice_copy": splice_copier.stats(),
+    })
+
+
 @app.get("/dir/{gfarm_path:path}")
 async def dir_list(gfarm_path: str,
                    request: Request,
@@ -2220,9 +3359,29 @@ async def dir_list(gfarm_path: str,
                    recursive: bool = False,
                    long_format: bool = True,  # noqa: E741
                    time_format: Literal['full', 'short'] = 'full',
-                   output_format: Literal['json', 'plain'] = 'json',
+                   output_format: Literal['json', 'ndjson', 'plain'] = 'json',
+                   stream: bool = False,
+                   sort: Optional[Literal['name', 'size', 'mtime']] = None,
+                   reverse: bool = False,
+                   limit: Optional[int] = Query(None, ge=1),
+                   cursor: Optional[str] = None,
                    ign_err: bool = False,
                    authorization: Union[str, None] = Header(default=None)):
+    """
+    output_format=ndjson (or stream=true) sends entries as soon as gfls
+    outputs them instead of building the whole list in memory.
+    With stream=true, output_format=json is sent as an incremental
+    JSON array.
+
+    sort and limit return sorted entries and/or the first page.
+    If more entries remain, the X-Next-Cursor response header is set;
+    pass it as cursor (with the same parameters) to get the next page
+    from a snapshot of the listing without running gfls again.
+    If the snapshot is in another worker process or expired, gfls
+    runs again and the page starts after the last entry sent (at the
+    same offset if not sorted).  X-Total-Count is the number of all
+    entries.
+    """
     opname = "gfls"
     apiname = "/dir"
     gfarm_path = fullpath(gfarm_path)
@@ -2230,41 +3389,166 @@ async def dir_list(gfarm_path: str,
     user = get_user_from_env(env)
     ipaddr = get_client_ip_from_env(env)
     log_operation(env, request.method, apiname, opname, gfarm_path)
-    existing, is_file, _ = await file_size(env, gfarm_path)
-    if not existing:
-        code = status.HTTP_404_NOT_FOUND
-        message = f"The requested path does not exist: path={gfarm_path}"
-        elist = []
-        raise gfarm_http_error(opname, code, message, "", elist)
 
-    output_data = []
+    snapshot_key = (gfarm_path, show_hidden, effperm, recursive, long_format,
+                    time_format, output_format, sort, reverse, ign_err)
+    sort_key = gfls_sort_key(sort)
+
+    def format_entry(entry):
+        if isinstance(entry, Gfls_Entry):
+            if output_format == 'plain':
+                return entry.line_dump()
+            return entry.json_dump()
+        return entry
+
+    def page_response(entries, offset, snapshot=None):
+        # entries: sorted, not formatted
+        end = len(entries) if limit is None else offset + limit
+        headers = {"X-Total-Count": str(len(entries))}
+        if end < len(entries):
+            if snapshot is None:
+                snapshot = dir_snapshots.add(user, snapshot_key, entries)
+            last_key = None if sort is None else sort_key(entries[end - 1])
+            headers["X-Next-Cursor"] = dir_snapshots.cursor(
+                snapshot, end, last_key)
+        return dir_list_response(
+            [format_entry(entry) for entry in entries[offset:end]],
+            output_format, headers)
+
+    resume = None
+    if cursor is not None:
+        resume = dir_snapshots.lookup(cursor, user, snapshot_key)
+        if resume is None:
+            code = status.HTTP_410_GONE
+            message = ("The cursor is invalid"
+                       f" (restart the listing): path={gfarm_path}")
+            raise gfarm_http_error(opname, code, message, "", [])
+        snapshot, offset, _ = resume
+        if snapshot is not None:
+            return page_response(snapshot.entries, offset, snapshot)
+        logger.debug(f"{ipaddr}:0 user={user}, cmd={opname},"
+                     f" path={gfarm_path}, resume without the snapshot")
+
+    if sort in ('size', 'mtime') and not long_format:
+        code = status.HTTP_400_BAD_REQUEST
+        message = f"sort={sort} requires long_format"
+        raise gfarm_http_error(opname, code, message, "", [])
+
+    async def check_path():
+        existing, is_file, _ = await file_size(env, gfarm_path)
+        if not existing:
+            code = status.HTTP_404_NOT_FOUND
+            message = f"The requested path does not exist: path={gfarm_path}"
+            elist = []
+            raise gfarm_http_error(opname, code, message, "", elist)
+        return is_file
+
+    def list_entries(is_file):
+        return gfls_generator(
+            env, gfarm_path, is_file,
+            show_hidden=show_hidden,
+            recursive=recursive,
+            long_format=long_format,
+            time_format=time_format,
+            effperm=effperm,
+            ign_err=ign_err)
+
+    # Run gfls only (without gfstat) and probe the type of the path
+    # from its output, unless gfstat is cached.
+    st = stat_cache.get(env, gfarm_path)
+    if st is not None:
+        is_file = st.Filetype == "regular file"
+    elif long_format:
+        is_file = None
+    else:
+        is_file = await check_path()
+    entries = list_entries(is_file)
+
+    # wait for the first entry to report an early error as usual
     try:
-        async for entry in gfls_generator(
-                env, gfarm_path, is_file,
-                show_hidden=show_hidden,
-                recursive=recursive,
-                long_format=long_format,
-                time_format=time_format,
-                effperm=effperm,
-                ign_err=ign_err):
-            if isinstance(entry, Gfls_Entry):
-                if output_format == 'json':
-                    output_data.append(entry.json_dump())
-                else:
-                    output_data.append(entry.line_dump())
-            else:
-                output_data.append(entry)
+        try:
+            first = await anext(entries)
+        except RuntimeError:
+            if is_file is not None:
+                raise
+            # probing failed: gfstat distinguishes "not found"
+            entries = list_entries(await check_path())
+            first = await anext(entries)
+    except StopAsyncIteration:
+        first = None
     except RuntimeError as e:
         code = status.HTTP_500_INTERNAL_SERVER_ERROR
         message = f"Failed to execute gfls: path={gfarm_path}"
         elist = []
         raise gfarm_http_error(opname, code, message, str(e), elist)
 
-    logger.debug(f"{ipaddr}:0 user={user}, cmd={opname}, stdout={output_data}")
-    if output_format == 'json':
-        return JSONResponse(content=output_data)
+    paginate = sort is not None or limit is not None or resume is not None
+    if not paginate and (stream or output_format == 'ndjson'):
+        if first is not None:
+            first = format_entry(first)
+
+        def dump(data):
+            if output_format == 'plain':
+                return data
+            return json.dumps(data)
+
+        if output_format == 'json':
+            head, sep, tail = "[", ",\n", "]\n"
+        else:
+            head, sep, tail = "", "\n", "\n"
+
+        async def generate():
+            count = 0
+            yield head
+            if first is not None:
+                yield dump(first)
+                count += 1
+            try:
+                async for entry in entries:
+                    yield sep + dump(format_entry(entry))
+                    count += 1
+            except RuntimeError as e:
+                logger.warning(
+                    f"{ipaddr}:0 user={user}, cmd={opname},"
+                    f" path={gfarm_path}, entries={count}, error={str(e)}")
+                if output_format != 'ndjson':
+                    raise  # truncated response
+                message = f"Failed to execute gfls: path={gfarm_path}"
+                yield sep + json.dumps({"error": message, "stdout": str(e)})
+            if count > 0 or output_format == 'json':
+                yield tail
+            logger.debug(f"{ipaddr}:0 user={user}, cmd={opname},"
+                         f" entries={count}")
+
+        return StreamingResponse(content=generate(),
+                                 media_type=DIR_LIST_MEDIA_TYPES[
+                                     output_format])
+
+    output_data = [] if first is None else [first]
+    try:
+        async for entry in entries:
+            output_data.append(entry)
+    except RuntimeError as e:
+        code = status.HTTP_500_INTERNAL_SERVER_ERROR
+        message = f"Failed to execute gfls: path={gfarm_path}"
+        elist = []
+        raise gfarm_http_error(opname, code, message, str(e), elist)
 
-    return PlainTextResponse(content="\n".join(output_data))
+    if sort is not None:
+        output_data.sort(key=sort_key, reverse=reverse)
+
+    if paginate:
+        logger.debug(f"{ipaddr}:0 user={user}, cmd={opname},"
+                     f" entries={len(output_data)}")
+        offset = 0
+        if resume is not None:
+            _, offset, last_key = resume
+            offset = gfls_resume_offset(output_data, sort_key, reverse,
+                                        offset, last_key)
+        return page_response(output_data, offset)
+    output_data = [format_entry(entry) for entry in output_data]
+    logger.debug(f"{ipaddr}:0 user={user}, cmd={opname}, stdout={output_data}")
+    return dir_list_response(output_data, output_format)
 
 
 @app.get("/symlink/{gfarm_path:path}")
@@ -2344,7 +3628,8 @@ async def symlink_create(
     env = await set_env(request, authorization)
     log_operation(env, request.method, apiname, opname, gfarm_path)
     proc = await gfln(env, gfarm_path, symlink_path, symlink)
-    return await gfarm_command_standard_response(env, proc, opname)
+    return await gfarm_command_standard_response(env, proc, opname,
+                                                 invalidate=[symlink_path])
 
 
 @app.put("/dir/{gfarm_path:path}")
@@ -2359,8 +3644,9 @@ async def dir_create(gfarm_path: str,
     gfarm_path = fullpath(gfarm_path)
     env = await set_env(request, authorization)
     log_operation(env, request.method, apiname, opname, gfarm_path)
-    proc = await gfmkdir(env, gfarm_path, p)
-    return await gfarm_command_standard_response(env, proc, opname)
+    proc = await gfmkdir(env, gfarm_path, p=p)
+    return await gfarm_command_standard_response(env, proc, opname,
+                                                 invalidate=[gfarm_path])
 
 
 @app.delete("/dir/{gfarm_path:path}")
@@ -2375,21 +3661,514 @@ async def dir_remove(gfarm_path: str,
     env = await set_env(request, authorization)
     log_operation(env, request.method, apiname, opname, gfarm_path)
     p = await gfrmdir(env, gfarm_path)
-    return await gfarm_command_standard_response(env, p, opname)
+    return await gfarm_command_standard_response(env, p, opname,
+                                                 invalidate=[gfarm_path])
 
 
-# BUFSIZE = 1
-# BUFSIZE = 65536
-BUFSIZE = 1024 * 1024
-
 ASYNC_GFEXPORT = str2bool(conf.GFARM_HTTP_ASYNC_GFEXPORT)
 
+SYNC_GFEXPORT_THREADS = conf_int("GFARM_HTTP_SYNC_GFEXPORT_THREADS", 16)
+# chunks read ahead by a thread for each download
+SYNC_GFEXPORT_QUEUE_SIZE = 4
+
+sync_gfexport_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=max(SYNC_GFEXPORT_THREADS, 1),
+    thread_name_prefix="sync_gfexport")
+
+
+class ThreadedPipeReader:
+    """
+    Read a blocking pipe in a thread of executor and pass chunks to
+    the event loop through a bounded queue (the thread blocks while
+    the queue is full).  The first chunk is first_size bytes.
+
+    The process writing the pipe must be killed before close() if
+    the pipe is not read until EOF.
+    """
+    def __init__(self, f, executor, first_size=1, size=BUFSIZE,
+                 maxsize=SYNC_GFEXPORT_QUEUE_SIZE):
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize)
+        self._stopped = False
+        self._eof = False
+        self._future = self._loop.run_in_executor(
+            executor, self._run, f, first_size, size)
+
+    def _run(self, f, first_size, size):
+        n = first_size
+        try:
+            while not self._stopped:
+                d = f.read(n)
+                n = size
+                self._put(d)
+                if not d:
+                    return
+        except Exception as e:
+            self._put(e)
+
+    def _put(self, item):
+        fut = asyncio.run_coroutine_threadsafe(self._queue.put(item),
+                                               self._loop)
+        while True:
+            try:
+                fut.result(timeout=1)
+                return
+            except concurrent.futures.TimeoutError:
+                if self._stopped:
+                    fut.cancel()
+                    return
+
+    async def read(self):
+        if self._eof:
+            return b""
+        item = await self._queue.get()
+        if isinstance(item, Exception):
+            raise item
+        if not item:
+            self._eof = True
+        return item
+
+    async def close(self):
+        self._stopped = True
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        await self._future
+
+
+async def sync_wait(p):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(sync_gfexport_executor, p.wait)
+
+
+class ContentCacheFill:
+    """
+    A file being filled into ContentCache by gfexport.
+    """
+    def __init__(self, cache, key, size, credential):
+        self.cache = cache
+        self.key = key
+        self.size = size
+        self.credential = credential
+        self.tmppath = cache.entry_path(key) + ".tmp"
+        self.f = open(self.tmppath, "wb")
+        self.written = 0
+        self.done = False
+
+    def write(self, data):
+        self.f.write(data)
+        self.written += len(data)
+
+    def commit(self):
+        if self.done:
+            return
+        if self.written != self.size:  # ex. changed during gfexport
+            self.abort()
+            return
+        self.f.close()
+        os.rename(self.tmppath, self.cache.entry_path(self.key))
+        self.done = True
+        self.cache.add(self.key, self.size, self.credential)
+
+    def abort(self):
+        if self.done:
+            return
+        self.f.close()
+        try:
+            os.remove(self.tmppath)
+        except OSError:
+            pass
+        self.done = True
+        self.cache.fill_done(self.key, False)
+
+
+class ContentCache:
+    """
+    Read-through cache of file contents on local disk for /file.
+
+    Entries are keyed by path, Inode, Gen, Size and Modify of gfstat,
+    so a changed file is never served from the cache; stale entries
+    are evicted in LRU order to keep the total size within max_bytes.
+
+    Contents are shared by users.  A user is allowed to read an entry
+    after gfexport by the user filled it or `gfls -e` says the user
+    can read the file (remembered for auth_ttl seconds).
+
+    Only the first request of the same entry runs gfexport to fill
+    it.  Concurrent requests do not wait for the fill, which is as
+    slow as the client of the first request, and run gfexport by
+    themselves without filling.  Files are kept in a directory for
+    each worker process, because the index is in memory.
+    """
+    def __init__(self, directory, max_bytes: int, max_file_size: int,
+                 auth_ttl: int):
+        self.base_directory = directory
+        self.max_bytes = max_bytes
+        self.max_file_size = max_file_size
+        self.auth_ttl = auth_ttl
+        # key -> [size, {credential: expire}]
+        self._entries = OrderedDict()
+        self._filling = set()  # keys
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.fills = 0
+        self.fill_failures = 0
+        self.evictions = 0
+        self.directory = None
+        if self.enabled:
+            self._setup()
+
+    @property
+    def enabled(self):
+        return self.base_directory is not None and self.max_bytes > 0
+
+    def _setup(self):
+        os.makedirs(self.base_directory, mode=0o700, exist_ok=True)
+        # remove directories of dead worker processes
+        for name in os.listdir(self.base_directory):
+            if not name.isdigit():
+                continue
+            try:
+                os.kill(int(name), 0)
+                continue
+            except ProcessLookupError:
+                pass
+            except PermissionError:
+                continue
+            shutil.rmtree(os.path.join(self.base_directory, name),
+                          ignore_errors=True)
+        self.directory = os.path.join(self.base_directory, str(os.getpid()))
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.makedirs(self.directory, mode=0o700)
+
+    @staticmethod
+    def key(path, st):
+        s = (f"{path}\0{st.Inode}\0{st.Gen}\0{st.Size}"
+             f"\0{st.ModifySeconds}.{st.ModifyNanos}")
+        return hashlib.sha256(s.encode()).hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.directory, key)
+
+    def cacheable(self, st):
+        return 0 < st.Size <= min(self.max_file_size, self.max_bytes)
+
+    async def _authorized(self, env, path, readers):
+        credential = StatCache._credential(env)
+        now = time.time()
+        expire = readers.get(credential)
+        if credential is not None and expire is not None and now < expire:
+            return True
+        if not await can_access(env, path, "r"):
+            return False
+        if credential is not None and self.auth_ttl > 0:
+            readers[credential] = now + self.auth_ttl
+        return True
+
+    async def lookup(self, env, path, st, fill=True):
+        """
+        Return (file object, None) on a hit.  Otherwise return
+        (None, ContentCacheFill or None); the caller must commit() or
+        abort() the fill.
+        """
+        key = self.key(path, st)
+        if key in self._filling:
+            self.coalesced += 1
+            self.misses += 1
+            return None, None
+        entry = self._entries.get(key)
+        if entry is not None:
+            size, readers = entry
+            if await self._authorized(env, path, readers):
+                try:
+                    f = open(self.entry_path(key), "rb")
+                except OSError:
+                    self._remove(key)
+                else:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return f, None
+            else:
+                self.misses += 1
+                return None, None  # gfexport reports the error
+        self.misses += 1
+        if not fill or key in self._entries or not self.cacheable(st):
+            return None, None
+        self._filling.add(key)
+        try:
+            return None, ContentCacheFill(
+                self, key, st.Size, StatCache._credential(env))
+        except OSError as e:
+            logger.warning(f"content cache: {str(e)}")
+            self.fill_done(key, False)
+            return None, None
+
+    def fill_done(self, key, success):
+        if success:
+            self.fills += 1
+        else:
+            self.fill_failures += 1
+        self._filling.discard(key)
+
+    def add(self, key, size, credential):
+        readers = {}
+        if credential is not None and self.auth_ttl > 0:
+            readers[credential] = time.time() + self.auth_ttl
+        self._entries[key] = [size, readers]
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes:
+            old_key = next(iter(self._entries))
+            self._remove(old_key)
+            self.evictions += 1
+        self.fill_done(key, True)
+
+    def _remove(self, key):
+        size, _ = self._entries.pop(key)
+        self.total_bytes -= size
+        try:
+            # readers can continue to read the opened file
+            os.remove(self.entry_path(key))
+        except OSError:
+            pass
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "fills": self.fills,
+            "fill_failures": self.fill_failures,
+            "evictions": self.evictions,
+        }
+
+
+content_cache = ContentCache(CONTENT_CACHE_DIR,
+                             CONTENT_CACHE_SIZE * 1024 * 1024,
+                             CONTENT_CACHE_MAX_FILE_SIZE * 1024 * 1024,
+                             STAT_CACHE_TTL)
+
+
+async def read_cached_file(f, parts, tail):
+    try:
+        for header, start, end in parts:
+            if header:
+                yield header
+            f.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                d = await asyncio.to_thread(f.read, min(BUFSIZE, remaining))
+                if not d:
+                    return
+                remaining -= len(d)
+                yield d
+        if tail:
+            yield tail
+    finally:
+        f.close()
+
+# Range header with more parts than this is ignored
+RANGE_MAX_PARTS = 64
+
+RANGE_SPEC = re.compile(r"(\d*)-(\d*)", re.ASCII)
+
+
+def parse_range(value, size):
+    """
+    Parse Range header (RFC 9110 14.2) for a file of size bytes.
+    Return a list of (start, end) (end is exclusive) sorted and
+    coalesced, because gfexport can only read forward.  Return None
+    to ignore the header (unknown unit or invalid syntax), or [] if no
+    range is satisfiable.
+    """
+    unit, _, spec = value.partition("=")
+    if unit.strip().lower() != "bytes":
+        return None
+    ranges = []
+    for r in spec.split(","):
+        m = RANGE_SPEC.fullmatch(r.strip())
+        if m is None:
+            return None
+        first, last = m.groups()
+        if first == "":
+            if last == "":
+                return None
+            length = int(last)
+            if length == 0:
+                continue  # unsatisfiable
+            start, end = max(size - length, 0), size
+        else:
+            start = int(first)
+            if last == "":
+                end = size
+            elif int(last) < start:
+                return None
+            else:
+                end = min(int(last) + 1, size)
+            if start >= size:
+                continue  # unsatisfiable
+        ranges.append((start, end))
+    if len(ranges) > RANGE_MAX_PARTS:
+        return None
+    ranges.sort()
+    coalesced = []
+    for start, end in ranges:
+        if coalesced and start <= coalesced[-1][1]:
+            coalesced[-1] = (coalesced[-1][0], max(coalesced[-1][1], end))
+        else:
+            coalesced.append((start, end))
+    return coalesced
+
+
+def file_etag(st):
+    # strong validator: a new Inode/Gen on replace, Size/Modify on update
+    return (f'"{st.Inode:x}-{st.Gen:x}-{st.Size:x}'
+            f'-{st.ModifySeconds:x}.{st.ModifyNanos or 0:09d}"')
+
+
+def parse_http_date(value):
+    try:
+        return int(email.utils.parsedate_to_datetime(value).timestamp())
+    except Exception:
+        return None
+
+
+def if_range_matches(value, etag, mtime):
+    # If-Range (RFC 9110 13.1.5): strong comparison
+    if value is None:
+        return True
+    if value.startswith('"'):
+        return value == etag
+    if value.startswith('W/'):
+        return False
+    date = parse_http_date(value)
+    return date is not None and mtime is not None and date == int(mtime)
+
+
+def not_modified(if_none_match, if_modified_since, etag, mtime):
+    # If-None-Match and If-Modified-Since (RFC 9110 13.1.2, 13.1.3)
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        # weak comparison
+        tags = [t.strip().removeprefix("W/")
+                for t in if_none_match.split(",")]
+        return etag in tags
+    if if_modified_since is not None and mtime is not None:
+        date = parse_http_date(if_modified_since)
+        return date is not None and int(mtime) <= date
+    return False
+
+
+def file_headers(gfarm_path, st, action):
+    headers = {
+        "accept-ranges": "bytes",
+        "etag": file_etag(st),
+        "last-modified": email.utils.formatdate(st.ModifySeconds,
+                                                usegmt=True),
+    }
+    if action == 'download':
+        filename = os.path.basename(gfarm_path)
+        encoded = urllib.parse.quote(filename, encoding='utf-8')
+        # RFC 5987,8187
+        cd = f"attachment; filename*=UTF-8' '\"{encoded}\""
+        # cd = f"attachment; filename=\"{encoded}\""
+        headers.update({"content-disposition": cd})
+    return headers
+
+
+def file_stat_error(opname, st):
+    if st is None:
+        code = status.HTTP_404_NOT_FOUND
+        message = "The requested URL does not exist."
+    else:
+        code = status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+        message = "The requested URL does not represent a file."
+    stdout = ""
+    elist = []
+    return gfarm_http_error(opname, code, message, stdout, elist)
+
+
+def is_regular_file(st):
+    return st is not None and st.Filetype == "regular file"
+
+
+def byteranges(ranges, size, content_type):
+    """
+    Return (parts, tail, media_type, content_length) for
+    multipart/byteranges.  parts is a list of (header, start, end).
+    """
+    boundary = secrets.token_hex(16)
+    parts = []
+    content_length = 0
+    for start, end in ranges:
+        header = (f"\r\n--{boundary}\r\n"
+                  f"Content-Type: {content_type}\r\n"
+                  f"Content-Range: bytes {start}-{end - 1}/{size}\r\n"
+                  "\r\n").encode()
+        parts.append((header, start, end))
+        content_length += len(header) + end - start
+    tail = f"\r\n--{boundary}--\r\n".encode()
+    content_length += len(tail)
+    media_type = f"multipart/byteranges; boundary={boundary}"
+    return parts, tail, media_type, content_length
+
+
+@app.head("/file/{gfarm_path:path}")
+async def file_head(gfarm_path: str,
+                    request: Request,
+                    action: str = 'view',
+                    authorization: Union[str, None] = Header(default=None),
+                    if_none_match: Union[str, None] = Header(default=None),
+                    if_modified_since: Union[str, None] = Header(
+                        default=None)):
+    # the same headers as GET without gfexport
+    opname = "gfstat"
+    apiname = "/file"
+    gfarm_path = fullpath(gfarm_path)
+    env = await set_env(request, authorization)
+    log_operation(env, request.method, apiname, opname, gfarm_path)
+    st = await file_stat(env, gfarm_path)
+    if not is_regular_file(st):
+        raise file_stat_error(opname, st)
+    headers = file_headers(gfarm_path, st, action)
+    if not_modified(if_none_match, if_modified_since,
+                    headers["etag"], st.ModifySeconds):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED,
+                        headers=headers)
+    if st.Size <= 0:
+        return Response(status_code=204, headers=headers)
+    headers["content-length"] = str(st.Size)
+    return Response(media_type=get_content_type(gfarm_path),
+                    headers=headers)
+
+
+async def discard_gfexport(export_task):
+    # gfexport started ahead of gfstat that failed
+    export_task.cancel()
+    try:
+        p, _ = await export_task
+    except (asyncio.CancelledError, Exception):
+        return  # not spawned
+    if p.returncode is None:
+        p.kill()
+    close_transfer_pipe(p.stdout)
+    await p.wait()
+
 
 @app.get("/file/{gfarm_path:path}")
 async def file_export(gfarm_path: str,
                       request: Request,
                       action: str = 'view',
-                      authorization: Union[str, None] = Header(default=None)):
+                      authorization: Union[str, None] = Header(default=None),
+                      http_range: Union[str, None] = Header(
+                          default=None, alias="Range"),
+                      if_range: Union[str, None] = Header(default=None),
+                      if_none_match: Union[str, None] = Header(default=None),
+                      if_modified_since: Union[str, None] = Header(
+                          default=None)):
     opname = "gfexport"
     apiname = "/file"
     gfarm_path = fullpath(gfarm_path)
@@ -2397,40 +4176,130 @@ async def file_export(gfarm_path: str,
     user = get_user_from_env(env)
     ipaddr = get_client_ip_from_env(env)
     log_operation(env, request.method, apiname, opname, gfarm_path)
-    existing, is_file, size = await file_size(env, gfarm_path)
-    if not existing:
-        code = status.HTTP_404_NOT_FOUND
-        message = "The requested URL does not exist."
-        stdout = ""
-        elist = []
-        raise gfarm_http_error(opname, code, message, stdout, elist)
-    if not is_file:
-        code = status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
-        message = "The requested URL does not represent a file."
-        stdout = ""
-        elist = []
-        raise gfarm_http_error(opname, code, message, stdout, elist)
-
-    if int(size) <= 0:
-        return Response(status_code=204)  # 0 byte OK
-
-    env = await set_env(request, authorization)  # may refresh
-    if ASYNC_GFEXPORT:
-        p, args = await gfexport(env, gfarm_path)
+    p = None
+    if (ASYNC_GFEXPORT and if_none_match is None
+            and if_modified_since is None and not content_cache.enabled):
+        # start gfexport while gfstat is running to overlap the
+        # latency of process startup and authentication with gfmd
+        export_task = asyncio.create_task(gfexport(env, gfarm_path))
+        try:
+            st = await file_stat(env, gfarm_path)
+        except BaseException:
+            await discard_gfexport(export_task)
+            raise
+        p, args = await export_task
         elist = []
         stderr_task = asyncio.create_task(log_stderr(opname, p, elist))
     else:
-        # stderr is not supported
-        p, args = sync_gfexport(env, gfarm_path)
+        # a conditional request is likely to be answered by 304
+        st = await file_stat(env, gfarm_path)
+
+    async def cancel_gfexport():
+        if p is not None:
+            if p.returncode is None:
+                p.kill()
+            close_transfer_pipe(p.stdout)
+            await stderr_task
+            await p.wait()
+
+    if not is_regular_file(st):
+        await cancel_gfexport()
+        raise file_stat_error(opname, st)
+
+    headers = file_headers(gfarm_path, st, action)
+    etag = headers["etag"]
+    mtime = st.ModifySeconds
+    if not_modified(if_none_match, if_modified_since, etag, mtime):
+        await cancel_gfexport()
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED,
+                        headers=headers)
+
+    size = st.Size
+    if size <= 0:
+        await cancel_gfexport()
+        return Response(status_code=204)  # 0 byte OK
 
-    # size > 0
-    if ASYNC_GFEXPORT:
-        first_byte = await p.stdout.read(1)
+    ranges = None
+    if http_range is not None and if_range_matches(if_range, etag, mtime):
+        ranges = parse_range(http_range, size)
+        if ranges == []:
+            await cancel_gfexport()
+            return Response(
+                status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                headers={"content-range": f"bytes */{size}"})
+
+    ct = get_content_type(gfarm_path)
+    status_code = status.HTTP_200_OK
+    media_type = ct
+    if ranges is None:
+        parts, tail = [(b"", 0, size)], b""
+        content_length = size
+    elif len(ranges) == 1:
+        status_code = status.HTTP_206_PARTIAL_CONTENT
+        start, end = ranges[0]
+        parts, tail = [(b"", start, end)], b""
+        headers["content-range"] = f"bytes {start}-{end - 1}/{size}"
+        content_length = end - start
     else:
-        first_byte = p.stdout.read(1)
+        status_code = status.HTTP_206_PARTIAL_CONTENT
+        parts, tail, media_type, content_length = byteranges(
+            ranges, size, ct)
+    headers["content-length"] = str(content_length)
+    if ranges is not None:
+        logger.debug(f"{ipaddr}:0 user={user}, cmd={opname},"
+                     f" path={gfarm_path}, ranges={ranges}")
+
+    def response(content):
+        return StreamingResponse(content=content,
+                                 status_code=status_code,
+                                 media_type=media_type,
+                                 headers=headers,
+                                 )
+
+    fill = None
+    if content_cache.enabled:
+        # fill the cache by a request for the whole file only
+        f, fill = await content_cache.lookup(env, gfarm_path, st,
+                                             fill=ranges is None)
+        if f is not None:
+            await cancel_gfexport()
+            logger.debug(f"{ipaddr}:0 user={user}, cmd={opname},"
+                         f" path={gfarm_path}, content cache hit")
+            return response(read_cached_file(f, parts, tail))
+
+    try:
+        if p is None:
+            env = await set_env(request, authorization)  # may refresh
+            elist = []
+            if ASYNC_GFEXPORT:
+                p, args = await gfexport(env, gfarm_path)
+                stderr_task = asyncio.create_task(
+                    log_stderr(opname, p, elist))
+            else:
+                # stderr is not supported
+                # read in a thread not to block the event loop
+                loop = asyncio.get_running_loop()
+                p, args = await loop.run_in_executor(
+                    sync_gfexport_executor, sync_gfexport, env, gfarm_path)
+                reader = ThreadedPipeReader(p.stdout, sync_gfexport_executor)
+
+        # size > 0
+        if ASYNC_GFEXPORT:
+            first_byte = await p.stdout.read(1)
+        else:
+            first_byte = await reader.read()
+    except BaseException:
+        if fill is not None:
+            fill.abort()
+        raise
     if not first_byte:
+        if fill is not None:
+            fill.abort()
         if ASYNC_GFEXPORT:
             await stderr_task
+        else:
+            await reader.close()
+            await sync_wait(p)
         if await can_access(env, gfarm_path, "r"):
             code = status.HTTP_403_FORBIDDEN
             message = f"Cannot read: path={gfarm_path}"
@@ -2440,153 +4309,729 @@ async def file_export(gfarm_path: str,
         stdout = ""
         raise gfarm_http_error(opname, code, message, stdout, elist)
 
+    async def read(n):
+        if ASYNC_GFEXPORT:
+            return await p.stdout.read(n)
+        return await reader.read()  # BUFSIZE
+
+    async def stop_sync_gfexport():
+        if p.poll() is None:
+            p.kill()
+        await reader.close()
+        return await sync_wait(p)
+
     async def generate():
-        yield first_byte
+        try:
+            d = first_byte
+            while d:
+                if fill is not None:
+                    await asyncio.to_thread(fill.write, d)
+                yield d
+                d = await read(BUFSIZE)
+            if ASYNC_GFEXPORT:
+                await stderr_task
+                return_code = await p.wait()
+            else:
+                return_code = await stop_sync_gfexport()
+            if return_code != 0:
+                # network error? disk error?
+                logger.warning(
+                    f"{ipaddr}:0 user={user}, cmd={opname},"
+                    f" path={gfarm_path},"
+                    f" return={return_code}, stderr={str(elist)}")
+            elif fill is not None:
+                fill.commit()
+        finally:
+            if fill is not None:
+                fill.abort()  # if not committed
+            if ASYNC_GFEXPORT:
+                # ex. client disconnected: gfexport gets EPIPE
+                close_transfer_pipe(p.stdout)
+            else:
+                await stop_sync_gfexport()  # ex. client disconnected
 
-        while True:
+    async def generate_ranges(parts, tail):
+        chunk = first_byte
+        offset = 0  # of chunk in the file
+        try:
+            for header, start, end in parts:
+                if header:
+                    yield header
+                while chunk:
+                    if offset + len(chunk) > start:
+                        s = max(start - offset, 0)
+                        e = min(end - offset, len(chunk))
+                        yield chunk if e - s == len(chunk) else chunk[s:e]
+                    if offset + len(chunk) >= end:
+                        break
+                    offset += len(chunk)
+                    chunk = await read(BUFSIZE)
+                if not chunk:
+                    logger.warning(
+                        f"{ipaddr}:0 user={user}, cmd={opname},"
+                        f" path={gfarm_path}, unexpected EOF"
+                        f" (offset={offset}, size={size})")
+                    return
+            if tail:
+                yield tail
+        finally:
+            # the rest of the file is not needed
             if ASYNC_GFEXPORT:
-                d = await p.stdout.read(BUFSIZE)
+                if p.returncode is None:
+                    p.kill()
+                close_transfer_pipe(p.stdout)
+                await stderr_task
+                await p.wait()
             else:
-                d = p.stdout.read(BUFSIZE)
-            if not d:
-                break
-            yield d
-        if ASYNC_GFEXPORT:
+                await stop_sync_gfexport()
+
+    if ranges is None:
+        return response(generate())
+    return response(generate_ranges(parts, tail))
+
+
+class PrefetchBudget:
+    """
+    Bytes of file contents buffered by ExportPrefetch.  The file being
+    written (active) may buffer a chunk over the limit, so that it is
+    never blocked by the files read ahead.
+    """
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self, n, prefetch):
+        async with self._condition:
+            await self._condition.wait_for(
+                lambda: (self.used + n <= self.limit
+                         or (prefetch.active and prefetch.buffered == 0)))
+            self.used += n
+            prefetch.buffered += n
+
+    async def release(self, n, prefetch):
+        async with self._condition:
+            self.used -= n
+            prefetch.buffered -= n
+            self._condition.notify_all()
+
+    async def activate(self, prefetch):
+        async with self._condition:
+            prefetch.active = True
+            self._condition.notify_all()
+
+
+class ExportPrefetch:
+    """
+    gfexport of a file started ahead of writing it to an archive.
+    The contents are read into memory within PrefetchBudget.
+    """
+    def __init__(self, env, path, budget: PrefetchBudget):
+        self.path = path
+        self.active = False
+        self.buffered = 0
+        self.elist = []
+        self._budget = budget
+        self._chunks = asyncio.Queue()
+        self._task = asyncio.create_task(self._read(env))
+
+    async def _read(self, env):
+        proc = None
+        try:
+            proc, _ = await gfexport(env, self.path)
+            stderr_task = asyncio.create_task(
+                log_stderr("gfexport", proc, self.elist))
+            while True:
+                data = await proc.stdout.read(BUFSIZE)
+                if not data:
+                    break
+                await self._budget.acquire(len(data), self)
+                self._chunks.put_nowait(data)
             await stderr_task
-            return_code = await p.wait()
-        else:
-            return_code = p.wait()
-        if return_code != 0:
-            # network error? disk error?
-            logger.warning(
-                f"{ipaddr}:0 user={user}, cmd={opname}, path={gfarm_path},"
-                f" return={return_code}, stderr={str(elist)}")
+            return await proc.wait()
+        except asyncio.CancelledError:
+            if proc is not None and proc.returncode is None:
+                proc.kill()
+            raise
+        finally:
+            if proc is not None:
+                close_transfer_pipe(proc.stdout)
+            self._chunks.put_nowait(None)
 
-    ct = get_content_type(gfarm_path)
-    cl = str(size)
-    headers = {"content-length": cl}
-    if action == 'download':
-        filename = os.path.basename(gfarm_path)
-        encoded = urllib.parse.quote(filename, encoding='utf-8')
-        # RFC 5987,8187
-        cd = f"attachment; filename*=UTF-8' '\"{encoded}\""
-        # cd = f"attachment; filename=\"{encoded}\""
-        headers.update({"content-disposition": cd})
-    return StreamingResponse(content=generate(),
-                             media_type=ct,
-                             headers=headers,
-                             )
+    async def chunks(self) -> AsyncGenerator[bytes, None]:
+        await self._budget.activate(self)
+        while True:
+            data = await self._chunks.get()
+            if data is None:
+                break
+            await self._budget.release(len(data), self)
+            yield data
+
+    async def wait(self):
+        # return code of gfexport (raise an error of spawning it)
+        return await self._task
+
+    def cancel(self):
+        # no effect after gfexport exited
+        self._task.cancel()
+
+
+async def prefetch_exports(entries, get_env, depth, budget_size):
+    """
+    Yield (entry, ExportPrefetch or None) for entries (Gfls_Entry) in
+    order, with gfexport started for the next depth regular files.
+    """
+    budget = PrefetchBudget(budget_size)
+
+    def is_regular(entry):
+        return not entry.is_dir and not entry.is_sym
+
+    if depth <= 0:
+        async with contextlib.aclosing(entries) as walk:
+            async for entry in walk:
+                if is_regular(entry):
+                    yield entry, ExportPrefetch(await get_env(), entry.path,
+                                                budget)
+                else:
+                    yield entry, None
+        return
+
+    queue = asyncio.Queue(maxsize=depth)
+    started = []  # ExportPrefetch not yielded
+
+    async def produce():
+        # closing entries ends gfls of the walk when the consumer stops
+        async with contextlib.aclosing(entries) as walk:
+            try:
+                async for entry in walk:
+                    prefetch = None
+                    if is_regular(entry):
+                        prefetch = ExportPrefetch(await get_env(),
+                                                  entry.path, budget)
+                        started.append(prefetch)
+                    await queue.put((entry, prefetch))
+            except Exception:
+                await queue.put(None)
+                raise
+        # no end mark when cancelled: the consumer has stopped, and
+        # it could block on the full queue
+        await queue.put(None)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            if item[1] is not None:
+                started.remove(item[1])
+            yield item
+        await producer
+    finally:
+        # ex. client disconnected
+        if not producer.done():
+            producer.cancel()
+        await asyncio.wait([producer])
+        for prefetch in started:
+            prefetch.cancel()
 
 
 class ZipStreamWriter:
     """
     Stream-like writer for ZipFile that supports async chunk consumption.
+
+    At most max_chunks chunks are buffered for a slow client: the
+    producer awaits drain() before writing, and write() in a thread
+    blocks until get_chunks() consumes them.
     """
     def __init__(self, chunk_size: int = BUFSIZE,
+                 max_chunks: int = ZIP_BUFFER_CHUNKS,
                  loop: Optional[asyncio.AbstractEventLoop] = None):
         self._buffer = deque()  # A queue for storing byte chunks
         self._closed = False
+        self._aborted = False
         self._chunk_size = chunk_size
-        self._current_chunk = bytearray()
-        self._condition = asyncio.Condition()
-        self._lock = threading.Lock()
+        self._max_chunks = max_chunks
+        # reused for the rest of writes smaller than a chunk
+        self._current_chunk = bytearray(chunk_size)
+        self._current_len = 0
+        self._lock = threading.Condition()
+        self._ready = asyncio.Event()  # chunks to consume, or closed
+        self._drained = asyncio.Event()  # below max_chunks
+        self._drained.set()
         self._loop = loop or asyncio.get_running_loop()
 
-    def write(self, data: bytes) -> int:
+    def _in_loop(self) -> bool:
+        try:
+            return asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            return False
+
+    def _wakeup(self):
+        # ZipFile may write in a thread
+        if self._in_loop():
+            self._ready.set()
+        else:
+            self._loop.call_soon_threadsafe(self._ready.set)
+
+    @property
+    def aborted(self) -> bool:
+        return self._aborted
+
+    def _check_open(self):
+        if self._aborted:
+            raise BrokenPipeError("the client has gone")
         if self._closed:
             raise ValueError("I/O operation on closed file.")
 
-        self._current_chunk.extend(data)
-        if len(self._current_chunk) >= self._chunk_size:
+    def write(self, data: bytes) -> int:
+        self._check_open()
+        view = memoryview(data).cast("B")
+        size = len(view)
+        in_loop = self._in_loop()
+        with self._lock:
+            while view:
+                if self._current_len == 0 and len(view) >= self._chunk_size:
+                    chunk = bytes(view[:self._chunk_size])
+                    view = view[self._chunk_size:]
+                else:
+                    n = min(len(view), self._chunk_size - self._current_len)
+                    pos = self._current_len
+                    self._current_chunk[pos:pos + n] = view[:n]
+                    self._current_len += n
+                    view = view[n:]
+                    if self._current_len < self._chunk_size:
+                        break
+                    chunk = bytes(self._current_chunk)
+                    self._current_len = 0
+                if not in_loop:
+                    # blocking a thread (the event loop uses drain())
+                    self._lock.wait_for(
+                        lambda: (len(self._buffer) < self._max_chunks
+                                 or self._aborted))
+                    self._check_open()
+                self._buffer.append(chunk)
+                if len(self._buffer) == 1:
+                    self._wakeup()
+        return size
+
+    async def drain(self):
+        while True:
+            self._check_open()
             with self._lock:
-                while len(self._current_chunk) >= self._chunk_size:
-                    self._buffer.append(
-                        bytes(self._current_chunk[:self._chunk_size]))
-                    del self._current_chunk[:self._chunk_size]
-            self._loop.create_task(self._notify())
-
-        return len(data)
-
-    async def _notify(self):
-        async with self._condition:
-            self._condition.notify_all()
+                if len(self._buffer) < self._max_chunks:
+                    return
+                self._drained.clear()
+            await self._drained.wait()
 
     async def get_chunks(self) -> AsyncGenerator[bytes, None]:
-        while not self._closed or self._buffer:
-            async with self._condition:
-                if not self._buffer:
-                    await self._condition.wait()
+        completed = False
+        try:
+            while True:
                 with self._lock:
-                    while self._buffer:
-                        yield self._buffer.popleft()
-        # Flush remaining data on exit
-        if self._current_chunk:
-            yield bytes(self._current_chunk)
-
+                    if self._buffer:
+                        chunk = self._buffer.popleft()
+                        if len(self._buffer) < self._max_chunks:
+                            self._lock.notify_all()
+                            self._drained.set()
+                    else:
+                        chunk = None
+                        self._ready.clear()
+                        closed = self._closed
+                if chunk is not None:
+                    yield chunk
+                elif closed:
+                    break
+                else:
+                    await self._ready.wait()
+            # Flush remaining data on exit
+            if self._current_len:
+                yield bytes(self._current_chunk[:self._current_len])
+            completed = True
+        finally:
+            if not completed:
+                self.abort()
+
     def close(self):
-        self._closed = True
-        self._loop.create_task(self._notify())
+        with self._lock:
+            self._closed = True
+        self._wakeup()
+
+    def abort(self):
+        # the client has gone: writers raise BrokenPipeError
+        with self._lock:
+            self._aborted = True
+            self._buffer.clear()
+            self._lock.notify_all()
+        self._drained.set()
+        self._ready.set()
 
     def flush(self):
         pass
 
 
+async def archive_paths(env, opname, paths):
+    """
+    Return [(path, is_file)] for /zip and /tar, or raise 404 if a path
+    does not exist.
+    """
+    filedatas = []
+    if len(paths) > 1:
+        # gfstat for many paths at once
+        stats = await file_stats(env, paths)
+        infos = [(filepath, stats[filepath] is not None,
+                  is_regular_file(stats[filepath]))
+                 for filepath in paths]
+    else:
+        infos = []
+        for filepath in paths:
+            existing, is_file, _ = await file_size(env, filepath)
+            infos.append((filepath, existing, is_file))
+    for filepath, existing, is_file in infos:
+        if not existing:
+            code = status.HTTP_404_NOT_FOUND
+            message = f"The requested URL does not exist: {filepath}"
+            stdout = ""
+            elist = []
+            raise gfarm_http_error(opname, code, message, stdout, elist)
+        filedatas.append((filepath, is_file))
+    return filedatas
+
+
+async def archive_entries(env, filedatas) -> AsyncGenerator[Gfls_Entry,
+                                                            None]:
+    """
+    Yield Gfls_Entry of the paths from archive_paths() recursively.
+    dirname is relative to the parent directory of each path.
+    """
+    for filepath, is_file in filedatas:
+        parent = os.path.dirname(filepath)
+        async with contextlib.aclosing(
+                gfls_generator(env, filepath, is_file)) as listing:
+            async for entry in listing:
+                if entry.name == "." or entry.name == "..":
+                    continue
+                dirname = entry.dirname
+                if dirname.startswith(parent):
+                    dirname = dirname.replace(parent, "", 1)
+                if dirname.startswith("/"):
+                    dirname = dirname[1:]
+                dirname = os.path.normpath(dirname)
+                entry.dirname = dirname
+                yield entry
+
+
+async def exported_data(prefetch: ExportPrefetch, size: int, limit: int,
+                        warn) -> AsyncGenerator[bytes, None]:
+    """
+    Yield the first limit bytes of a file read by prefetch.  When the
+    file is not size bytes (the size from gfls in the archive header),
+    it is truncated or padded with zeros like tar, and warn(message)
+    is called.
+    """
+    pos = 0
+    try:
+        async for data in prefetch.chunks():
+            if len(data) > size - pos:
+                warn(f"truncated: size={size}")
+                data = data[:size - pos]
+            yield data
+            pos += len(data)
+            if pos >= limit:
+                break
+    finally:
+        prefetch.cancel()
+    if pos < limit:
+        try:
+            return_code = await prefetch.wait()
+        except Exception as e:
+            return_code = str(e)
+        warn(f"padded with zeros: size={size}, read={pos},"
+             f" return_code={return_code},"
+             f" error={last_emsg(prefetch.elist)}")
+        zeros = bytes(BUFSIZE)
+        while pos < limit:
+            data = zeros[:limit - pos]
+            yield data
+            pos += len(data)
+
+
+# already compressed: stored without compression by /zip
+ZIP_STORED_CONTENT_TYPES = {
+    "application/gzip",
+    "application/java-archive",
+    "application/vnd.rar",
+    "application/x-7z-compressed",
+    "application/x-bzip2",
+    "application/x-hdf5",
+    "application/x-rar-compressed",
+    "application/x-xz",
+    "application/zip",
+    "application/zstd",
+    "audio/aac",
+    "audio/flac",
+    "audio/mp4",
+    "audio/mpeg",
+    "audio/ogg",
+    "image/avif",
+    "image/gif",
+    "image/heic",
+    "image/jpeg",
+    "image/png",
+    "image/webp",
+    "video/mp4",
+    "video/mpeg",
+    "video/quicktime",
+    "video/webm",
+    "video/x-matroska",
+}
+
+
+def zip_compress_type(filename, store):
+    if store or get_content_type(filename) in ZIP_STORED_CONTENT_TYPES:
+        return zipfile.ZIP_STORED
+    # ex. .gz, .bz2, .xz (content type without the encoding)
+    _, encoding = mimetypes.guess_type(filename)
+    if encoding is not None:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def set_compress_level(zipinfo, level):
+    # ZipFile.open(zipinfo, "w") has no compresslevel argument, and
+    # takes the level from zipinfo only (ignored if not supported)
+    if hasattr(zipinfo, "compress_level"):
+        zipinfo.compress_level = level  # Python 3.13 or later
+    elif hasattr(zipinfo, "_compresslevel"):
+        zipinfo._compresslevel = level
+
+
+# sizes and offsets over this are written in ZIP64 extra fields
+ZIP64_LIMIT = zipfile.ZIP64_LIMIT
+ZIP_MAX_UINT32 = 0xFFFFFFFF
+ZIP_DATA_DESCRIPTOR = b"PK\x07\x08"
+ZIP_FLAG_DATA_DESCRIPTOR = 0x08
+ZIP_FLAG_UTF8 = 0x800
+
+
+def zip_dos_date_time(mtime):
+    # (date, time) of zip headers (1980-2107)
+    t = time.localtime(mtime)[:6]
+    if t[0] < 1980:
+        t = (1980, 1, 1, 0, 0, 0)
+    elif t[0] > 2107:
+        t = (2107, 12, 31, 23, 59, 58)
+    return ((t[0] - 1980) << 9 | t[1] << 5 | t[2],
+            t[3] << 11 | t[4] << 5 | t[5] // 2)
+
+
+class StoredZipMember:
+    """
+    An entry of StoredZip.  The contents of a regular file are read by
+    gfexport (exported) and followed by a data descriptor with CRC-32.
+    The local header has the sizes from gfls for streaming readers.
+    """
+    def __init__(self, name: str, entry: Gfls_Entry, offset: int):
+        self.entry = entry
+        self.offset = offset
+        external_attr = entry.mode & 0xFFFF
+        if entry.is_sym:
+            external_attr |= stat.S_IFLNK
+            self.data = entry.linkname.encode()
+        elif entry.is_dir:
+            external_attr |= stat.S_IFDIR
+            self.data = b""
+        else:
+            external_attr |= stat.S_IFREG
+            self.data = None if entry.size > 0 else b""
+        self.external_attr = external_attr << 16
+        if entry.is_dir:
+            self.external_attr |= 0x10  # MS-DOS directory
+        self.exported = self.data is None
+        if self.exported:
+            self.size = entry.size
+            self.crc = None  # after reading
+        else:
+            self.size = len(self.data)
+            self.crc = zlib.crc32(self.data)
+        try:
+            self.name = name.encode("ascii")
+            self.flag_bits = 0
+        except UnicodeEncodeError:
+            self.name = name.encode("utf-8")
+            self.flag_bits = ZIP_FLAG_UTF8
+        if self.exported:
+            self.flag_bits |= ZIP_FLAG_DATA_DESCRIPTOR
+        self.dosdate, self.dostime = zip_dos_date_time(entry.mtime)
+        self.zip64 = self.size >= ZIP64_LIMIT
+        self.data_offset = offset + len(self.local_header())
+        self.data_end = self.data_offset + self.size
+        self.end = self.data_end
+        if self.exported:
+            self.end += 24 if self.zip64 else 16
+        self.central_size = len(self.central_header())
+
+    def local_header(self) -> bytes:
+        size = self.size
+        extra = b""
+        if self.zip64:
+            size = ZIP_MAX_UINT32
+            extra = struct.pack("<HHQQ", 1, 16, self.size, self.size)
+        crc = 0 if self.exported else self.crc
+        version = 45 if self.zip64 else 20
+        return struct.pack(
+            zipfile.structFileHeader, zipfile.stringFileHeader,
+            version, 0, self.flag_bits, zipfile.ZIP_STORED,
+            self.dostime, self.dosdate, crc, size, size,
+            len(self.name), len(extra)) + self.name + extra
+
+    def descriptor(self) -> bytes:
+        fmt = "<4sLQQ" if self.zip64 else "<4sLLL"
+        return struct.pack(fmt, ZIP_DATA_DESCRIPTOR,
+                           self.crc, self.size, self.size)
+
+    def central_header(self) -> bytes:
+        # the same size before CRC-32 is known
+        size = self.size
+        offset = self.offset
+        fields = []
+        if self.size >= ZIP64_LIMIT:
+            size = ZIP_MAX_UINT32
+            fields += [self.size, self.size]
+        if self.offset >= ZIP64_LIMIT:
+            offset = ZIP_MAX_UINT32
+            fields.append(self.offset)
+        extra = b""
+        if fields:
+            extra = struct.pack(f"<HH{len(fields)}Q", 1, 8 * len(fields),
+                                *fields)
+        version = 45 if fields else 20
+        return struct.pack(
+            zipfile.structCentralDir, zipfile.stringCentralDir,
+            version, 3, version, 0, self.flag_bits, zipfile.ZIP_STORED,
+            self.dostime, self.dosdate, self.crc or 0, size, size,
+            len(self.name), len(extra), 0, 0, 0, self.external_attr,
+            offset) + self.name + extra
+
+
+class StoredZip:
+    """
+    Layout of a zip archive without compression (POST /zip with store)
+    computed from gfls sizes before streaming, for Content-Length and
+    Range.  ZIP64 records are written for large archives.
+    """
+    def __init__(self, entries):
+        # entries: list of (name in the archive, Gfls_Entry)
+        self.members = []
+        offset = 0
+        for name, entry in entries:
+            member = StoredZipMember(name, entry, offset)
+            self.members.append(member)
+            offset = member.end
+        self.cd_offset = offset
+        self.cd_size = sum(m.central_size for m in self.members)
+        self.zip64 = (len(self.members) >= zipfile.ZIP_FILECOUNT_LIMIT
+                      or self.cd_offset >= ZIP64_LIMIT
+                      or self.cd_size >= ZIP64_LIMIT)
+        self.size = self.cd_offset + self.cd_size + len(self.end_records())
+
+    def etag(self):
+        # names, sizes, modes and mtimes in seconds, not the contents:
+        # weak, so that If-Range (strong comparison) never matches it
+        h = hashlib.sha256()
+        for m in self.members:
+            h.update(m.central_header())
+        return f'W/"{h.hexdigest()[:32]}"'
+
+    def end_records(self) -> bytes:
+        count = len(self.members)
+        cd_size = self.cd_size
+        cd_offset = self.cd_offset
+        records = b""
+        if self.zip64:
+            records = struct.pack(
+                zipfile.structEndArchive64, zipfile.stringEndArchive64,
+                44, 45, 45, 0, 0, count, count, cd_size, cd_offset)
+            records += struct.pack(
+                zipfile.structEndArchive64Locator,
+                zipfile.stringEndArchive64Locator,
+                0, cd_offset + cd_size, 1)
+            count = min(count, 0xFFFF)
+            cd_size = min(cd_size, ZIP_MAX_UINT32)
+            cd_offset = min(cd_offset, ZIP_MAX_UINT32)
+        return records + struct.pack(
+            zipfile.structEndArchive, zipfile.stringEndArchive,
+            0, 0, count, count, cd_size, cd_offset, 0)
+
+    def central_directory(self) -> bytes:
+        # after CRC-32 of all exported files
+        return (b"".join(m.central_header() for m in self.members)
+                + self.end_records())
+
+
 @app.post("/zip")
 async def zip_export(request: Request,
                      paths: List[str] = Form(...),
-                     authorization: Union[str, None] = Header(default=None)):
+                     compress_level: Optional[int] = Form(default=None,
+                                                          ge=0, le=9),
+                     store: bool = Form(default=False),
+                     authorization: Union[str, None] = Header(default=None),
+                     http_range: Union[str, None] = Header(
+                         default=None, alias="Range"),
+                     if_range: Union[str, None] = Header(default=None)):
+    # compress_level: of deflate (None: the default of zlib)
+    # store: no compression (otherwise compressed content types are
+    #        stored by zip_compress_type()), with Content-Length and
+    #        Range support by StoredZip (a weak ETag: If-Range sends
+    #        the whole archive)
     opname = "gfexport"
     apiname = "/zip"
     env = await set_env(request, authorization)
     user = get_user_from_env(env)
     ipaddr = get_client_ip_from_env(env)
     log_operation(env, request.method, apiname, opname, paths)
-    filedatas = []
-    for filepath in paths:
-        existing, is_file, _ = await file_size(env, filepath)
-        if not existing:
-            code = status.HTTP_404_NOT_FOUND
-            message = f"The requested URL does not exist: {filepath}"
-            stdout = ""
-            elist = []
-            raise gfarm_http_error(opname, code, message, stdout, elist)
-        filedatas.append((filepath, is_file))
+    filedatas = await archive_paths(env, opname, paths)
 
-    async def add_entry_to_zip(zipf: zipfile.ZipFile, entry: Gfls_Entry):
+    async def add_entry_to_zip(zipf: zipfile.ZipFile, entry: Gfls_Entry,
+                               prefetch: Optional[ExportPrefetch],
+                               zip_writer: ZipStreamWriter):
         rel_path = os.path.join(entry.dirname, entry.name)
         logger.debug(f"rel_path {rel_path}")
 
         zipinfo = zipfile.ZipInfo(filename=rel_path)
         zipinfo.date_time = time.localtime(entry.mtime)[:6]
-        zipinfo.compress_type = zipfile.ZIP_DEFLATED
+        zipinfo.compress_type = zip_compress_type(entry.name, store)
         zipinfo.external_attr = (entry.mode & 0xFFFF) << 16
 
         if entry.is_sym:
             zipinfo.create_system = 3  # Unix
             zipinfo.external_attr |= 0xA000 << 16  # symlink bit
-            zipf.writestr(zipinfo, entry.linkname.encode())
+            zipf.writestr(zipinfo, entry.linkname.encode(),
+                          compresslevel=compress_level)
         elif entry.is_dir:
             zipinfo.external_attr |= 0x4000 << 16  # directory bit
             if not rel_path.endswith('/'):
                 zipinfo.filename += '/'
-            zipf.writestr(zipinfo, b'')
+            zipf.writestr(zipinfo, b'', compresslevel=compress_level)
         else:
             try:
-                env = await set_env(request, authorization)
-                proc, _ = await gfexport(env, entry.path)
-                elist = []
-                stderr_task = asyncio.create_task(
-                    log_stderr(opname, proc, elist))
-                with zipf.open(zipinfo, 'w') as dest:
-                    while True:
-                        chunk = await proc.stdout.read(BUFSIZE)
-                        if not chunk:
-                            break
-                        dest.write(chunk)
-                await stderr_task
-                return_code = await proc.wait()
+                # gfexport started by prefetch_exports()
+                set_compress_level(zipinfo, compress_level)
+                dest = zipf.open(zipinfo, 'w')
+                try:
+                    async for data in prefetch.chunks():
+                        # not to block a thread for a slow client
+                        await zip_writer.drain()
+                        # compressed in a thread (zlib releases the GIL)
+                        await asyncio.to_thread(dest.write, data)
+                finally:
+                    prefetch.cancel()
+                    await asyncio.to_thread(dest.close)
+                return_code = await prefetch.wait()
                 if return_code != 0:
-                    raise
+                    raise Exception(last_emsg(prefetch.elist))
+            except BrokenPipeError:
+                raise  # the client has gone: create_zip() stops
             except Exception as e:
                 message = f"zip create error: path={entry.path}: {str(e)}"
                 logger.debug(
@@ -2594,28 +5039,166 @@ async def zip_export(request: Request,
                     f" message={message}")
                 return
 
+    async def get_env():
+        return await set_env(request, authorization)
+
+    def warn(path, message):
+        logger.warning(f"{ipaddr}:0 user={user}, cmd={opname},"
+                       f" path={path}, message={message}")
+
+    def clip(data, pos, start, end):
+        # the part of data at pos of the archive in [start, end)
+        return data[max(start - pos, 0):max(end - pos, 0)]
+
+    async def export_member(m: StoredZipMember, prefetch: ExportPrefetch,
+                            start, end, need_crc):
+        # need_crc=False: the data descriptor is not in the range
+        limit = m.size if need_crc else min(m.size, end - m.data_offset)
+        pos = m.data_offset
+        crc = 0
+        async with contextlib.aclosing(exported_data(
+                prefetch, m.size, limit,
+                functools.partial(warn, m.entry.path))) as chunks:
+            async for data in chunks:
+                if len(data) > 65536:
+                    # zlib releases the GIL
+                    crc = await asyncio.to_thread(zlib.crc32, data, crc)
+                else:
+                    crc = zlib.crc32(data, crc)
+                yield clip(data, pos, start, end)
+                pos += len(data)
+        if need_crc:
+            m.crc = crc
+            yield clip(m.descriptor(), m.data_end, start, end)
+
+    async def stored_content(stored: StoredZip, start, end):
+        # bytes [start, end) of the archive
+        # the central directory needs CRC-32 of all exported files
+        need_all = end > stored.cd_offset
+
+        def needed(m):
+            return m.exported and (need_all or (m.offset < end
+                                                and m.end > start))
+
+        async def exported_entries():
+            for m in stored.members:
+                if needed(m):
+                    yield m.entry
+
+        async with contextlib.aclosing(prefetch_exports(
+                exported_entries(), get_env, ZIP_PREFETCH_FILES,
+                ZIP_PREFETCH_SIZE * 1024 * 1024)) as prefetches:
+            for m in stored.members:
+                if m.offset >= end:
+                    break
+                if needed(m):
+                    _, prefetch = await anext(prefetches)
+                    yield clip(m.local_header(), m.offset, start, end)
+                    need_crc = need_all or m.data_end < end
+                    async for data in export_member(m, prefetch, start, end,
+                                                    need_crc):
+                        if data:
+                            yield data
+                elif not m.exported and m.end > start:
+                    yield clip(m.local_header() + m.data, m.offset,
+                               start, end)
+        if need_all:
+            yield clip(stored.central_directory(), stored.cd_offset,
+                       start, end)
+
+    if store:
+        try:
+            entries = []
+            async for entry in archive_entries(env, filedatas):
+                name = zipfile.ZipInfo(
+                    os.path.join(entry.dirname, entry.name)).filename
+                if entry.is_dir and not name.endswith('/'):
+                    name += '/'
+                entries.append((name, entry))
+        except RuntimeError as e:
+            code = status.HTTP_500_INTERNAL_SERVER_ERROR
+            message = f"Failed to execute gfls: paths={paths}"
+            elist = []
+            raise gfarm_http_error(opname, code, message, str(e), elist)
+        stored = StoredZip(entries)
+        size = stored.size
+        headers = {"accept-ranges": "bytes", "etag": stored.etag()}
+        ranges = None
+        if (http_range is not None
+                and if_range_matches(if_range, headers["etag"], None)):
+            ranges = parse_range(http_range, size)
+            if ranges == []:
+                code = status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+                return Response(
+                    status_code=code,
+                    headers={"content-range": f"bytes */{size}"})
+        status_code = status.HTTP_200_OK
+        media_type = "application/zip"
+        if ranges is None:
+            parts, tail = [(b"", 0, size)], b""
+            content_length = size
+        elif len(ranges) == 1:
+            status_code = status.HTTP_206_PARTIAL_CONTENT
+            start, end = ranges[0]
+            parts, tail = [(b"", start, end)], b""
+            headers["content-range"] = f"bytes {start}-{end - 1}/{size}"
+            content_length = end - start
+        else:
+            status_code = status.HTTP_206_PARTIAL_CONTENT
+            parts, tail, media_type, content_length = byteranges(
+                ranges, size, media_type)
+        headers["content-length"] = str(content_length)
+        logger.debug(f"{ipaddr}:0 user={user}, cmd={opname},"
+                     f" entries={len(entries)}, size={size},"
+                     f" ranges={ranges}")
+
+        async def generate_stored():
+            for header, start, end in parts:
+                if header:
+                    yield header
+                async for data in stored_content(stored, start, end):
+                    yield data
+            if tail:
+                yield tail
+
+        zipname = ('download_' + datetime.now().strftime('%Y%m%d-%H%M%S')
+                   + '.zip')
+        headers["content-disposition"] = f'attachment; filename="{zipname}"'
+        return StreamingResponse(
+            content=generate_stored(),
+            status_code=status_code,
+            media_type=media_type,
+            headers=headers)
+
     async def create_zip(zip_writer):
+        zf = None
         try:
-            with zipfile.ZipFile(zip_writer, "w",
-                                 compression=zipfile.ZIP_DEFLATED) as zf:
-                for filepath, is_file in filedatas:
-                    parent = os.path.dirname(filepath)
-                    async for entry in gfls_generator(env, filepath, is_file):
-                        if entry.name == "." or entry.name == "..":
-                            continue
-                        dirname = entry.dirname
-                        if dirname.startswith(parent):
-                            dirname = dirname.replace(parent, "", 1)
-                        if dirname.startswith("/"):
-                            dirname = dirname[1:]
-                        dirname = os.path.normpath(dirname)
-                        entry.dirname = dirname
-                        await add_entry_to_zip(zf, entry)
+            try:
+                zf = zipfile.ZipFile(zip_writer, "w",
+                                     compression=zipfile.ZIP_DEFLATED,
+                                     compresslevel=compress_level)
+                async with contextlib.aclosing(prefetch_exports(
+                        archive_entries(env, filedatas), get_env,
+                        ZIP_PREFETCH_FILES,
+                        ZIP_PREFETCH_SIZE * 1024 * 1024)) as entries:
+                    async for entry, prefetch in entries:
+                        # paused while the client is slow
+                        await zip_writer.drain()
+                        await add_entry_to_zip(zf, entry, prefetch,
+                                               zip_writer)
+            finally:
+                if zf is not None and not zip_writer.aborted:
+                    # the central directory
+                    await asyncio.to_thread(zf.close)
+        except BrokenPipeError as e:
+            logger.debug(f"{ipaddr}:0 user={user}, cmd={opname}, " +
+                         f" message=zip aborted: {str(e)}")
         finally:
             zip_writer.close()
 
     async def generate():
         zip_writer = ZipStreamWriter(chunk_size=BUFSIZE,
+                                     max_chunks=ZIP_BUFFER_CHUNKS,
                                      loop=asyncio.get_running_loop())
         asyncio.create_task(create_zip(zip_writer))
         async for chunk in zip_writer.get_chunks():
@@ -2629,11 +5212,369 @@ async def zip_export(request: Request,
         headers=headers)
 
 
+def tar_header(entry: Gfls_Entry, name: str) -> bytes:
+    # POSIX.1-2001 (pax) header with extended records if needed
+    info = tarfile.TarInfo(name)
+    info.mtime = int(entry.mtime)
+    info.mode = entry.mode & 0o7777
+    info.uname = entry.uname or ""
+    info.gname = entry.gname or ""
+    if entry.is_sym:
+        info.type = tarfile.SYMTYPE
+        info.linkname = entry.linkname
+    elif entry.is_dir:
+        info.type = tarfile.DIRTYPE
+    else:
+        info.size = entry.size
+    return info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+
+
+async def coalesce_chunks(chunks, size=BUFSIZE):
+    # tar headers are 512 bytes: join small chunks up to size
+    buf = bytearray()
+    async with contextlib.aclosing(chunks) as chunks:
+        async for data in chunks:
+            if len(data) >= size:
+                if buf:
+                    yield bytes(buf)
+                    buf.clear()
+                yield data
+                continue
+            buf += data
+            if len(buf) >= size:
+                yield bytes(buf)
+                buf.clear()
+    if buf:
+        yield bytes(buf)
+
+
+async def gzip_stream(chunks, level):
+    # compressed in threads (zlib releases the GIL)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    async with contextlib.aclosing(chunks) as chunks:
+        async for data in chunks:
+            out = await asyncio.to_thread(compressor.compress, data)
+            if out:
+                yield out
+    yield await asyncio.to_thread(compressor.flush)
+
+
+async def zstd(env, level):
+    args = ["-q", "-c", f"-{level}", "-T0"]
+    return await gf_spawn(
+        'zstd', *args,
+        env=env,
+        stdin=TRANSFER_PIPE,
+        stdout=TRANSFER_PIPE,
+        stderr=asyncio.subprocess.PIPE)
+
+
+async def zstd_stream(env, chunks, level):
+    # compressed by zstd command (multithreaded)
+    opname = "zstd"
+    p = await zstd(env, level)
+    elist = []
+    stderr_task = asyncio.create_task(log_stderr(opname, p, elist))
+
+    async def feed():
+        try:
+            async with contextlib.aclosing(chunks) as c:
+                async for data in c:
+                    p.stdin.write(data)
+                    await p.stdin.drain()
+        finally:
+            close_transfer_pipe(p.stdin)
+
+    feeder = asyncio.create_task(feed())
+    try:
+        while True:
+            data = await p.stdout.read(BUFSIZE)
+            if not data:
+                break
+            yield data
+        await feeder
+        await stderr_task
+        return_code = await p.wait()
+        if return_code != 0:
+            raise RuntimeError(f"zstd failed: {last_emsg(elist)}")
+    finally:
+        if not feeder.done():
+            feeder.cancel()
+        if p.returncode is None:
+            p.kill()
+        close_transfer_pipe(p.stdout)
+
+
+TAR_COMPRESSIONS = {
+    # name: (media type, suffix, default level, max level)
+    "gzip": ("application/gzip", ".tar.gz", 6, 9),
+    "zstd": ("application/zstd", ".tar.zst", 3, 19),
+}
+
+
+@app.post("/tar")
+async def tar_export(request: Request,
+                     paths: List[str] = Form(...),
+                     compression: Optional[Literal['gzip', 'zstd']] = Form(
+                         default=None),
+                     compress_level: Optional[int] = Form(default=None,
+                                                          ge=1, le=19),
+                     authorization: Union[str, None] = Header(default=None)):
+    # compression: None (tar), gzip or zstd
+    # compress_level: gzip 1-9, zstd 1-19
+    opname = "gfexport"
+    apiname = "/tar"
+    env = await set_env(request, authorization)
+    user = get_user_from_env(env)
+    ipaddr = get_client_ip_from_env(env)
+    log_operation(env, request.method, apiname, opname, paths)
+    media_type = "application/x-tar"
+    suffix = ".tar"
+    if compression is not None:
+        media_type, suffix, default_level, max_level = \
+            TAR_COMPRESSIONS[compression]
+        if compress_level is None:
+            compress_level = default_level
+        if compress_level > max_level:
+            code = status.HTTP_400_BAD_REQUEST
+            message = (f"compress_level of {compression} must be"
+                       f" 1-{max_level}: {compress_level}")
+            raise gfarm_http_error(opname, code, message, "", [])
+        if (compression == "zstd"
+                and gf_executable("zstd", env.get("PATH", os.defpath))
+                is None):
+            code = status.HTTP_501_NOT_IMPLEMENTED
+            message = "zstd command is not available"
+            raise gfarm_http_error(opname, code, message, "", [])
+    filedatas = await archive_paths(env, opname, paths)
+
+    async def get_env():
+        return await set_env(request, authorization)
+
+    def warn(path, message):
+        logger.warning(f"{ipaddr}:0 user={user}, cmd={opname},"
+                       f" path={path}, message={message}")
+
+    async def tar_blocks():
+        total = 0
+        async with contextlib.aclosing(prefetch_exports(
+                archive_entries(env, filedatas), get_env,
+                ZIP_PREFETCH_FILES,
+                ZIP_PREFETCH_SIZE * 1024 * 1024)) as entries:
+            try:
+                async for entry, prefetch in entries:
+                    name = os.path.normpath(
+                        os.path.join(entry.dirname, entry.name))
+                    header = tar_header(entry, name)
+                    total += len(header)
+                    yield header
+                    if prefetch is None:
+                        continue
+                    async with contextlib.aclosing(exported_data(
+                            prefetch, entry.size, entry.size,
+                            functools.partial(warn, entry.path))) as chunks:
+                        async for data in chunks:
+                            total += len(data)
+                            yield data
+                    padding = -entry.size % tarfile.BLOCKSIZE
+                    if padding:
+                        total += padding
+                        yield bytes(padding)
+            except RuntimeError as e:
+                # gfls: the entries listed are archived
+                logger.warning(f"{ipaddr}:0 user={user}, cmd={opname},"
+                               f" paths={paths}, error={str(e)}")
+        # end-of-archive, padded to a record like tarfile
+        end = tarfile.BLOCKSIZE * 2
+        end += -(total + end) % tarfile.RECORDSIZE
+        yield bytes(end)
+
+    async def generate():
+        chunks = coalesce_chunks(tar_blocks())
+        if compression == "gzip":
+            chunks = gzip_stream(chunks, compress_level)
+        elif compression == "zstd":
+            chunks = zstd_stream(await get_env(), chunks, compress_level)
+        async with contextlib.aclosing(chunks) as chunks:
+            async for data in chunks:
+                yield data
+
+    tarname = ('download_' + datetime.now().strftime('%Y%m%d-%H%M%S')
+               + suffix)
+    headers = {"Content-Disposition": f'attachment; filename="{tarname}"'}
+    return StreamingResponse(
+        content=generate(),
+        media_type=media_type,
+        headers=headers)
+
+
+# RFC 9530 names -> hashlib names
+DIGEST_ALGORITHMS = {
+    "md5": "md5",
+    "sha": "sha1",
+    "sha-256": "sha256",
+    "sha-512": "sha512",
+}
+
+GFARM_CONFIG_FILES = ["/etc/gfarm2.conf", "/usr/local/etc/gfarm2.conf"]
+
+
+def gfarm_digest_type():
+    """
+    Return the type of the "digest" statement in the Gfarm
+    configuration (the user's file first as Gfarm does), or None.
+    """
+    if GFARM_CONFIG_FILE:
+        user_conf = os.path.expanduser(GFARM_CONFIG_FILE)
+    else:
+        user_conf = os.path.expanduser("~/.gfarm2rc")
+    for path in [user_conf] + GFARM_CONFIG_FILES:
+        try:
+            with open(path) as f:
+                for line in f:
+                    words = line.split()
+                    if len(words) >= 2 and words[0] == "digest":
+                        return words[1].lower()
+        except OSError:
+            continue
+    return None
+
+
+def upload_digest_type():
+    if UPLOAD_DIGEST_TYPE is not None:
+        digest_type = UPLOAD_DIGEST_TYPE.lower()
+        if digest_type == "no":
+            return None
+    else:
+        digest_type = gfarm_digest_type() or "md5"
+    if digest_type not in hashlib.algorithms_available:
+        logger.warning(f"Unsupported digest type: {digest_type}")
+        return None
+    return digest_type
+
+
+REPR_DIGEST_MEMBER = re.compile(r"\s*([a-z0-9*_.-]+)\s*=\s*:([^:]*):\s*")
+
+
+def parse_upload_digests(content_md5, repr_digest):
+    """
+    Return {hashlib name: digest} expected by Content-MD5 and
+    Repr-Digest (RFC 9530).  Unknown algorithms are ignored.
+    Raise ValueError if malformed.
+    """
+    expected = {}
+    if content_md5 is not None:
+        expected["md5"] = base64.b64decode(content_md5, validate=True)
+    if repr_digest is not None:
+        for member in repr_digest.split(","):
+            m = REPR_DIGEST_MEMBER.fullmatch(member)
+            if m is None:
+                raise ValueError(f"Invalid Repr-Digest: {repr_digest}")
+            name = DIGEST_ALGORITHMS.get(m.group(1))
+            if name is not None:
+                expected[name] = base64.b64decode(m.group(2), validate=True)
+    return expected
+
+
+class UploadDigest:
+    """
+    Digests of an upload computed while it is written to gfreg.
+    Large chunks are hashed in a thread (hashlib releases the GIL).
+    """
+    THREAD_MIN = 64 * 1024
+
+    def __init__(self, algorithms):
+        self._hashes = {name: hashlib.new(name, usedforsecurity=False)
+                        for name in algorithms}
+
+    def _update(self, data):
+        for h in self._hashes.values():
+            h.update(data)
+
+    async def update(self, data):
+        if not self._hashes:
+            return
+        if len(data) < self.THREAD_MIN:
+            self._update(data)
+        else:
+            await asyncio.to_thread(self._update, data)
+
+    def mismatch(self, expected):
+        """
+        Return the names of algorithms whose digests differ.
+        """
+        return [name for name, digest in expected.items()
+                if self._hashes[name].digest() != digest]
+
+    def repr_digest(self):
+        names = {v: k for k, v in DIGEST_ALGORITHMS.items()}
+        return ", ".join(
+            f"{names.get(name, name)}="
+            f":{base64.b64encode(h.digest()).decode()}:"
+            for name, h in self._hashes.items())
+
+
+def upload_tmppath(gfarm_path):
+    # NOTE: MAXNAMLEN == 255
+    filename_prefix = os.path.basename(gfarm_path)[:128]
+
+    choices = string.ascii_letters + string.digits
+    randstr = ''.join(random.choices(choices, k=8))
+    tmpname = "gfarm-http.upload." + filename_prefix + "." + randstr
+    return os.path.join(os.path.dirname(gfarm_path), tmpname)
+
+
+async def commit_upload(request, authorization, opname, gfarm_path, tmppath,
+                        args, return_code, error, elist):
+    """
+    Rename tmppath registered by gfreg to gfarm_path, or remove it
+    and raise HTTPException when gfreg or gfmv failed.  (error: an
+    exception while writing, or HTTPException to raise)
+    """
+    env = await set_env(request, authorization)  # may refresh
+    user = get_user_from_env(env)
+    ipaddr = get_client_ip_from_env(env)
+    if return_code == 0 and error is None:
+        gfmv_cmd = "gfmv"
+        p2 = await gfmv(env, tmppath, gfarm_path)
+        stderr_task2 = asyncio.create_task(log_stderr(gfmv_cmd, p2, elist))
+        await stderr_task2
+        return_code = await p2.wait()
+        stat_cache.invalidate(tmppath, gfarm_path)
+        logger.debug(f"{ipaddr}:0 user={user}, cmd={gfmv_cmd}, src={tmppath},"
+                     f" dest={gfarm_path}, return={return_code}")
+        if return_code == 0:
+            return Response(status_code=200)
+
+    # error case
+    env = await set_env(request, authorization)  # may refresh
+    p3 = await gfrm(env, tmppath, force=True)
+    gfrm_cmd = "gfrm"
+    stderr_task3 = asyncio.create_task(log_stderr(gfrm_cmd, p3, elist))
+    await stderr_task3
+    # ignore error
+    return_code = await p3.wait()
+    logger.debug(f"{ipaddr}:0 user={user}, cmd={gfrm_cmd}, path={tmppath},"
+                 f" return={return_code}")
+
+    if isinstance(error, HTTPException):
+        raise error
+    code = status.HTTP_500_INTERNAL_SERVER_ERROR
+    if error:
+        message = f"I/O error({str(error)}): path={gfarm_path}"
+    else:
+        message = f"Failed to execute: gfreg {' '.join(args)}"
+    stdout = ""
+    raise gfarm_http_error(opname, code, message, stdout, elist)
+
+
 @app.put("/file/{gfarm_path:path}")
 async def file_import(gfarm_path: str,
                       request: Request,
                       x_file_timestamp:
                       Union[str, None] = Header(default=None),
+                      content_md5: Union[str, None] = Header(default=None),
+                      repr_digest: Union[str, None] = Header(default=None),
                       authorization: Union[str, None] = Header(default=None),
                       x_csrf_token: Union[str, None] = Header(default=None)):
     check_csrf(request, x_csrf_token)
@@ -2641,103 +5582,1067 @@ async def file_import(gfarm_path: str,
     opname = "gfreg"
     apiname = "/file"
     gfarm_path = fullpath(gfarm_path)
-    filename = os.path.basename(gfarm_path)
-    dirname = os.path.dirname(gfarm_path)
     env = await set_env(request, authorization)
     user = get_user_from_env(env)
     ipaddr = get_client_ip_from_env(env)
     log_operation(env, request.method, apiname, opname, gfarm_path)
 
-    # NOTE: MAXNAMLEN == 255
-    filename_prefix = filename[:128]
+    try:
+        expected = parse_upload_digests(content_md5, repr_digest)
+    except ValueError as e:
+        code = status.HTTP_400_BAD_REQUEST
+        message = f"Invalid digest ({str(e)}): path={gfarm_path}"
+        raise gfarm_http_error(opname, code, message, "", [])
+    digest_type = upload_digest_type()
+    algorithms = set(expected)
+    if digest_type is not None:
+        algorithms.add(digest_type)
+    digest = UploadDigest(sorted(algorithms))
+
+    tmppath = upload_tmppath(gfarm_path)
+
+    p, args = await gfreg(env, tmppath, x_file_timestamp)
+    elist = []
+    stderr_task = asyncio.create_task(log_stderr(opname, p, elist))
+    error = None
+    try:
+        async for chunk in request.stream():
+            p.stdin.write(chunk)
+            # hash while gfreg reads the chunk
+            await asyncio.gather(digest.update(chunk),
+                                 p.stdin.drain())  # speedup
+    except Exception as e:
+        logger.exception(f"{ipaddr}:0 user={user}, cmd={opname},"
+                         f" path={tmppath}")
+        error = e
+
+    p.stdin.close()
+    await stderr_task
+    return_code = await p.wait()
+    logger.debug(f"{ipaddr}:0 user={user}, cmd={opname}, path={tmppath},"
+                 f" return={return_code}")
+
+    if return_code == 0 and error is None:
+        mismatch = digest.mismatch(expected)
+        if mismatch:
+            code = status.HTTP_400_BAD_REQUEST
+            message = (f"Digest mismatch ({', '.join(mismatch)}):"
+                       f" path={gfarm_path}")
+            error = gfarm_http_error(opname, code, message, "", [])
+
+    response = await commit_upload(request, authorization, opname,
+                                   gfarm_path, tmppath, args, return_code,
+                                   error, elist)
+    if algorithms:
+        response.headers["Repr-Digest"] = digest.repr_digest()
+    return response
+
+
+@app.delete("/file/{gfarm_path:path}")
+async def file_remove(gfarm_path: str,
+                      request: Request,
+                      force: bool = False,
+                      recursive: bool = False,
+                      authorization: Union[str, None] = Header(default=None),
+                      x_csrf_token: Union[str, None] = Header(default=None)):
+    check_csrf(request, x_csrf_token)
+    opname = "gfrm"
+    apiname = "/file"
+    gfarm_path = fullpath(gfarm_path)
+    env = await set_env(request, authorization)
+    log_operation(env, request.method, apiname, opname, gfarm_path)
+    p = await gfrm(env, gfarm_path, force, recursive)
+    return await gfarm_command_standard_response(env, p, opname,
+                                                 invalidate=[gfarm_path])
+
+
+class UploadSession:
+    """
+    A resumable upload staged in a directory on local disk.
+
+    "session.json" has the owner, the destination and the length of
+    the upload, and "data" has the bytes received so far, so that
+    every worker process can continue the upload.
+
+    A multipart upload has parts in "parts/<part number>.<MD5>"
+    instead, and "data" is empty (locked to complete the upload).
+    """
+    def __init__(self, directory, upload_id, meta):
+        self.directory = directory
+        self.id = upload_id
+        self.user = meta["user"]
+        self.path = meta["path"]
+        self.length = meta.get("length")
+        self.mtime = meta.get("mtime")
+        self.multipart = meta.get("multipart", False)
+
+    @property
+    def data_path(self):
+        return os.path.join(self.directory, "data")
+
+    @property
+    def parts_dir(self):
+        return os.path.join(self.directory, "parts")
+
+    def touch(self):
+        # not to expire
+        os.utime(self.data_path)
+
+    def part_tmpfile(self):
+        return tempfile.NamedTemporaryFile(dir=self.parts_dir, prefix=".",
+                                           delete=False)
+
+    def commit_part(self, tmpname, number, etag):
+        name = f"{number}.{etag}"
+        os.rename(tmpname, os.path.join(self.parts_dir, name))
+        # replaced
+        for old in os.listdir(self.parts_dir):
+            if old.startswith(f"{number}.") and old != name:
+                try:
+                    os.remove(os.path.join(self.parts_dir, old))
+                except OSError:
+                    pass
+        self.touch()
+
+    def parts(self):
+        """
+        Return {part number: (file path, MD5 in hex, size)}.
+        """
+        parts = {}
+        for name in os.listdir(self.parts_dir):
+            number, _, etag = name.partition(".")
+            if not number.isdigit():
+                continue  # ex. a part being uploaded
+            path = os.path.join(self.parts_dir, name)
+            try:
+                size = os.stat(path).st_size
+            except OSError:
+                continue  # replaced
+            parts[int(number)] = (path, etag, size)
+        return parts
+
+    def offset(self):
+        return os.stat(self.data_path).st_size
+
+    def open_data(self):
+        """
+        Return the data file locked exclusively, or None when another
+        request is using the session.
+        """
+        f = open(self.data_path, "r+b")
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            return None
+        return f
+
+
+class UploadSessions:
+    """
+    Resumable uploads for /upload.
+
+    A session expires when it is not updated for ttl seconds.
+    """
+    META = "session.json"
+
+    def __init__(self, directory, ttl: int):
+        self.directory = directory
+        self.ttl = ttl
+
+    def _session_dir(self, upload_id):
+        return os.path.join(self.directory, upload_id)
+
+    def _expired(self, session_dir):
+        try:
+            st = os.stat(os.path.join(session_dir, "data"))
+        except OSError:
+            return True
+        return self.ttl > 0 and time.time() - st.st_mtime > self.ttl
+
+    def _expire(self):
+        for name in os.listdir(self.directory):
+            session_dir = self._session_dir(name)
+            # a session being created has no data file yet
+            try:
+                st = os.stat(session_dir)
+            except OSError:
+                continue
+            if time.time() - st.st_mtime < 60:
+                continue
+            if self._expired(session_dir):
+                shutil.rmtree(session_dir, ignore_errors=True)
+
+    def create(self, user, path, length, mtime,
+               multipart=False) -> UploadSession:
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        self._expire()
+        upload_id = secrets.token_urlsafe(16)
+        session_dir = self._session_dir(upload_id)
+        os.mkdir(session_dir, mode=0o700)
+        if multipart:
+            os.mkdir(os.path.join(session_dir, "parts"), mode=0o700)
+        meta = {"user": user, "path": path, "length": length,
+                "mtime": mtime, "multipart": multipart}
+        with open(os.path.join(session_dir, self.META), "w") as f:
+            json.dump(meta, f)
+        open(os.path.join(session_dir, "data"), "wb").close()
+        return UploadSession(session_dir, upload_id, meta)
+
+    def lookup(self, upload_id, user, path):
+        if not re.fullmatch(r"[A-Za-z0-9_-]+", upload_id):
+            return None
+        session_dir = self._session_dir(upload_id)
+        try:
+            with open(os.path.join(session_dir, self.META)) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get("user") != user or meta.get("path") != path:
+            return None
+        if self._expired(session_dir):
+            shutil.rmtree(session_dir, ignore_errors=True)
+            return None
+        return UploadSession(session_dir, upload_id, meta)
+
+    def remove(self, session):
+        shutil.rmtree(session.directory, ignore_errors=True)
+
+
+upload_sessions = UploadSessions(UPLOAD_DIR, UPLOAD_TTL)
+
+
+def upload_session_error(opname, gfarm_path):
+    code = status.HTTP_404_NOT_FOUND
+    message = f"No such upload: path={gfarm_path}"
+    return gfarm_http_error(opname, code, message, "", [])
+
+
+def upload_busy_error(opname, gfarm_path):
+    code = status.HTTP_409_CONFLICT
+    message = f"The upload is in use by another request: path={gfarm_path}"
+    return gfarm_http_error(opname, code, message, "", [])
+
+
+# as S3
+UPLOAD_MAX_PARTS = 10000
+
+
+class UploadPart(BaseModel):
+    part_number: int
+    etag: str
+
+
+class UploadComplete(BaseModel):
+    parts: List[UploadPart]
+
+    model_config = {
+        "json_schema_extra": {
+            "examples": [
+                {
+                    "parts": [
+                        {"part_number": 1,
+                         "etag": "\"b1946ac92492d2347c6235b4d2611184\""},
+                        {"part_number": 2,
+                         "etag": "\"591785b794601e212b260e25925636fd\""},
+                    ]
+                }
+            ]
+        }
+    }
+
+
+def upload_parts_error(opname, message, gfarm_path):
+    code = status.HTTP_400_BAD_REQUEST
+    return gfarm_http_error(opname, code, f"{message}: path={gfarm_path}",
+                            "", [])
+
+
+def upload_headers(session, offset):
+    headers = {"Upload-Offset": str(offset),
+               "Cache-Control": "no-store"}
+    if session.length is not None:
+        headers["Upload-Length"] = str(session.length)
+    return headers
+
+
+@app.post("/upload/{gfarm_path:path}")
+async def upload_create(gfarm_path: str,
+                        request: Request,
+                        multipart: bool = False,
+                        upload_length: Union[int, None] = Header(default=None),
+                        x_file_timestamp:
+                        Union[str, None] = Header(default=None),
+                        authorization: Union[str, None] = Header(default=None),
+                        x_csrf_token: Union[str, None] = Header(default=None)):
+    """
+    Start a resumable upload to gfarm_path.
+
+    Then send the content by PATCH /upload/{gfarm_path}?upload_id=...
+    in one or more requests with Upload-Offset (the bytes received
+    so far, also returned by HEAD), and register it to Gfarm by
+    PUT /upload/{gfarm_path}?upload_id=...
+
+    Upload-Length (optional): the size of the file
+
+    multipart=true starts a multipart upload instead.  Send parts
+    (1 to 10000) concurrently by
+    PUT /upload/{gfarm_path}?upload_id=...&part_number=N (with
+    Content-MD5 optionally) in any order, and complete it by
+    PUT /upload/{gfarm_path}?upload_id=... with the list of part
+    numbers and ETags of the parts to concatenate in ascending order.
+    """
+    check_csrf(request, x_csrf_token)
+    opname = "upload"
+    apiname = "/upload"
+    gfarm_path = fullpath(gfarm_path)
+    env = await set_env(request, authorization)
+    user = get_user_from_env(env)
+    log_operation(env, request.method, apiname, opname, gfarm_path)
+    if upload_length is not None and upload_length < 0:
+        code = status.HTTP_400_BAD_REQUEST
+        message = f"Invalid Upload-Length: {upload_length}"
+        raise gfarm_http_error(opname, code, message, "", [])
+    session = await asyncio.to_thread(
+        upload_sessions.create, user, gfarm_path, upload_length,
+        x_file_timestamp, multipart)
+    location = (f"{apiname}{urllib.parse.quote(gfarm_path)}"
+                f"?upload_id={session.id}")
+    headers = upload_headers(session, 0)
+    headers["Location"] = location
+    return JSONResponse(status_code=status.HTTP_201_CREATED,
+                        headers=headers,
+                        content={"upload_id": session.id,
+                                 "path": gfarm_path,
+                                 "offset": 0,
+                                 "length": upload_length})
+
+
+@app.head("/upload/{gfarm_path:path}")
+async def upload_head(gfarm_path: str,
+                      upload_id: str,
+                      request: Request,
+                      authorization: Union[str, None] = Header(default=None)):
+    opname = "upload"
+    apiname = "/upload"
+    gfarm_path = fullpath(gfarm_path)
+    env = await set_env(request, authorization)
+    user = get_user_from_env(env)
+    log_operation(env, request.method, apiname, opname, gfarm_path)
+    session = upload_sessions.lookup(upload_id, user, gfarm_path)
+    if session is None:
+        raise upload_session_error(opname, gfarm_path)
+    return Response(status_code=200,
+                    headers=upload_headers(session, session.offset()))
+
+
+@app.patch("/upload/{gfarm_path:path}")
+async def upload_append(gfarm_path: str,
+                        upload_id: str,
+                        request: Request,
+                        upload_offset: int = Header(),
+                        authorization: Union[str, None] = Header(default=None),
+                        x_csrf_token: Union[str, None] = Header(default=None)):
+    """
+    Append the request body at Upload-Offset.  Bytes received before
+    the connection is lost are kept.
+    """
+    check_csrf(request, x_csrf_token)
+    opname = "upload"
+    apiname = "/upload"
+    gfarm_path = fullpath(gfarm_path)
+    env = await set_env(request, authorization)
+    user = get_user_from_env(env)
+    ipaddr = get_client_ip_from_env(env)
+    log_operation(env, request.method, apiname, opname, gfarm_path)
+    session = upload_sessions.lookup(upload_id, user, gfarm_path)
+    if session is None:
+        raise upload_session_error(opname, gfarm_path)
+    if session.multipart:
+        raise upload_parts_error(opname, "Multipart upload", gfarm_path)
+    f = session.open_data()
+    if f is None:
+        raise upload_busy_error(opname, gfarm_path)
+    with f:
+        offset = os.fstat(f.fileno()).st_size
+        if upload_offset != offset:
+            code = status.HTTP_409_CONFLICT
+            message = (f"Upload-Offset mismatch: {upload_offset}"
+                       f" (expected {offset}): path={gfarm_path}")
+            e = gfarm_http_error(opname, code, message, "", [])
+            e.headers = upload_headers(session, offset)
+            raise e
+        f.seek(offset)
+        buf = bytearray()
+        try:
+            async for chunk in request.stream():
+                if (session.length is not None
+                        and offset + len(buf) + len(chunk) > session.length):
+                    code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+                    message = (f"Exceeds Upload-Length {session.length}:"
+                               f" path={gfarm_path}")
+                    raise gfarm_http_error(opname, code, message, "", [])
+                buf += chunk
+                if len(buf) >= BUFSIZE:
+                    await asyncio.to_thread(f.write, buf)
+                    offset += len(buf)
+                    buf = bytearray()
+        except ClientDisconnect:
+            logger.debug(f"{ipaddr}:0 user={user}, cmd={opname},"
+                         f" path={gfarm_path}, client disconnected")
+        finally:
+            # keep the bytes received so far
+            if buf:
+                await asyncio.to_thread(f.write, buf)
+                offset += len(buf)
+            f.flush()
+    logger.debug(f"{ipaddr}:0 user={user}, cmd={opname}, path={gfarm_path},"
+                 f" offset={offset}")
+    return Response(status_code=204,
+                    headers=upload_headers(session, offset))
+
+
+async def upload_part(request, session, part_number, content_md5,
+                      opname, gfarm_path):
+    if not 1 <= part_number <= UPLOAD_MAX_PARTS:
+        raise upload_parts_error(
+            opname, f"Invalid part number: {part_number}", gfarm_path)
+    md5 = hashlib.md5(usedforsecurity=False)
+    f = await asyncio.to_thread(session.part_tmpfile)
+
+    def write(data):
+        # hashlib releases the GIL
+        md5.update(data)
+        f.write(data)
+
+    try:
+        buf = bytearray()
+        async for chunk in request.stream():
+            buf += chunk
+            if len(buf) >= BUFSIZE:
+                await asyncio.to_thread(write, buf)
+                buf = bytearray()
+        if buf:
+            await asyncio.to_thread(write, buf)
+        f.close()
+        digest = md5.digest()
+        if content_md5 is not None:
+            try:
+                expected = base64.b64decode(content_md5, validate=True)
+            except ValueError:
+                expected = None
+            if expected != digest:
+                raise upload_parts_error(
+                    opname, f"Content-MD5 mismatch: part {part_number}",
+                    gfarm_path)
+        etag = digest.hex()
+        await asyncio.to_thread(session.commit_part, f.name, part_number,
+                                etag)
+    except BaseException:
+        f.close()
+        try:
+            os.remove(f.name)
+        except OSError:
+            pass
+        raise
+    return Response(status_code=200, headers={"ETag": f'"{etag}"'})
+
+
+async def write_files(writer, paths):
+    # double buffering: read the next chunk from the local file
+    # while writing the current chunk
+    bufs = [buffer_pool.get(), buffer_pool.get()]
+    views = [memoryview(buf) for buf in bufs]
+    for path in paths:
+        with open(path, "rb", buffering=0) as f:
+            i = 0
+            n = await asyncio.to_thread(f.readinto, bufs[i])
+            while n > 0:
+                writer.write(views[i][:n])
+                i ^= 1
+                n, _ = await asyncio.gather(
+                    asyncio.to_thread(f.readinto, bufs[i]),
+                    writer.drain())
+    for buf in bufs:
+        buffer_pool.put(buf)
+
+
+def multipart_etag(etags):
+    # as S3: MD5 of MD5s of the parts
+    md5 = hashlib.md5(usedforsecurity=False)
+    for etag in etags:
+        md5.update(bytes.fromhex(etag))
+    return f'"{md5.hexdigest()}-{len(etags)}"'
+
+
+async def upload_parts_to_complete(request, session, opname, gfarm_path):
+    parts = await asyncio.to_thread(session.parts)
+    try:
+        body = await request.body()
+        if body:
+            complete = UploadComplete.model_validate_json(body)
+            numbers = [part.part_number for part in complete.parts]
+        else:
+            complete = None
+            numbers = sorted(parts)
+    except ValueError as e:
+        raise upload_parts_error(opname, f"Invalid part list ({str(e)})",
+                                 gfarm_path)
+    if not numbers:
+        raise upload_parts_error(opname, "No parts", gfarm_path)
+    if numbers != sorted(set(numbers)):
+        raise upload_parts_error(
+            opname, "Part numbers must be in ascending order", gfarm_path)
+    selected = []
+    for i, number in enumerate(numbers):
+        part = parts.get(number)
+        if complete is not None and part is not None:
+            if complete.parts[i].etag.strip('"') != part[1]:
+                part = None
+        if part is None:
+            raise upload_parts_error(
+                opname, f"Invalid part: part {number}", gfarm_path)
+        selected.append(part)
+    return selected
+
+
+@app.put("/upload/{gfarm_path:path}")
+async def upload_finish(gfarm_path: str,
+                        upload_id: str,
+                        request: Request,
+                        part_number: Union[int, None] = None,
+                        content_md5: Union[str, None] = Header(default=None),
+                        authorization: Union[str, None] = Header(default=None),
+                        x_csrf_token: Union[str, None] = Header(default=None)):
+    """
+    Register the uploaded content to gfarm_path by gfreg (to a
+    temporary file) and gfmv.  The session is kept on error to retry.
+
+    For a multipart upload, send a part with part_number, or complete
+    the upload with the part list (UploadComplete) in the body
+    (empty: all parts received).  Part ETags are MD5 of the parts.
+    """
+    check_csrf(request, x_csrf_token)
+    opname = "gfreg"
+    apiname = "/upload"
+    gfarm_path = fullpath(gfarm_path)
+    env = await set_env(request, authorization)
+    user = get_user_from_env(env)
+    ipaddr = get_client_ip_from_env(env)
+    log_operation(env, request.method, apiname, opname, gfarm_path)
+    session = upload_sessions.lookup(upload_id, user, gfarm_path)
+    if session is None:
+        raise upload_session_error(opname, gfarm_path)
+    if part_number is not None:
+        if not session.multipart:
+            raise upload_parts_error(opname, "Not a multipart upload",
+                                     gfarm_path)
+        return await upload_part(request, session, part_number, content_md5,
+                                 "upload", gfarm_path)
+    f = session.open_data()
+    if f is None:
+        raise upload_busy_error(opname, gfarm_path)
+    with f:
+        if session.multipart:
+            parts = await upload_parts_to_complete(request, session, opname,
+                                                   gfarm_path)
+            offset = sum(size for _, _, size in parts)
+        else:
+            offset = os.fstat(f.fileno()).st_size
+        if session.length is not None and offset != session.length:
+            code = status.HTTP_409_CONFLICT
+            message = (f"Incomplete upload: {offset} of {session.length}"
+                       f" bytes: path={gfarm_path}")
+            e = gfarm_http_error(opname, code, message, "", [])
+            e.headers = upload_headers(session, offset)
+            raise e
+        tmppath = upload_tmppath(gfarm_path)
+        error = None
+        elist = []
+        if session.multipart:
+            # assemble the parts in order into gfreg
+            p, args = await gfreg(env, tmppath, session.mtime)
+            stderr_task = asyncio.create_task(log_stderr(opname, p, elist))
+            try:
+                await write_files(p.stdin, [path for path, _, _ in parts])
+            except Exception as e:
+                logger.exception(f"{ipaddr}:0 user={user}, cmd={opname},"
+                                 f" path={tmppath}")
+                error = e
+            p.stdin.close()
+        else:
+            # gfreg reads the staged file directly
+            p, args = await gfreg(env, tmppath, session.mtime,
+                                  stdin=f.fileno())
+            stderr_task = asyncio.create_task(log_stderr(opname, p, elist))
+        await stderr_task
+        return_code = await p.wait()
+        logger.debug(f"{ipaddr}:0 user={user}, cmd={opname},"
+                     f" path={tmppath}, return={return_code}")
+        response = await commit_upload(request, authorization, opname,
+                                       gfarm_path, tmppath, args,
+                                       return_code, error, elist)
+    if session.multipart:
+        response.headers["ETag"] = multipart_etag(
+            [etag for _, etag, _ in parts])
+    upload_sessions.remove(session)
+    return response
+
+
+@app.get("/upload/{gfarm_path:path}")
+async def upload_info(gfarm_path: str,
+                      upload_id: str,
+                      request: Request,
+                      authorization: Union[str, None] = Header(default=None)):
+    """
+    Return the state of the upload (parts received for a multipart
+    upload).
+    """
+    opname = "upload"
+    apiname = "/upload"
+    gfarm_path = fullpath(gfarm_path)
+    env = await set_env(request, authorization)
+    user = get_user_from_env(env)
+    log_operation(env, request.method, apiname, opname, gfarm_path)
+    session = upload_sessions.lookup(upload_id, user, gfarm_path)
+    if session is None:
+        raise upload_session_error(opname, gfarm_path)
+    content = {"upload_id": session.id,
+               "path": gfarm_path,
+               "length": session.length,
+               "multipart": session.multipart}
+    if session.multipart:
+        parts = await asyncio.to_thread(session.parts)
+        content["parts"] = [
+            {"part_number": number, "etag": f'"{etag}"', "size": size}
+            for number, (_, etag, size) in sorted(parts.items())]
+    else:
+        content["offset"] = session.offset()
+    return JSONResponse(content=content,
+                        headers={"Cache-Control": "no-store"})
+
+
+@app.delete("/upload/{gfarm_path:path}")
+async def upload_abort(gfarm_path: str,
+                       upload_id: str,
+                       request: Request,
+                       authorization: Union[str, None] = Header(default=None),
+                       x_csrf_token: Union[str, None] = Header(default=None)):
+    check_csrf(request, x_csrf_token)
+    opname = "upload"
+    apiname = "/upload"
+    gfarm_path = fullpath(gfarm_path)
+    env = await set_env(request, authorization)
+    user = get_user_from_env(env)
+    log_operation(env, request.method, apiname, opname, gfarm_path)
+    session = upload_sessions.lookup(upload_id, user, gfarm_path)
+    if session is None:
+        raise upload_session_error(opname, gfarm_path)
+    f = session.open_data()
+    if f is None:
+        raise upload_busy_error(opname, gfarm_path)
+    with f:
+        upload_sessions.remove(session)
+    return Response(status_code=204)
+
+
+# sec.
+COPY_PROGRESS_INTERVAL = 0.5
+
+# directories per gfmkdir -p
+COPY_MKDIR_BATCH = 256
+
+# processes of FileCopy running together: gfexport, gfreg and gfcksum
+COPY_PIPELINE_PROCS = 3
+
+
+def copy_tmppath(dest_path):
+    dest_dir = os.path.dirname(dest_path)
+    filename_prefix = os.path.basename(dest_path)[:128]
+    randstr = ''.join(
+        random.choices(string.ascii_letters + string.digits, k=8))
+    tmpname = f"gfarm-http.copy.{filename_prefix}.{randstr}"
+    return os.path.join(dest_dir, tmpname)
+
+
+class FileCopy:
+    """
+    Copy a file by gfexport | gfreg to a temporary file, verify it and
+    rename it to the destination.
+    """
+    def __init__(self, env, method, apiname, src, dest, mtime, elist):
+        self.env = env
+        self.method = method
+        self.apiname = apiname
+        self.src = src
+        self.dest = dest
+        self.mtime = mtime
+        self.elist = elist
+        self.tmppath = copy_tmppath(dest)
+        self.progress = CopyProgress()
+        self.warn = None
+        self.reservation = None
+
+    async def export(self):
+        """
+        Start gfexport and return the first byte (b"": an empty file
+        or an error).  The slots of the processes are reserved at once,
+        and released by run() or close_export().
+        """
+        user = get_user_from_env(self.env)
+        self.reservation = await spawn_limiter.reserve(
+            user, COPY_PIPELINE_PROCS)
+        try:
+            with self.reservation.use():
+                self.p_export, self.args = await gfexport(self.env,
+                                                          self.src)
+        except BaseException:
+            self.reservation.close()
+            raise
+        self.stderr_export = asyncio.create_task(
+            log_stderr("gfexport", self.p_export, self.elist))
+        self.first_byte = await self.p_export.stdout.read(1)
+        self.progress.copied = len(self.first_byte)
+        return self.first_byte
+
+    async def close_export(self):
+        self.reservation.close()
+        await self.stderr_export
+        await self.p_export.wait()
+        close_transfer_pipe(self.p_export.stdout)
+
+    async def remove_tmpfile(self):
+        p_clean = await gfrm(self.env, self.tmppath, force=True)
+        await asyncio.create_task(log_stderr("gfrm", p_clean, self.elist))
+        await p_clean.wait()
+
+    async def run(self):
+        """
+        Copy the rest after export(), and return an error message or
+        None.  self.warn is set when the copy is not verified.
+        """
+        try:
+            with self.reservation.use():
+                try:
+                    return await self._run()
+                except BaseException:
+                    # ex. client disconnected, or I/O error
+                    with contextlib.suppress(Exception):
+                        await self.remove_tmpfile()
+                    raise
+        finally:
+            self.reservation.close()
+
+    async def _run(self):
+        env = self.env
+        elist = self.elist
+        p_export = self.p_export
+        p_reg, _ = await gfreg(env, self.tmppath, self.mtime)
+        stderr_reg = asyncio.create_task(log_stderr("gfreg", p_reg, elist))
+        log_operation(env, self.method, self.apiname, "gfreg", self.src)
+        # splice: verify the checksum stored by gfreg (computed by Gfarm)
+        # otherwise: verify the digest of the copied bytes computed here
+        splice = splice_copier.available(p_export.stdout, p_reg.stdin)
+        if not splice:
+            # the stored checksum of the source
+            cksum_task = asyncio.create_task(stored_checksum(
+                env, self.method, self.apiname, self.src, elist))
+        digest = None
+        copy_task = None
+        try:
+            p_reg.stdin.write(self.first_byte)
+            await p_reg.stdin.drain()
+            if splice:
+                copy = splice_copier.copy(p_export.stdout, p_reg.stdin,
+                                          self.progress)
+            else:
+                cksum, self.warn = await cksum_task
+                if cksum is not None:
+                    digest = hashlib.new(cksum["cksum_type"],
+                                         self.first_byte,
+                                         usedforsecurity=False)
+                copy = copy_pipe(p_export.stdout, p_reg.stdin,
+                                 self.progress, digest)
+            copy_task = asyncio.create_task(copy)
+            # shield: keep the copy running until the processes are
+            # killed when cancelled
+            await asyncio.shield(copy_task)
+        finally:
+            if copy_task is None or not copy_task.done():
+                # ex. client disconnected: end the copy before closing
+                # the pipes used by it
+                for p in (p_export, p_reg):
+                    if p.returncode is None:
+                        p.kill()
+                if copy_task is not None:
+                    await asyncio.wait([copy_task])
+            p_reg.stdin.close()
+            close_transfer_pipe(p_export.stdout)
+
+        await self.stderr_export
+        await stderr_reg
+        return_code_export = await p_export.wait()
+        return_code_reg = await p_reg.wait()
 
-    choices = string.ascii_letters + string.digits
-    randstr = ''.join(random.choices(choices, k=8))
-    tmpname = "gfarm-http.upload." + filename_prefix + "." + randstr
-    tmppath = os.path.join(dirname, tmpname)
+        error = None
+        if return_code_export == 0 and return_code_reg == 0:
+            if splice:
+                ok, message = await match_checksum(
+                    env, self.method, self.apiname, self.src, self.tmppath,
+                    elist)
+                if ok is None:
+                    self.warn = message
+                elif not ok:
+                    error = message
+            elif digest is not None and digest.hexdigest() != cksum["cksum"]:
+                error = (
+                    f"checksum mismatch: "
+                    f'{cksum["path"]}:{cksum["cksum"]}'
+                    f'({cksum["cksum_type"]})'
+                    f" copied:{digest.hexdigest()}")
+        else:
+            user = get_user_from_env(env)
+            ipaddr = get_client_ip_from_env(env)
+            logger.debug(f"{ipaddr}:0 user={user}, cmd="
+                         + ("gfexport" if return_code_export != 0
+                            else "gfreg")
+                         + f", path={self.tmppath}, "
+                         f"return={return_code_export | return_code_reg}")
+            error = "copy failed"
+        if error is not None:
+            await self.remove_tmpfile()
+            return error
 
-    p, args = await gfreg(env, tmppath, x_file_timestamp)
-    elist = []
-    stderr_task = asyncio.create_task(log_stderr(opname, p, elist))
-    error = None
+        # final move
+        p_mv = await gfmv(env, self.tmppath, self.dest)
+        stderr_mv = asyncio.create_task(log_stderr("gfmv", p_mv, elist))
+        log_operation(env, self.method, self.apiname, "gfmv", self.src)
+        await stderr_mv
+        return_code_mv = await p_mv.wait()
+        stat_cache.invalidate(self.tmppath, self.dest)
+        if return_code_mv != 0:
+            await self.remove_tmpfile()
+            return "move failed"
+        # verified before gfmv
+        return None
+
+
+async def copy_tree_entries(env, src):
+    """
+    List src recursively, and return the relative paths of the
+    directories and the entries of the other files and symlinks.
+    """
+    dirs = []
+    entries = []
+    warn = None
     try:
-        async for chunk in request.stream():
-            p.stdin.write(chunk)
-            await p.stdin.drain()  # speedup
-    except Exception as e:
-        logger.exception(f"{ipaddr}:0 user={user}, cmd={opname},"
-                         f" path={tmppath}")
-        error = e
+        async for entry in gfls_generator(env, src, False):
+            if not isinstance(entry, Gfls_Entry) \
+               or entry.name in (".", ".."):
+                continue
+            if entry.is_dir:
+                dirs.append(os.path.relpath(entry.path, src))
+            else:
+                entries.append(entry)
+    except RuntimeError:
+        warn = "gfls failed: the listing may be incomplete"
+    return dirs, entries, warn
 
-    p.stdin.close()
-    await stderr_task
-    return_code = await p.wait()
-    logger.debug(f"{ipaddr}:0 user={user}, cmd={opname}, path={tmppath},"
-                 f" return={return_code}")
 
-    if return_code == 0 and error is None:
-        env = await set_env(request, authorization)  # may refresh
-        gfmv_cmd = "gfmv"
-        p2 = await gfmv(env, tmppath, gfarm_path)
-        stderr_task2 = asyncio.create_task(log_stderr(gfmv_cmd, p2, elist))
-        await stderr_task2
-        return_code = await p2.wait()
-        logger.debug(f"{ipaddr}:0 user={user}, cmd={gfmv_cmd}, src={tmppath},"
-                     f" dest={gfarm_path}, return={return_code}")
-        if return_code == 0:
-            return Response(status_code=200)
+def leaf_dirs(dirs):
+    # gfmkdir -p creates the parents
+    parents = {os.path.dirname(d) for d in dirs}
+    return [d for d in dirs if d not in parents]
 
-    # error case
-    env = await set_env(request, authorization)  # may refresh
-    p3 = await gfrm(env, tmppath, force=True)
-    gfrm_cmd = "gfrm"
-    stderr_task3 = asyncio.create_task(log_stderr(gfrm_cmd, p3, elist))
-    await stderr_task3
-    # ignore error
-    return_code = await p3.wait()
-    logger.debug(f"{ipaddr}:0 user={user}, cmd={gfrm_cmd}, path={tmppath},"
-                 f" return={return_code}")
 
-    code = status.HTTP_500_INTERNAL_SERVER_ERROR
-    if error:
-        message = f"I/O error({str(error)}): path={gfarm_path}"
-    else:
-        message = f"Failed to execute: gfreg {' '.join(args)}"
-    stdout = ""
-    raise gfarm_http_error(opname, code, message, stdout, elist)
+async def copy_tree_file(env, method, apiname, src, dest, entry, fc_set,
+                         elist):
+    """
+    Copy a file or a symlink (entry) in the tree, and return
+    (FileCopy or None, error message or None).
+    """
+    rel = os.path.relpath(entry.path, src)
+    dest_path = os.path.join(dest, rel)
+    if entry.is_sym:
+        log_operation(env, method, apiname, "gfln", entry.path)
+        p = await gfln(env, entry.linkname, dest_path, True)
+        await log_stderr("gfln", p, elist)
+        if await p.wait() != 0:
+            return None, f"{entry.path}: gfln failed"
+        stat_cache.invalidate(dest_path)
+        return None, None
+    fc = FileCopy(env, method, apiname, entry.path, dest_path,
+                  int(entry.mtime), elist)
+    fc_set.add(fc)
+    try:
+        first_byte = await fc.export()
+        if not first_byte and entry.size != 0:
+            await fc.close_export()
+            return fc, f"{entry.path}: Cannot read"
+        error = await fc.run()
+    except Exception:
+        error = "I/O error"
+    finally:
+        fc_set.discard(fc)
+    if error is not None:
+        error = f"{entry.path}: {error}"
+    return fc, error
 
 
-@app.delete("/file/{gfarm_path:path}")
-async def file_remove(gfarm_path: str,
-                      request: Request,
-                      force: bool = False,
-                      recursive: bool = False,
-                      authorization: Union[str, None] = Header(default=None),
-                      x_csrf_token: Union[str, None] = Header(default=None)):
-    check_csrf(request, x_csrf_token)
-    opname = "gfrm"
-    apiname = "/file"
-    gfarm_path = fullpath(gfarm_path)
-    env = await set_env(request, authorization)
-    log_operation(env, request.method, apiname, opname, gfarm_path)
-    p = await gfrm(env, gfarm_path, force, recursive)
-    return await gfarm_command_standard_response(env, p, opname)
+async def copy_tree(env, method, apiname, src, dest, elist):
+    """
+    Copy the directory src to dest by COPY_PARALLEL gfexport | gfreg
+    pipelines (fewer near the spawn limits of the user), and yield the
+    aggregated progress as JSON lines.
+    """
+    current_status = {"files_copied": 0,
+                      "files_total": None,
+                      "files_failed": 0,
+                      "copied": 0,
+                      "total": None,
+                      "warn": None,
+                      "error": None,
+                      "done": False}
+    yield json.dumps(current_status) + "\n"
+
+    dirs, entries, warn = await copy_tree_entries(env, src)
+    current_status["warn"] = warn
+    current_status["files_total"] = len(entries)
+    current_status["total"] = sum(e.size for e in entries
+                                  if not e.is_sym)
+    mkdirs = [dest] + [os.path.join(dest, d) for d in leaf_dirs(dirs)]
+    for i in range(0, len(mkdirs), COPY_MKDIR_BATCH):
+        log_operation(env, method, apiname, "gfmkdir", dest)
+        p = await gfmkdir(env, *mkdirs[i:i + COPY_MKDIR_BATCH], p=True)
+        stdout = await read_proc_output("gfmkdir", p, elist)
+        if stdout is None:
+            stat_cache.invalidate(dest)
+            current_status["error"] = "gfmkdir failed"
+            current_status["done"] = True
+            yield json.dumps(current_status) + "\n"
+            return
+    stat_cache.invalidate(dest)
+    yield json.dumps(current_status) + "\n"
+
+    running = set()  # FileCopy in progress
+    copied = 0  # by completed FileCopy
+    todo = iter(entries)  # shared by the workers
+
+    async def worker():
+        nonlocal copied
+        for entry in todo:
+            fc, error = await copy_tree_file(
+                env, method, apiname, src, dest, entry, running, elist)
+            if error is None:
+                current_status["files_copied"] += 1
+                if fc is not None:
+                    copied += fc.progress.copied
+            else:
+                current_status["files_failed"] += 1
+                current_status["error"] = error
+            if fc is not None and fc.warn is not None:
+                current_status["warn"] = f"{fc.src}: {fc.warn}"
+
+    parallel = min(COPY_PARALLEL, len(entries))
+    available = spawn_limiter.available(get_user_from_env(env))
+    if available is not None:
+        # each pipeline reserves COPY_PIPELINE_PROCS slots
+        parallel = min(parallel, max(1, available // COPY_PIPELINE_PROCS))
+    workers = [asyncio.create_task(worker()) for _ in range(parallel)]
+    try:
+        while workers:
+            _, pending = await asyncio.wait(workers,
+                                            timeout=COPY_PROGRESS_INTERVAL)
+            current_status["copied"] = copied + sum(
+                fc.progress.copied for fc in running)
+            if not pending:
+                break
+            # yield JSON line
+            yield json.dumps(current_status) + "\n"
+        for task in workers:
+            task.result()
+    finally:
+        for task in workers:
+            # ex. client disconnected: FileCopy.run() kills the processes
+            task.cancel()
+        if workers:
+            await asyncio.wait(workers)
+    current_status["done"] = True
+    yield json.dumps(current_status) + "\n"
+
+
+async def copy_tree_gfpcopy(env, method, apiname, src, dest, elist):
+    """
+    Copy the directory src to dest by gfpcopy via a temporary
+    directory, and yield the progress as JSON lines.
+    """
+    current_status = {"files_copied": None,
+                      "files_total": None,
+                      "files_failed": None,
+                      "copied": None,
+                      "total": None,
+                      "warn": None,
+                      "error": None,
+                      "done": False}
+    yield json.dumps(current_status) + "\n"
+
+    tmpdir = copy_tmppath(dest)
+    log_operation(env, method, apiname, "gfmkdir", tmpdir)
+    p = await gfmkdir(env, tmpdir)
+    if await read_proc_output("gfmkdir", p, elist) is None:
+        current_status["error"] = "gfmkdir failed"
+        current_status["done"] = True
+        yield json.dumps(current_status) + "\n"
+        return
+
+    log_operation(env, method, apiname, "gfpcopy", src)
+    p, _ = await gfpcopy(env, src, tmpdir, COPY_PARALLEL)
+    task = asyncio.create_task(read_proc_output("gfpcopy", p, elist))
+    try:
+        while True:
+            done, _ = await asyncio.wait([task],
+                                         timeout=COPY_PROGRESS_INTERVAL)
+            if done:
+                break
+            # yield JSON line
+            yield json.dumps(current_status) + "\n"
+        stdout = task.result()
+    finally:
+        if not task.done():
+            # ex. client disconnected
+            if p.returncode is None:
+                p.kill()
+            await asyncio.wait([task])
+
+    if stdout is not None:
+        copied_dir = os.path.join(tmpdir, os.path.basename(src))
+        log_operation(env, method, apiname, "gfmv", src)
+        p = await gfmv(env, copied_dir, dest)
+        await log_stderr("gfmv", p, elist)
+        if await p.wait() != 0:
+            current_status["error"] = "move failed"
+    else:
+        current_status["error"] = "gfpcopy failed"
+    p = await gfrm(env, tmpdir, force=True, recursive=True)
+    await log_stderr("gfrm", p, elist)
+    await p.wait()
+    stat_cache.invalidate(tmpdir, dest)
+    current_status["done"] = True
+    yield json.dumps(current_status) + "\n"
 
 
 @app.post("/copy")
 async def file_copy(copy_data: FileOperation,
                     request: Request,
+                    use_gfpcopy: bool = False,
                     authorization: Union[str, None] = Header(default=None)):
+    # use_gfpcopy: copy a directory by gfpcopy instead of the pipelines
     opname = "gfexport"
     apiname = "/copy"
     gfarm_path = copy_data.source
     dest_path = copy_data.destination
-    dest_dir = os.path.dirname(dest_path)
-    dest_filename = os.path.basename(dest_path)
 
     env = await set_env(request, authorization)
-    user = get_user_from_env(env)
-    ipaddr = get_client_ip_from_env(env)
     elist = []
 
     log_operation(env, request.method, apiname, opname, gfarm_path)
@@ -2750,123 +6655,69 @@ async def file_copy(copy_data: FileOperation,
         elist = []
         raise gfarm_http_error(opname, code, message, stdout, elist)
     if not is_file:
-        code = status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
-        message = "The requested URL does not represent a file."
-        stdout = ""
-        elist = []
-        raise gfarm_http_error(opname, code, message, stdout, elist)
-
-    filename_prefix = dest_filename[:128]
-    randstr = ''.join(
-        random.choices(string.ascii_letters + string.digits, k=8))
-    tmpname = f"gfarm-http.copy.{filename_prefix}.{randstr}"
-    tmppath = os.path.join(dest_dir, tmpname)
-
-    p_export, args = await gfexport(env, gfarm_path)
-    stderr_export = asyncio.create_task(
-        log_stderr("gfexport", p_export, elist))
-    first_byte = await p_export.stdout.read(1)
+        st = await file_stat(env, gfarm_path)
+        if st is None or st.Filetype != "directory":
+            code = status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+            message = ("The requested URL does not represent"
+                       " a file or a directory.")
+            stdout = ""
+            elist = []
+            raise gfarm_http_error(opname, code, message, stdout, elist)
+        if use_gfpcopy:
+            copy_gen = copy_tree_gfpcopy
+        else:
+            copy_gen = copy_tree
+        return StreamingResponse(
+            copy_gen(env, request.method, apiname, gfarm_path, dest_path,
+                     elist),
+            media_type="application/json")
+
+    fc = FileCopy(env, request.method, apiname, gfarm_path, dest_path,
+                  mtime, elist)
+    first_byte = await fc.export()
     if not first_byte:
-        await stderr_export
+        await fc.close_export()
         if await can_access(env, gfarm_path, "r"):
             code = status.HTTP_403_FORBIDDEN
             message = f"Cannot read: {gfarm_path}"
         else:
             code = status.HTTP_500_INTERNAL_SERVER_ERROR
-            message = f"Failed to execute: gfexport {' '.join(args)}"
+            message = f"Failed to execute: gfexport {' '.join(fc.args)}"
         stdout = ""
         raise gfarm_http_error(opname, code, message, stdout, elist)
 
-    p_reg, _ = await gfreg(env, tmppath, mtime)
-    stderr_reg = asyncio.create_task(log_stderr("gfreg", p_reg, elist))
-    opname = "gfreg"
-    log_operation(env, request.method, apiname, opname, gfarm_path)
-    current_status = {"copied": 0,
+    current_status = {"copied": fc.progress.copied,
                       "total": size,
                       "warn": None,
                       "error": None,
                       "done": False}
 
     async def progress_generator():
-        copied = 1
-        p_reg.stdin.write(first_byte)
-        await p_reg.stdin.drain()
-        current_status["copied"] = copied
         yield json.dumps(current_status) + "\n"
+        copy_task = asyncio.create_task(fc.run())
         try:
             while True:
-                chunk = await p_export.stdout.read(BUFSIZE)
-                if not chunk:
+                done, _ = await asyncio.wait([copy_task],
+                                             timeout=COPY_PROGRESS_INTERVAL)
+                current_status["copied"] = fc.progress.copied
+                current_status["warn"] = fc.warn
+                if done:
                     break
-                p_reg.stdin.write(chunk)
-                await p_reg.stdin.drain()
-                copied += len(chunk)
                 # yield JSON line
-                current_status["copied"] = copied
                 yield json.dumps(current_status) + "\n"
+            error = copy_task.result()
         except Exception:
             yield json.dumps({"error": "I/O error", "done": True}) + "\n"
             raise
         finally:
-            p_reg.stdin.close()
-
-        await stderr_export
-        await stderr_reg
-        return_code_export = await p_export.wait()
-        return_code_reg = await p_reg.wait()
-
-        if return_code_reg == 0:
-            ok, error_message = await match_checksum(
-                env, request.method, apiname, gfarm_path, tmppath, elist)
-            if ok is None:
-                current_status["warn"] = error_message
-                yield json.dumps(current_status) + "\n"
-            elif not ok:
-                # cleanup
-                p_clean = await gfrm(env, tmppath, force=True)
-                await asyncio.create_task(log_stderr("gfrm", p_clean, elist))
-                await p_clean.wait()
-                current_status["error"] = error_message
-                current_status["done"] = True
-                yield json.dumps(current_status) + "\n"
-                return
-
-        if return_code_export != 0 or return_code_reg != 0:
-            logger.debug(f"{ipaddr}:0 user={user}, cmd=",
-                         "gfexport" if return_code_export != 0 else "gfreg"
-                         f", path={tmppath}, "
-                         f"return={return_code_export | return_code_reg}")
-            # cleanup
-            p_clean = await gfrm(env, tmppath, force=True)
-            await asyncio.create_task(log_stderr("gfrm", p_clean, elist))
-            await p_clean.wait()
-            current_status["error"] = "copy failed"
-            current_status["done"] = True
-            yield json.dumps(current_status) + "\n"
-            return
-
-        # final move
-        p_mv = await gfmv(env, tmppath, dest_path)
-        stderr_mv = asyncio.create_task(log_stderr("gfmv", p_mv, elist))
-        opname = "gfmv"
-        log_operation(env, request.method, apiname, opname, gfarm_path)
-        await stderr_mv
-        return_code_mv = await p_mv.wait()
-
-        if return_code_mv == 0:
-            ok, error_message = await match_checksum(
-                env, request.method, apiname, gfarm_path, dest_path, elist)
-            current_status["warn"] = error_message if ok is None else None
-            current_status["error"] = None if ok is None else error_message
-            current_status["done"] = True
-            yield json.dumps(current_status) + "\n"
-        else:
-            p_clean = await gfrm(env, tmppath, force=True)
-            await asyncio.create_task(log_stderr("gfrm", p_clean, elist))
-            await p_clean.wait()
-            current_status["error"] = "move failed"
-            current_status["done"] = True
-            yield json.dumps(current_status) + "\n"
+            if not copy_task.done():
+                # ex. client disconnected: FileCopy.run() kills
+                # the processes
+                copy_task.cancel()
+                await asyncio.wait([copy_task])
+        current_status["error"] = error
+        current_status["done"] = True
+        yield json.dumps(current_status) + "\n"
 
     return StreamingResponse(progress_generator(),
                              media_type="application/json")
@@ -2886,7 +6737,8 @@ async def move_rename(request: Request,
     log_operation(env, request.method, apiname, opname,
                   {"src": src, "dest": dest})
     p = await gfmv(env, src, dest)
-    return await gfarm_command_standard_response(env, p, opname)
+    return await gfarm_command_standard_response(env, p, opname,
+                                                 invalidate=[src, dest])
 
 
 @app.get("/attr/{gfarm_path:path}")
@@ -2954,6 +6806,8 @@ async def get_attr(gfarm_path: str,
 
         return JSONResponse(content=result_json)
 
+    except SpawnRejected:
+        raise
     except Exception as err:
         if "authentication error" in str(elist):
             code = status.HTTP_401_UNAUTHORIZED
@@ -2965,6 +6819,55 @@ async def get_attr(gfarm_path: str,
             raise gfarm_http_error(opname, code, message, stdout, elist)
 
 
+ATTR_MAX_PATHS = 10000
+
+
+class StatPaths(BaseModel):
+    paths: List[str]
+
+    model_config = {
+        "json_schema_extra": {
+            "examples": [
+                {
+                    "paths": ["/tmp", "/tmp/testfile1"],
+                }
+            ]
+        }
+    }
+
+
+@app.post("/attr")
+async def get_attrs(stat_paths: StatPaths,
+                    request: Request,
+                    authorization: Union[str, None] = Header(default=None)):
+    """
+    Stat of many paths by a gfstat for STAT_BATCH_SIZE paths.
+    Return {path: Stat or {"error": message}}.
+    """
+    opname = "gfstat"
+    apiname = "/attr"
+    paths = list(dict.fromkeys(stat_paths.paths))
+    if len(paths) > ATTR_MAX_PATHS:
+        code = status.HTTP_400_BAD_REQUEST
+        message = f"Too many paths (max: {ATTR_MAX_PATHS})"
+        raise gfarm_http_error(opname, code, message, None, None)
+    env = await set_env(request, authorization)
+    log_operation(env, request.method, apiname, opname, paths)
+    result_json = {}
+    for stats, errors, elist in await asyncio.gather(
+            *[gfstat_many(env, batch, True)
+              for batch in stat_batches(paths)]):
+        if "authentication error" in str(elist):
+            code = status.HTTP_401_UNAUTHORIZED
+            message = "Authentication error"
+            raise gfarm_http_error(opname, code, message, "", elist)
+        for path, st in stats.items():
+            result_json[path] = st.model_dump()
+        for path, emsg in errors.items():
+            result_json[path] = {"error": emsg}
+    return JSONResponse(content={path: result_json[path] for path in paths})
+
+
 @app.post("/attr/{gfarm_path:path}")
 async def change_attr(gfarm_path: str,
                       stat: UpdateStat,
@@ -2982,7 +6885,8 @@ async def change_attr(gfarm_path: str,
         log_operation(env, request.method, apiname, opname,
                       (stat.Mode, gfarm_path))
         proc = await gfchmod(env, gfarm_path, stat.Mode)
-        response = await gfarm_command_standard_response(env, proc, opname)
+        response = await gfarm_command_standard_response(
+            env, proc, opname, invalidate=[gfarm_path])
     if response:
         return response
     else:
@@ -2993,6 +6897,191 @@ async def change_attr(gfarm_path: str,
         raise gfarm_http_error(opname, code, message, stdout, elist)
 
 
+BATCH_MAX_OPERATIONS = 10000
+
+# operations per set_env() in POST /batch to refresh the access token
+BATCH_ENV_REFRESH = 100
+
+
+class BatchOperation(BaseModel):
+    op: Literal['remove', 'mkdir', 'rmdir', 'move', 'stat', 'chmod']
+    path: str
+    destination: Optional[str] = None  # move
+    force: bool = False  # remove
+    recursive: bool = False  # remove
+    p: bool = False  # mkdir
+    mode: Optional[str] = None  # chmod
+
+
+class Batch(BaseModel):
+    operations: List[BatchOperation]
+    stop_on_error: bool = False
+
+    model_config = {
+        "json_schema_extra": {
+            "examples": [
+                {
+                    "operations": [
+                        {"op": "mkdir", "path": "/tmp/dir1", "p": True},
+                        {"op": "move", "path": "/tmp/testfile1",
+                         "destination": "/tmp/dir1/testfile1"},
+                        {"op": "remove", "path": "/tmp/testfile2"},
+                        {"op": "stat", "path": "/tmp/testfile3"},
+                    ],
+                    "stop_on_error": False,
+                }
+            ]
+        }
+    }
+
+
+async def batch_stat(env, path):
+    opname = "gfstat"
+    elist = []
+    proc = await gfstat(env, path, True)
+    stdout = await read_proc_output(opname, proc, elist)
+    if stdout is None:
+        if "authentication error" in str(elist):
+            code = status.HTTP_401_UNAUTHORIZED
+            message = "Authentication error"
+        else:
+            code = status.HTTP_500_INTERNAL_SERVER_ERROR
+            message = "Internal Server Error"
+        raise gfarm_http_error(opname, code, message, "", elist)
+    return parse_gfstat(stdout).model_dump()
+
+
+async def batch_run(env, method, op):
+    """
+    Run an operation of POST /batch, and return the result (stdout,
+    or Stat for stat), or raise HTTPException.
+    """
+    apiname = "/batch"
+    path = op.path
+    if op.op == "stat":
+        log_operation(env, method, apiname, "gfstat", path)
+        return await batch_stat(env, path)
+    args = path
+    invalidate = [path]
+    if op.op == "remove":
+        opname = "gfrm"
+        proc = await gfrm(env, path, op.force, op.recursive)
+    elif op.op == "mkdir":
+        opname = "gfmkdir"
+        proc = await gfmkdir(env, path, p=op.p)
+    elif op.op == "rmdir":
+        opname = "gfrmdir"
+        proc = await gfrmdir(env, path)
+    elif op.op == "move" and op.destination:
+        opname = "gfmv"
+        proc = await gfmv(env, path, op.destination)
+        args = {"src": path, "dest": op.destination}
+        invalidate.append(op.destination)
+    elif op.op == "chmod" and op.mode:
+        opname = "gfchmod"
+        proc = await gfchmod(env, path, op.mode)
+    else:
+        code = status.HTTP_422_UNPROCESSABLE_ENTITY
+        message = f"No input data for {op.op}"
+        raise gfarm_http_error(op.op, code, message, None, None)
+    log_operation(env, method, apiname, opname, args)
+    response = await gfarm_command_standard_response(
+        env, proc, opname, invalidate=invalidate)
+    return response.body.decode()
+
+
+@app.post("/batch")
+async def batch(batch_data: Batch,
+                request: Request,
+                authorization: Union[str, None] = Header(default=None),
+                x_csrf_token: Union[str, None] = Header(default=None)):
+    """
+    Run operations concurrently under one authentication, and stream
+    the result of each operation as a JSON line when it completes.
+    stop_on_error: no more operations are started after an error.
+    """
+    check_csrf(request, x_csrf_token)
+    operations = batch_data.operations
+    if len(operations) > BATCH_MAX_OPERATIONS:
+        code = status.HTTP_400_BAD_REQUEST
+        message = f"Too many operations (max: {BATCH_MAX_OPERATIONS})"
+        raise gfarm_http_error("batch", code, message, None, None)
+    env = await set_env(request, authorization)
+    env_uses = 0
+    user = get_user_from_env(env)
+    ipaddr = get_client_ip_from_env(env)
+
+    results = asyncio.Queue()
+    todo = iter(enumerate(operations))  # shared by the workers
+    counts = {"succeeded": 0, "failed": 0, "skipped": 0}
+    stop = False
+
+    async def current_env():
+        # a long batch outlives the access token
+        nonlocal env, env_uses
+        if env_uses >= BATCH_ENV_REFRESH:
+            env_uses = 0
+            env = await set_env(request, authorization)  # may refresh
+        env_uses += 1
+        return env
+
+    async def worker():
+        nonlocal stop
+        for index, op in todo:
+            if stop:
+                counts["skipped"] += 1
+                continue
+            result = {"index": index, "op": op.op, "path": op.path}
+            try:
+                result["result"] = await batch_run(
+                    await current_env(), request.method, op)
+                result["status_code"] = status.HTTP_200_OK
+                counts["succeeded"] += 1
+            except Exception as e:
+                if isinstance(e, HTTPException):
+                    result["status_code"] = e.status_code
+                    result["detail"] = e.detail
+                else:
+                    result["status_code"] = \
+                        status.HTTP_500_INTERNAL_SERVER_ERROR
+                    result["detail"] = str(e)
+                logger.debug(f"{ipaddr}:0 user={user}, cmd=batch,"
+                             f" index={index}, op={op.op},"
+                             f" status={result['status_code']}")
+                counts["failed"] += 1
+                if batch_data.stop_on_error:
+                    stop = True
+            await results.put(result)
+
+    async def run_workers(workers):
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            await results.put(None)
+
+    async def result_generator():
+        workers = [asyncio.create_task(worker())
+                   for _ in range(min(BATCH_CONCURRENCY, len(operations)))]
+        task = asyncio.create_task(run_workers(workers))
+        try:
+            while True:
+                result = await results.get()
+                if result is None:
+                    break
+                yield json.dumps(result) + "\n"
+            await task
+        finally:
+            if not task.done():
+                # ex. client disconnected
+                for w in workers:
+                    w.cancel()
+                await asyncio.wait([task])
+        yield json.dumps({**counts, "done": True}) + "\n"
+
+    return StreamingResponse(result_generator(),
+                             media_type="application/x-ndjson")
+
+
 @app.get("/acl/{gfarm_path:path}")
 async def get_acl(gfarm_path: str,
                   request: Request,
@@ -3047,6 +7136,7 @@ async def set_acl(gfarm_path: str,
     elist = []
     stdout = stdout.decode()
     return_code = await proc.wait()
+    stat_cache.invalidate(gfarm_path)
     if return_code != 0:
         code = status.HTTP_500_INTERNAL_SERVER_ERROR
         message = f"Failed to execute: gfsetfacl {' '.join(args)}"
@@ -3234,30 +7324,24 @@ async def archive_files(
     async def progress_generator():
         try:
             exp = expire
-            buffer = first_byte
-            if b"\r" in buffer or b"\n" in buffer:
-                yield json.dumps({"message": ""}) + '\n'
-                buffer = b""
-            while True:
-                chunk = await p.stdout.read(1)
-                if not chunk:
-                    break
-                buffer += chunk
-                logger.debug(f"buffer:{buffer}")
-                if b"\r" in buffer or b"\n" in buffer:
-                    msg = buffer.decode("utf-8", errors="replace").strip()
-                    buffer = b""
-                    j_line = json.dumps({"message": msg})
-                    yield j_line + '\n'
-                    logger.debug(
-                        f"{ipaddr}:0 user={user}, cmd={opname}, json={j_line}")
-                    # Update access_token
-                    _, _, exp = await set_tokenfilepath_to_env(
-                        request, env, tokenfilepath, exp)
+            reader = LineReader(p.stdout, initial=first_byte,
+                                final_line=False)
+            async for line in reader:
+                msg = line.strip()
+                j_line = json.dumps({"message": msg})
+                yield j_line + '\n'
+                logger.debug(
+                    f"{ipaddr}:0 user={user}, cmd={opname}, json={j_line}")
+                # Update access_token
+                _, _, exp = await set_tokenfilepath_to_env(
+                    request, env, tokenfilepath, exp)
             await stderr_task
             return_code = await p.wait()
+            if cmd != 't':
+                stat_cache.invalidate(outdir)
             if return_code != 0:
-                stdout = buffer.decode("utf-8", errors="replace").strip()
+                stdout = reader.remainder.decode(
+                    "utf-8", errors="replace").strip()
                 logger.error(
                     f"{ipaddr}:0 user={user}, cmd={opname}, {stdout}")
         except asyncio.CancelledError:
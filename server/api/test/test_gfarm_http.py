@@ -1,6 +1,7 @@
 import base64
 
 import asyncio
+import contextlib
 from fastapi.testclient import TestClient
 import pytest
 import pytest_asyncio
@@ -8,7 +9,15 @@ from unittest.mock import patch, Mock, MagicMock, AsyncMock
 
 import zipfile
 import io
+import hashlib
+import os
+import subprocess
+import json
 import time
+import stat
+import threading
+import shutil
+import tarfile
 
 import gfarm_http_gateway
 
@@ -28,6 +37,12 @@ req_headers_basic_auth = {"Authorization": "Basic " + userpass_b64_str}
 req_headers_anon_auth = {}
 
 
+@pytest.fixture(autouse=True)
+def clear_stat_cache():
+    gfarm_http_gateway.stat_cache.clear()
+    yield
+
+
 @pytest.fixture
 def mock_claims():
     with patch("jose.jwt.get_unverified_claims") as mock:
@@ -102,10 +117,46 @@ def mock_exec_common(mock, stdout, stderr, result):
     mock_future_wait = asyncio.Future()
     mock_proc.wait.return_value = mock_future_wait
     mock_future_wait.set_result(result)
+    mock_proc.stdin_received = bytearray()
+    mock_proc.stdin_threads = []
+
+    def spawn(*args, **kwargs):
+        # a fd (TRANSFER_PIPE of gf_spawn, not PIPE or DEVNULL) is
+        # read or written like a child process, and proc.stdin/stdout
+        # is None for it
+        proc = mock.return_value
+        stdin_fd = kwargs.get("stdin")
+        if isinstance(stdin_fd, int) and stdin_fd >= 0:
+            proc.stdin = None
+            thread = threading.Thread(target=read_stdin,
+                                      args=(proc, os.dup(stdin_fd)))
+            thread.start()
+            proc.stdin_threads.append(thread)
+        stdout_fd = kwargs.get("stdout")
+        if isinstance(stdout_fd, int) and stdout_fd >= 0:
+            proc.stdout = None
+            if stdout is not None:
+                os.write(stdout_fd, stdout)
+        return proc
+
     mock.return_value = mock_proc
+    mock.side_effect = spawn
     return mock
 
 
+def read_stdin(proc, fd):
+    with open(fd, "rb", buffering=0) as f:
+        while data := f.read(65536):
+            proc.stdin_received += data
+
+
+def stdin_data(proc):
+    # written to stdin of a mock process (until closed)
+    for thread in proc.stdin_threads:
+        thread.join()
+    return bytes(proc.stdin_received)
+
+
 # See: https://docs.pytest.org/en/latest/example/parametrize.html#apply-indirect-on-particular-arguments  # noqa: E501
 @pytest_asyncio.fixture(scope="function")
 async def mock_exec(request):
@@ -356,6 +407,249 @@ def test_parse_gfstat():
     assert st == parsed_stat
 
 
+async def read_lines(data, initial=b"", final_line=True, bufsize=4):
+    stream = asyncio.StreamReader()
+    stream.feed_data(data)
+    stream.feed_eof()
+    reader = gfarm_http_gateway.LineReader(stream, initial=initial,
+                                           final_line=final_line,
+                                           bufsize=bufsize)
+    lines = [line async for line in reader]
+    return lines, reader.remainder
+
+
+@pytest.mark.asyncio
+async def test_line_reader():
+    data = "abc\r\ndef\nあいう\rtail".encode()
+    lines, remainder = await read_lines(data[1:], initial=data[:1])
+    assert lines == ["abc", "", "def", "あいう", "tail"]
+    assert remainder == b""
+
+    lines, remainder = await read_lines(data, final_line=False)
+    assert lines == ["abc", "", "def", "あいう"]
+    assert remainder == b"tail"
+
+
+@pytest.mark.asyncio
+async def test_file_size_stat_cache():
+    def new_gfstat(env, path, metadata):
+        return mock_exec_common(Mock(), gfstat_file_stdout.encode(),
+                                b"", 0).return_value
+
+    env = {"GFARM_SASL_MECHANISMS": "PLAIN",
+           "GFARM_SASL_USER": "user1",
+           "GFARM_SASL_PASSWORD": "pass1"}
+    path = "/tmp/test.pdf"
+    size = gfarm_http_gateway.file_size
+    with patch("gfarm_http_gateway.gfstat",
+               AsyncMock(side_effect=new_gfstat)) as mock_gfstat:
+        assert await size(env, path) == (True, True, 54321)
+        assert await size(env, path) == (True, True, 54321)
+        assert mock_gfstat.call_count == 1
+
+        # another credential
+        env2 = dict(env, GFARM_SASL_PASSWORD="pass2")
+        await size(env2, path)
+        assert mock_gfstat.call_count == 2
+
+        # the parent directory is changed
+        gfarm_http_gateway.stat_cache.invalidate("/tmp")
+        await size(env, path)
+        assert mock_gfstat.call_count == 3
+    stats = gfarm_http_gateway.stat_cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 3
+    assert stats["invalidations"] == 2
+
+
+@pytest.mark.asyncio
+async def test_gf_spawn():
+    env = {"PATH": "/usr/bin:/bin"}
+    p = await gfarm_http_gateway.gf_spawn(
+        "echo", "a", "b",
+        env=env,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE)
+    stdout, _ = await p.communicate()
+    assert stdout == b"a b\n"
+
+    kwargs = gfarm_http_gateway.spawn_kwargs("echo", env)
+    assert kwargs["close_fds"] is False
+    assert os.path.isabs(kwargs["executable"])
+    kwargs = gfarm_http_gateway.spawn_kwargs("no-such-command", env)
+    assert kwargs == {"close_fds": True}
+    with pytest.raises(FileNotFoundError):
+        await gfarm_http_gateway.gf_spawn(
+            "no-such-command",
+            env=env,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE)
+
+
+@pytest.mark.asyncio
+async def test_transfer_pipe():
+    env = {"PATH": "/usr/bin:/bin"}
+    p = await gfarm_http_gateway.gf_spawn(
+        "cat",
+        env=env,
+        stdin=gfarm_http_gateway.TRANSFER_PIPE,
+        stdout=gfarm_http_gateway.TRANSFER_PIPE,
+        stderr=asyncio.subprocess.DEVNULL)
+    assert isinstance(p.stdin, gfarm_http_gateway.PipeWriter)
+    assert isinstance(p.stdout, gfarm_http_gateway.PipeReader)
+
+    data = os.urandom(3 * 1024 * 1024 + 1)
+
+    async def writer():
+        view = memoryview(data)
+        for i in range(0, len(data), 100000):
+            p.stdin.write(view[i:i + 100000])
+            await p.stdin.drain()
+        p.stdin.close()
+
+    async def reader():
+        out = bytearray()
+        buf = bytearray(65536)
+        while True:
+            n = await p.stdout.readinto(buf)
+            if n == 0:
+                break
+            out += buf[:n]
+        assert await p.stdout.read(1) == b""
+        return out
+
+    _, out = await asyncio.gather(writer(), reader())
+    assert out == data
+    assert await p.wait() == 0
+
+    # EPIPE
+    p = await gfarm_http_gateway.gf_spawn(
+        "true",
+        env=env,
+        stdin=gfarm_http_gateway.TRANSFER_PIPE,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.DEVNULL)
+    await p.wait()
+    with pytest.raises(ConnectionResetError):
+        p.stdin.write(data)
+        await p.stdin.drain()
+
+
+@pytest.mark.asyncio
+async def test_splice_copier():
+    env = {"PATH": "/usr/bin:/bin"}
+    procs = [await gfarm_http_gateway.gf_spawn(
+        "cat",
+        env=env,
+        stdin=gfarm_http_gateway.TRANSFER_PIPE,
+        stdout=gfarm_http_gateway.TRANSFER_PIPE,
+        stderr=asyncio.subprocess.DEVNULL) for _ in range(2)]
+    copier = gfarm_http_gateway.SpliceCopier(1, 65536)
+    assert copier.available(procs[0].stdout, procs[1].stdin)
+    data = os.urandom(3 * 1024 * 1024)
+
+    async def writer():
+        procs[0].stdin.write(data)
+        await procs[0].stdin.drain()
+        procs[0].stdin.close()
+
+    progress = gfarm_http_gateway.CopyProgress()
+
+    async def copy():
+        await copier.copy(procs[0].stdout, procs[1].stdin, progress)
+        procs[1].stdin.close()
+
+    _, _, out = await asyncio.gather(writer(), copy(),
+                                     procs[1].stdout.read(len(data) + 1))
+    while len(out) < len(data):
+        chunk = await procs[1].stdout.read(len(data))
+        assert chunk
+        out += chunk
+    assert out == data
+    assert progress.copied == len(data)
+    assert copier.stats() == {"running": 0, "copies": 1, "fallbacks": 0}
+    for p in procs:
+        assert await p.wait() == 0
+
+
+@pytest.mark.asyncio
+async def test_spawn_limiter():
+    limiter = gfarm_http_gateway.SpawnLimiter(2, 1, 2, 0)
+    await limiter.acquire("user1")
+    await limiter.acquire("user2")
+    # user1 waits for the global limit, user3 waits behind it
+    w1 = asyncio.create_task(limiter.acquire("user1"))
+    w3 = asyncio.create_task(limiter.acquire("user3"))
+    await asyncio.sleep(0)
+    assert limiter.stats()["queue_depth"] == 2
+    # the queue is full
+    with pytest.raises(gfarm_http_gateway.SpawnRejected) as e:
+        await limiter.acquire("user4")
+    assert e.value.status_code == 503
+    assert "Retry-After" in e.value.headers
+
+    # user1 is still at the per-user limit, so user3 starts first
+    limiter.release("user2")
+    await asyncio.sleep(0)
+    assert w3.done() and not w1.done()
+    limiter.release("user1")
+    await asyncio.sleep(0)
+    assert w1.done()
+    stats = limiter.stats()
+    assert stats["running"] == 2
+    assert stats["queue_depth"] == 0
+    assert stats["admitted"] == 4
+    assert stats["rejected_503"] == 1
+
+    limiter = gfarm_http_gateway.SpawnLimiter(0, 1, 1, 0.01)
+    await limiter.acquire("user1")
+    with pytest.raises(gfarm_http_gateway.SpawnRejected) as e:
+        await limiter.acquire("user1")  # timeout
+    assert e.value.status_code == 503
+    assert limiter.stats()["queue_depth"] == 0
+
+
+@pytest.mark.asyncio
+async def test_spawn_reservation():
+    limiter = gfarm_http_gateway.SpawnLimiter(0, 3, 2, 0)
+    await limiter.acquire("user1")
+    # all slots or nothing
+    w = asyncio.create_task(limiter.reserve("user1", 3))
+    await asyncio.sleep(0)
+    assert not w.done()
+    limiter.release("user1")
+    await asyncio.sleep(0)
+    reservation = await w
+    assert limiter.available("user1") == 0
+    assert reservation.take("user1") and reservation.take("user1")
+    assert not reservation.take("user2")
+    reservation.put_back()
+    # a slot of a running process is released when it exits
+    reservation.close()
+    assert limiter.available("user1") == 2
+    assert not reservation.take("user1")
+    reservation.put_back()
+    assert limiter.available("user1") == 3
+    # capped by the per-user limit
+    reservation = await limiter.reserve("user1", 5)
+    assert reservation.free == 3
+    reservation.close()
+    assert limiter.stats()["running"] == 0
+
+
+def test_spawn_limiter_reject_user():
+    limiter = gfarm_http_gateway.SpawnLimiter(0, 1, 0, 0)
+    limiter._start(userpass_str.split(":")[0])
+    with patch("gfarm_http_gateway.spawn_limiter", limiter):
+        response = client.get("/attr/testdir",
+                              headers=req_headers_basic_auth)
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "1"
+    assert limiter.stats()["rejected_429"] == 1
+
+
 expect_gfwhoami_stdout = "testuser"
 expect_gfwhoami = (expect_gfwhoami_stdout.encode(), b"error", 0)
 
@@ -525,6 +819,128 @@ async def test_dir_list_json(mock_claims, mock_size_not_file, mock_exec):
     assert response.json() == [expect_gfls_json_stdout]
 
 
+gfls_success_param_multi = (
+    b"drwxr-xr-x 4 user group 0 Jul 25 04:13:58 2025 .\n"
+    b"-rw-r--r-- 1 user group 6686 Mar 31 17:20:10 2025 file_a.txt\n"
+    b"-rw-r--r-- 1 user group 5678 Jun 01 09:00:00 2024 file_b.txt\n",
+    b"", 0)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mock_exec", [gfls_success_param_multi],
+                         indirect=True)
+async def test_dir_list_ndjson(mock_claims, mock_size_not_file, mock_exec):
+    response = client.get("/dir/testdir?output_format=ndjson",
+                          headers=req_headers_oidc_auth)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    entries = [json.loads(line) for line in response.text.splitlines()]
+    assert [e["name"] for e in entries] == [".", "file_a.txt", "file_b.txt"]
+    assert entries[1]["path"] == "/testdir/file_a.txt"
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mock_exec", [gfls_success_param], indirect=True)
+async def test_dir_list_json_stream(mock_claims, mock_size_not_file,
+                                    mock_exec):
+    response = client.get("/dir/testdir?stream=1",
+                          headers=req_headers_oidc_auth)
+    assert response.status_code == 200
+    assert response.json() == [expect_gfls_json_stdout]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mock_exec", [gfls_success_param_multi],
+                         indirect=True)
+async def test_dir_list_paginate(mock_claims, mock_size_not_file, mock_exec):
+    url = "/dir/testdir?sort=size&reverse=1&limit=2"
+    response = client.get(url, headers=req_headers_oidc_auth)
+    assert response.status_code == 200
+    assert response.headers["x-total-count"] == "3"
+    assert [e["name"] for e in response.json()] == \
+        ["file_a.txt", "file_b.txt"]
+    cursor = response.headers["x-next-cursor"]
+    assert mock_exec.call_count == 1
+
+    response = client.get(f"{url}&cursor={cursor}",
+                          headers=req_headers_oidc_auth)
+    assert response.status_code == 200
+    assert [e["name"] for e in response.json()] == ["."]
+    assert "x-next-cursor" not in response.headers
+    assert mock_exec.call_count == 1  # from the snapshot
+
+    # parameters differ from the snapshot
+    response = client.get(f"/dir/testdir?limit=2&cursor={cursor}",
+                          headers=req_headers_oidc_auth)
+    assert response.status_code == 410
+
+
+@pytest.mark.asyncio
+async def test_dir_list_paginate_resume(mock_claims, mock_size_not_file):
+    # a new gfls process for each request
+    def new_proc(*args, **kwargs):
+        return mock_exec_common(
+            Mock(), *gfls_success_param_multi).return_value
+
+    url = "/dir/testdir?sort=size&reverse=1&limit=1"
+    with patch("asyncio.create_subprocess_exec",
+               AsyncMock(side_effect=new_proc)) as mock_exec:
+        response = client.get(url, headers=req_headers_oidc_auth)
+        assert [e["name"] for e in response.json()] == ["file_a.txt"]
+        cursor = response.headers["x-next-cursor"]
+
+        # the snapshot is in another worker process:
+        # gfls again, and resume after the last entry
+        snapshots = gfarm_http_gateway.ListingSnapshots(60, 4)
+        with patch("gfarm_http_gateway.dir_snapshots", snapshots):
+            response = client.get(f"{url}&cursor={cursor}",
+                                  headers=req_headers_oidc_auth)
+            assert response.status_code == 200
+            assert response.headers["x-total-count"] == "3"
+            assert [e["name"] for e in response.json()] == ["file_b.txt"]
+            assert mock_exec.call_count == 2
+            cursor = response.headers["x-next-cursor"]
+            response = client.get(f"{url}&cursor={cursor}",
+                                  headers=req_headers_oidc_auth)
+            assert [e["name"] for e in response.json()] == ["."]
+            assert mock_exec.call_count == 2  # from the new snapshot
+
+        response = client.get(f"{url}&cursor=broken",
+                              headers=req_headers_oidc_auth)
+        assert response.status_code == 410
+
+
+gfls_file_param = (
+    b"-rw-r--r-- 1 user group 5678 Jun 01 09:00:00 2024"
+    b" /testdir/testfile1.txt\n", b"", 0)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mock_exec", [gfls_file_param], indirect=True)
+async def test_dir_list_probe_file(mock_claims, mock_exec):
+    response = client.get("/dir/testdir/testfile1.txt",
+                          headers=req_headers_oidc_auth)
+    assert response.status_code == 200
+    # without gfstat
+    assert mock_exec.call_count == 1
+    args, kwargs = mock_exec.call_args
+    assert args == ('gfls', '-l', '-T', '/testdir/testfile1.txt')
+    entry = response.json()[0]
+    assert entry["name"] == "testfile1.txt"
+    assert entry["path"] == "/testdir/testfile1.txt"
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mock_exec", [
+    (b"gfls: /nodir: no such file or directory\n", b"", 1)], indirect=True)
+async def test_dir_list_probe_not_found(mock_claims, mock_exec):
+    response = client.get("/dir/nodir?ign_err=1",
+                          headers=req_headers_oidc_auth)
+    assert_gfarm_http_error(response, 404, "gfls", None, None)
+    args, kwargs = mock_exec.call_args
+    assert args == ('gfstat', '/nodir')
+
+
 expect_gfls_err_msg = "test gfls (error)"
 expect_gfls_err = ((expect_gfls_err_msg + "\n").encode(), b"error", 1)
 
@@ -590,6 +1006,299 @@ async def test_file_export(mock_claims, mock_gfstat, mock_exec):
     args, kwargs = mock_exec.call_args
     assert args == ('gfexport', '/a/testfile.txt')
     assert response.content == gfexport_stdout
+    assert response.headers["accept-ranges"] == "bytes"
+
+
+@pytest.mark.asyncio
+async def test_file_export_gfstat_error(mock_claims):
+    proc = MagicMock()
+    proc.returncode = None
+    proc.wait = AsyncMock(return_value=-9)
+    spawned = asyncio.Event()
+
+    async def gfexport(env, path):
+        spawned.set()
+        return proc, ["gfexport", path]
+
+    async def file_stat(env, path):
+        # fail while gfexport is running
+        await spawned.wait()
+        raise RuntimeError("gfstat failed")
+
+    with patch("gfarm_http_gateway.gfexport", gfexport), \
+         patch("gfarm_http_gateway.file_stat", file_stat):
+        with pytest.raises(RuntimeError):
+            client.get("/file/a/testfile.txt",
+                       headers=req_headers_oidc_auth)
+    # gfexport started ahead is not left running
+    proc.kill.assert_called_once()
+    proc.wait.assert_awaited()
+
+
+expect_gfstat_export = (gfstat_file_stdout.replace(
+    "54321", str(len(gfexport_stdout))).encode(), b"", 0)
+
+
+@pytest_asyncio.fixture(scope="function")
+async def mock_exec_gfexport():
+    # a new process for each request
+    def new_proc(*args, **kwargs):
+        return mock_exec_common(Mock(), gfexport_stdout, b"", 0)(*args,
+                                                                 **kwargs)
+
+    with patch("asyncio.create_subprocess_exec",
+               AsyncMock(side_effect=new_proc)) as mock:
+        yield mock
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mock_gfstat", [expect_gfstat_export],
+                         indirect=True)
+async def test_file_export_range(mock_claims, mock_gfstat,
+                                 mock_exec_gfexport):
+    url = "/file/a/testfile.txt"
+    headers = dict(req_headers_oidc_auth, Range="bytes=5-10")
+    response = client.get(url, headers=headers)
+    assert response.status_code == 206
+    assert response.headers["content-range"] == "bytes 5-10/16"
+    assert response.content == gfexport_stdout[5:11]
+
+    # suffix
+    headers["Range"] = "bytes=-4"
+    response = client.get(url, headers=headers)
+    assert response.status_code == 206
+    assert response.headers["content-range"] == "bytes 12-15/16"
+    assert response.content == b"data"
+
+    # If-Range does not match: whole file
+    headers["If-Range"] = "Wed, 21 Oct 2015 07:28:00 GMT"
+    response = client.get(url, headers=headers)
+    assert response.status_code == 200
+    assert response.content == gfexport_stdout
+    headers["If-Range"] = response.headers["last-modified"]
+    response = client.get(url, headers=headers)
+    assert response.status_code == 206
+    del headers["If-Range"]
+
+    # not satisfiable
+    headers["Range"] = "bytes=16-"
+    response = client.get(url, headers=headers)
+    assert response.status_code == 416
+    assert response.headers["content-range"] == "bytes */16"
+
+    # invalid: ignored
+    headers["Range"] = "bytes=5-1"
+    response = client.get(url, headers=headers)
+    assert response.status_code == 200
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mock_gfstat", [expect_gfstat_export],
+                         indirect=True)
+async def test_file_export_multi_range(mock_claims, mock_gfstat,
+                                       mock_exec_gfexport):
+    headers = dict(req_headers_oidc_auth, Range="bytes=12-,0-3,2-4")
+    response = client.get("/file/a/testfile.txt", headers=headers)
+    assert response.status_code == 206
+    media_type, boundary = response.headers["content-type"].split("; ")
+    assert media_type == "multipart/byteranges"
+    boundary = boundary.split("=", 1)[1]
+    assert int(response.headers["content-length"]) == len(response.content)
+    parts = response.content.split(f"--{boundary}".encode())
+    assert parts[-1] == b"--\r\n"
+    assert parts[1].endswith(b"Content-Range: bytes 0-4/16\r\n\r\ntest \r\n")
+    assert parts[2].endswith(b"Content-Range: bytes 12-15/16\r\n\r\ndata\r\n")
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mock_gfstat", [expect_gfstat_export],
+                         indirect=True)
+async def test_file_export_conditional(mock_claims, mock_gfstat,
+                                       mock_exec_gfexport):
+    url = "/file/a/testfile.txt"
+    response = client.get(url, headers=req_headers_oidc_auth)
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+    assert etag == '"5f5e0ff-98967f-10-67aa4513.071120060"'
+    last_modified = response.headers["last-modified"]
+    assert last_modified == "Mon, 10 Feb 2025 18:27:31 GMT"
+    assert mock_exec_gfexport.call_count == 1
+
+    headers = dict(req_headers_oidc_auth, **{"If-None-Match": etag})
+    response = client.get(url, headers=headers)
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    headers = dict(req_headers_oidc_auth,
+                   **{"If-Modified-Since": last_modified})
+    response = client.get(url, headers=headers)
+    assert response.status_code == 304
+    # gfexport is not started
+    assert mock_exec_gfexport.call_count == 1
+
+    headers = dict(req_headers_oidc_auth, **{"If-None-Match": '"other"'})
+    response = client.get(url, headers=headers)
+    assert response.status_code == 200
+    assert response.content == gfexport_stdout
+
+    headers = dict(req_headers_oidc_auth, Range="bytes=0-3",
+                   **{"If-Range": etag})
+    response = client.get(url, headers=headers)
+    assert response.status_code == 206
+    assert response.content == b"test"
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mock_gfstat", [expect_gfstat_export],
+                         indirect=True)
+async def test_file_head(mock_claims, mock_gfstat, mock_exec_gfexport):
+    url = "/file/a/testfile.txt?action=download"
+    response = client.head(url, headers=req_headers_oidc_auth)
+    assert response.status_code == 200
+    assert response.headers["content-length"] == "16"
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "etag" in response.headers
+    assert "attachment" in response.headers["content-disposition"]
+    assert response.content == b""
+    headers = dict(req_headers_oidc_auth,
+                   **{"If-None-Match": response.headers["etag"]})
+    response = client.head(url, headers=headers)
+    assert response.status_code == 304
+    mock_exec_gfexport.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_file_export_content_cache(mock_claims, mock_exec_gfexport,
+                                         tmp_path):
+    def new_gfstat(env, path, metadata):
+        return mock_exec_common(Mock(), *expect_gfstat_export).return_value
+
+    cache = gfarm_http_gateway.ContentCache(str(tmp_path), 1024, 1024, 60)
+    url = "/file/a/testfile.txt"
+    with patch("gfarm_http_gateway.content_cache", cache), \
+         patch("gfarm_http_gateway.gfstat",
+               AsyncMock(side_effect=new_gfstat)), \
+         patch("gfarm_http_gateway.can_access",
+               AsyncMock(return_value=True)) as mock_can_access:
+        response = client.get(url, headers=req_headers_oidc_auth)
+        assert response.status_code == 200
+        assert response.content == gfexport_stdout
+        assert cache.stats()["fills"] == 1
+        assert os.listdir(cache.directory) == [
+            cache.key("/a/testfile.txt",
+                      gfarm_http_gateway.parse_gfstat(
+                          expect_gfstat_export[0].decode()))]
+
+        # served from the cache
+        response = client.get(url, headers=req_headers_oidc_auth)
+        assert response.content == gfexport_stdout
+        headers = dict(req_headers_oidc_auth, Range="bytes=5-10")
+        response = client.get(url, headers=headers)
+        assert response.status_code == 206
+        assert response.content == gfexport_stdout[5:11]
+        assert mock_exec_gfexport.call_count == 1
+        mock_can_access.assert_not_called()
+
+        # another user
+        response = client.get(url, headers=req_headers_basic_auth)
+        assert response.content == gfexport_stdout
+        assert mock_can_access.call_count == 1
+        assert mock_exec_gfexport.call_count == 1
+
+        # not allowed: gfexport reports the error
+        mock_can_access.return_value = False
+        headers = {"Authorization": "Basic " + base64.b64encode(
+            b"user2:pass2").decode()}
+        response = client.get(url, headers=headers)
+        assert mock_exec_gfexport.call_count == 2
+    stats = cache.stats()
+    assert stats["hits"] == 3
+    assert stats["misses"] == 2
+    assert stats["bytes"] == len(gfexport_stdout)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mock_gfstat", [expect_gfstat_export],
+                         indirect=True)
+async def test_file_export_sync(mock_claims, mock_gfstat):
+    def sync_gfexport(env, path):
+        args = ["printf", gfexport_stdout.decode()]
+        return subprocess.Popen(args, stdout=subprocess.PIPE), args
+
+    url = "/file/a/testfile.txt"
+    with patch("gfarm_http_gateway.ASYNC_GFEXPORT", False), \
+         patch("gfarm_http_gateway.sync_gfexport",
+               side_effect=sync_gfexport) as mock_sync_gfexport:
+        response = client.get(url, headers=req_headers_oidc_auth)
+        assert response.status_code == 200
+        assert response.content == gfexport_stdout
+        headers = dict(req_headers_oidc_auth, Range="bytes=0-3")
+        response = client.get(url, headers=headers)
+        assert response.status_code == 206
+        assert response.content == b"test"
+    assert mock_sync_gfexport.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_threaded_pipe_reader():
+    r, w = os.pipe()
+    os.write(w, b"abcdef")
+    os.close(w)
+    with open(r, "rb", buffering=0) as f:
+        reader = gfarm_http_gateway.ThreadedPipeReader(
+            f, gfarm_http_gateway.sync_gfexport_executor, size=4, maxsize=1)
+        assert await reader.read() == b"a"
+        assert await reader.read() == b"bcde"
+        assert await reader.read() == b"f"
+        assert await reader.read() == b""
+        assert await reader.read() == b""
+        await reader.close()
+
+
+@pytest.mark.asyncio
+async def test_content_cache_coalesce(tmp_path):
+    cache = gfarm_http_gateway.ContentCache(str(tmp_path), 10, 10, 60)
+    st = gfarm_http_gateway.parse_gfstat(gfstat_file_stdout)
+    st.Size = 4
+    env = {"GFARM_SASL_MECHANISMS": "PLAIN",
+           "GFARM_SASL_USER": "user1",
+           "GFARM_SASL_PASSWORD": "pass1"}
+    f, fill = await cache.lookup(env, "/a", st)
+    assert f is None and fill is not None
+    # not wait for the fill, nor fill again
+    assert await cache.lookup(env, "/a", st) == (None, None)
+    fill.write(b"data")
+    fill.commit()
+    f, fill = await cache.lookup(env, "/a", st)
+    assert fill is None and f.read() == b"data"
+    f.close()
+
+    # a failed fill can be retried
+    st3 = st.model_copy(update={"Size": 3})
+    f, fill = await cache.lookup(env, "/c", st3)
+    fill.abort()
+    assert await cache.lookup(env, "/c", st3, fill=False) == (None, None)
+    f, fill = await cache.lookup(env, "/c", st3)
+    assert fill is not None
+    fill.abort()
+
+    # evicted by the size limit
+    st2 = st.model_copy(update={"Size": 8})
+    f, fill = await cache.lookup(env, "/b", st2)
+    fill.write(b"12345678")
+    fill.commit()
+    stats = cache.stats()
+    assert stats["entries"] == 1 and stats["evictions"] == 1
+    assert stats["coalesced"] == 1 and stats["fill_failures"] == 2
+
+
+def test_parse_range():
+    parse_range = gfarm_http_gateway.parse_range
+    assert parse_range("bytes=0-0,-1", 10) == [(0, 1), (9, 10)]
+    assert parse_range("bytes=3-5,4-8, 9-", 10) == [(3, 10)]
+    assert parse_range("bytes=-20", 10) == [(0, 10)]
+    assert parse_range("bytes=10-,-0", 10) == []
+    assert parse_range("bytes=a-b", 10) is None
+    assert parse_range("items=0-1", 10) is None
 
 
 @pytest.mark.asyncio
@@ -603,15 +1312,169 @@ async def test_file_import(mock_claims, mock_gfmv, mock_exec):
     assert response.status_code == 200
     assert response.text == no_stdout
     gfreg_proc = mock_exec.return_value
-    written_data = b"".join([call.args[0] for call in
-                             gfreg_proc.stdin.write.call_args_list])
-    assert written_data == input_data
+    assert stdin_data(gfreg_proc) == input_data
     args, kwargs = mock_exec.call_args
     assert args[0] == 'gfreg'
     args, kwargs = mock_gfmv.call_args
     assert args[2] == '/a/testfile.txt'
 
 
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mock_gfmv", [expect_no_stdout], indirect=True)
+@pytest.mark.parametrize("mock_exec", [expect_no_stdout], indirect=True)
+async def test_upload_resumable(mock_claims, mock_gfmv, mock_exec, tmp_path):
+    staged = []
+
+    def gfreg(*args, **kwargs):
+        # stdin is the staged file
+        staged.append(os.pread(kwargs["stdin"], 100, 0))
+        return mock_exec.return_value
+
+    mock_exec.side_effect = gfreg
+    with patch.object(gfarm_http_gateway.upload_sessions, "directory",
+                      str(tmp_path)):
+        response = client.post("/upload/a/testfile.txt",
+                               headers={**req_headers_oidc_auth,
+                                        "Upload-Length": "10"})
+        assert response.status_code == 201
+        upload_id = response.json()["upload_id"]
+        url = f"/upload/a/testfile.txt?upload_id={upload_id}"
+        assert response.headers["Location"] == url
+
+        response = client.patch(url, content=b"01234",
+                                headers={**req_headers_oidc_auth,
+                                         "Upload-Offset": "0"})
+        assert response.status_code == 204
+        assert response.headers["Upload-Offset"] == "5"
+        # incomplete
+        response = client.put(url, headers=req_headers_oidc_auth)
+        assert response.status_code == 409
+        # resume from the wrong offset
+        response = client.patch(url, content=b"56789",
+                                headers={**req_headers_oidc_auth,
+                                         "Upload-Offset": "0"})
+        assert response.status_code == 409
+        assert response.headers["Upload-Offset"] == "5"
+        response = client.head(url, headers=req_headers_oidc_auth)
+        assert response.headers["Upload-Offset"] == "5"
+        assert response.headers["Upload-Length"] == "10"
+        response = client.patch(url, content=b"56789",
+                                headers={**req_headers_oidc_auth,
+                                         "Upload-Offset": "5"})
+        assert response.headers["Upload-Offset"] == "10"
+        response = client.patch(url, content=b"a",
+                                headers={**req_headers_oidc_auth,
+                                         "Upload-Offset": "10"})
+        assert response.status_code == 413
+
+        response = client.put(url, headers=req_headers_oidc_auth)
+        assert response.status_code == 200
+        assert staged == [b"0123456789"]
+        args, kwargs = mock_exec.call_args
+        assert args[0] == "gfreg"
+        args, kwargs = mock_gfmv.call_args
+        assert args[2] == "/a/testfile.txt"
+        # the session is removed
+        response = client.head(url, headers=req_headers_oidc_auth)
+        assert response.status_code == 404
+        assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mock_gfmv", [expect_no_stdout], indirect=True)
+@pytest.mark.parametrize("mock_exec", [expect_no_stdout], indirect=True)
+async def test_upload_multipart(mock_claims, mock_gfmv, mock_exec, tmp_path):
+    def md5(data):
+        return hashlib.md5(data).hexdigest()
+
+    with patch.object(gfarm_http_gateway.upload_sessions, "directory",
+                      str(tmp_path)):
+        response = client.post("/upload/a/testfile.txt?multipart=true",
+                               headers=req_headers_oidc_auth)
+        assert response.status_code == 201
+        url = response.headers["Location"]
+
+        response = client.put(url + "&part_number=2", content=b"world",
+                              headers=req_headers_oidc_auth)
+        assert response.status_code == 200
+        assert response.headers["ETag"] == f'"{md5(b"world")}"'
+        content_md5 = base64.b64encode(hashlib.md5(b"xxx").digest())
+        response = client.put(url + "&part_number=1", content=b"hello ",
+                              headers={**req_headers_oidc_auth,
+                                       "Content-MD5": content_md5.decode()})
+        assert response.status_code == 400
+        content_md5 = base64.b64encode(hashlib.md5(b"hello ").digest())
+        response = client.put(url + "&part_number=1", content=b"hello ",
+                              headers={**req_headers_oidc_auth,
+                                       "Content-MD5": content_md5.decode()})
+        assert response.status_code == 200
+        response = client.patch(url, content=b"x",
+                                headers={**req_headers_oidc_auth,
+                                         "Upload-Offset": "0"})
+        assert response.status_code == 400
+
+        response = client.get(url, headers=req_headers_oidc_auth)
+        parts = response.json()["parts"]
+        assert [(part["part_number"], part["size"]) for part in parts] \
+            == [(1, 6), (2, 5)]
+
+        # a wrong ETag
+        complete = {"parts": [{"part_number": 1, "etag": md5(b"hello ")},
+                              {"part_number": 2, "etag": md5(b"hello ")}]}
+        response = client.put(url, json=complete,
+                              headers=req_headers_oidc_auth)
+        assert response.status_code == 400
+        complete["parts"][1]["etag"] = f'"{md5(b"world")}"'
+        # buffers are reused after drain()
+        gfreg_proc = mock_exec.return_value
+        received = len(stdin_data(gfreg_proc))
+        response = client.put(url, json=complete,
+                              headers=req_headers_oidc_auth)
+        assert response.status_code == 200
+        assert response.headers["ETag"].endswith('-2"')
+        assert stdin_data(gfreg_proc)[received:] == b"hello world"
+        args, kwargs = mock_gfmv.call_args
+        assert args[2] == "/a/testfile.txt"
+        assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mock_gfrm", [expect_no_stdout], indirect=True)
+@pytest.mark.parametrize("mock_gfmv", [expect_no_stdout], indirect=True)
+@pytest.mark.parametrize("mock_exec", [expect_no_stdout], indirect=True)
+async def test_file_import_digest(mock_claims, mock_gfmv, mock_gfrm,
+                                  mock_exec, tmp_path):
+    input_data = b"test data"
+    md5 = base64.b64encode(hashlib.md5(input_data).digest()).decode()
+    sha256 = base64.b64encode(hashlib.sha256(input_data).digest()).decode()
+    gfarm_conf = tmp_path / "gfarm2rc"
+    gfarm_conf.write_text("auth enable sasl *\ndigest sha256\n")
+    with patch("gfarm_http_gateway.GFARM_CONFIG_FILE", str(gfarm_conf)):
+        response = client.put("/file/a/testfile.txt",
+                              content=input_data,
+                              headers={**req_headers_oidc_auth,
+                                       "Content-MD5": md5})
+    assert response.status_code == 200
+    assert response.headers["Repr-Digest"] \
+        == f"md5=:{md5}:, sha-256=:{sha256}:"
+    mock_gfrm.assert_not_called()
+
+    response = client.put("/file/a/testfile.txt",
+                          content=input_data,
+                          headers={**req_headers_oidc_auth,
+                                   "Repr-Digest": f"sha-256=:{md5}:"})
+    assert_gfarm_http_error(response, 400, "gfreg",
+                            ["Digest mismatch (sha256)"], None)
+    args, kwargs = mock_gfrm.call_args
+    assert kwargs["force"] is True
+
+    response = client.put("/file/a/testfile.txt",
+                          content=input_data,
+                          headers={**req_headers_oidc_auth,
+                                   "Content-MD5": "?"})
+    assert response.status_code == 400
+
+
 expect_gfreg_err = (b"", b"error", 1)
 
 
@@ -637,9 +1500,7 @@ async def test_file_import_err(mock_claims, mock_gfrm, mock_exec):
                        repeat_str("abcde", MAXVIEWNAMELEN)]
     assert_gfarm_http_error(response, 500, "gfreg", expect_msg_list, None)
     gfreg_proc = mock_exec.return_value
-    written_data = b"".join([call.args[0] for call in
-                             gfreg_proc.stdin.write.call_args_list])
-    assert written_data == input_data
+    assert stdin_data(gfreg_proc) == input_data
 
     args, kwargs = mock_exec.call_args
     assert args[0] == 'gfreg'
@@ -692,6 +1553,68 @@ async def test_move_rename(mock_claims, mock_exec):
 expect_gfstat = (gfstat_dir_stdout.encode(), b"", 0)
 
 
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mock_exec", [expect_no_stdout], indirect=True)
+async def test_batch(mock_claims, mock_exec):
+    ops = [
+        {"op": "mkdir", "path": "/dir1", "p": True},
+        {"op": "remove", "path": "/dir1/file1.txt", "force": True},
+        {"op": "move", "path": "/dir1/file2.txt",
+         "destination": "/dir2/file2.txt"},
+        {"op": "chmod", "path": "/dir1/file3.txt"},  # no mode
+    ]
+    response = client.post("/batch", json={"operations": ops},
+                           headers=req_headers_oidc_auth)
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.iter_lines()]
+    assert lines[-1] == {"succeeded": 3, "failed": 1, "skipped": 0,
+                         "done": True}
+    results = {r["index"]: r for r in lines[:-1]}
+    assert sorted(results) == [0, 1, 2, 3]
+    assert results[0]["status_code"] == 200
+    assert results[3]["status_code"] == 422
+    commands = sorted(args for args, _ in mock_exec.call_args_list)
+    assert commands == [('gfmkdir', '-p', '/dir1'),
+                        ('gfmv', '/dir1/file2.txt', '/dir2/file2.txt'),
+                        ('gfrm', '-f', '/dir1/file1.txt')]
+
+    # stop_on_error
+    mock_exec.reset_mock()
+    with patch("gfarm_http_gateway.BATCH_CONCURRENCY", 1):
+        response = client.post("/batch",
+                               json={"operations": ops[::-1],
+                                     "stop_on_error": True},
+                               headers=req_headers_oidc_auth)
+    lines = [json.loads(line) for line in response.iter_lines()]
+    assert lines[-1] == {"succeeded": 0, "failed": 1, "skipped": 3,
+                         "done": True}
+    mock_exec.assert_not_called()
+
+    # the env is refreshed every BATCH_ENV_REFRESH operations
+    set_env = gfarm_http_gateway.set_env
+    with patch("gfarm_http_gateway.BATCH_ENV_REFRESH", 2), \
+         patch("gfarm_http_gateway.set_env",
+               AsyncMock(side_effect=set_env)) as mock_set_env:
+        response = client.post("/batch", json={"operations": ops[:3] * 2},
+                               headers=req_headers_oidc_auth)
+        lines = [json.loads(line) for line in response.iter_lines()]
+        assert lines[-1]["succeeded"] == 6
+        assert mock_set_env.call_count == 3
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mock_exec", [(expect_gfstat)], indirect=True)
+async def test_batch_stat(mock_claims, mock_exec):
+    response = client.post("/batch",
+                           json={"operations": [{"op": "stat",
+                                                 "path": "/testdir"}]},
+                           headers=req_headers_oidc_auth)
+    lines = [json.loads(line) for line in response.iter_lines()]
+    assert lines[0]["result"]["Filetype"] == "directory"
+    args, kwargs = mock_exec.call_args
+    assert args == ('gfstat', '-M', '/testdir')
+
+
 @pytest.mark.asyncio
 @pytest.mark.parametrize("mock_exec", [(expect_gfstat)], indirect=True)
 async def test_get_attr(mock_claims, mock_exec):
@@ -703,6 +1626,29 @@ async def test_get_attr(mock_claims, mock_exec):
     assert response.json() == parsed_stat
 
 
+expect_gfstat_many = ((gfstat_file_stdout + gfstat_dir_stdout).encode(),
+                      b"gfstat: /missing: no such file or directory\n", 1)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mock_exec", [expect_gfstat_many], indirect=True)
+async def test_get_attrs(mock_claims, mock_exec):
+    paths = ["/tmp/test.pdf", "/missing", "/tmp"]
+    response = client.post("/attr", json={"paths": paths},
+                           headers=req_headers_oidc_auth)
+    assert response.status_code == 200
+    # one gfstat for all paths
+    mock_exec.assert_called_once()
+    args, kwargs = mock_exec.call_args
+    assert args == ('gfstat', '-M', *paths)
+    result = response.json()
+    assert list(result) == paths
+    assert result["/tmp"] == parsed_stat
+    assert result["/tmp/test.pdf"]["Size"] == 54321
+    assert result["/missing"] == {
+        "error": "gfstat: /missing: no such file or directory"}
+
+
 @pytest.mark.asyncio
 @pytest.mark.parametrize("mock_exec", [expect_no_stdout], indirect=True)
 async def test_change_attr(mock_claims, mock_exec):
@@ -958,6 +1904,377 @@ async def test_zip_export_gfls_error(
         assert expected_filename not in namelist
 
 
+expect_gfls_stdout_compress = (
+    b"drwxr-xr-x 4 user group 0 Jul 25 04:13:58 2025 .\n"
+    b"drwxrwxr-x 5 user group 4 Jul 25 04:14:43 2025 ..\n"
+    b"-rw-r--r-- 1 user group 14 Mar 31 17:20:10 2025 a.txt\n"
+    b"-rw-r--r-- 1 user group 14 Jun 01 09:00:00 2024 b.jpg\n"
+    b"-rw-r--r-- 1 user group 17 Jun 01 09:00:00 2024 c.tar.gz\n"
+)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mock_gfexport", [(b"", 0)], indirect=True)
+async def test_zip_export_compress_type(
+        mock_claims,
+        mock_size_not_file,
+        mock_gfexport):
+    def infolist(data):
+        with patch("gfarm_http_gateway.gfls") as mock_gfls:
+            mock_exec_common(mock_gfls, expect_gfls_stdout_compress, b"", 0)
+            response = client.post("/zip", headers=req_headers_oidc_auth,
+                                   data=data)
+        assert response.status_code == 200
+        with zipfile.ZipFile(io.BytesIO(response.content)) as zf:
+            assert zf.read("testdir/a.txt") == b"/testdir/a.txt"
+            return zf.infolist()
+
+    def compress_types(data):
+        return {i.filename: i.compress_type for i in infolist(data)}
+
+    def compress_size(level):
+        data = {"paths": ["/testdir"], "compress_level": level}
+        return next(i.compress_size for i in infolist(data)
+                    if i.filename == "testdir/a.txt")
+
+    # compressed content types are stored
+    assert compress_types({"paths": ["/testdir"]}) == {
+        "testdir/a.txt": zipfile.ZIP_DEFLATED,
+        "testdir/b.jpg": zipfile.ZIP_STORED,
+        "testdir/c.tar.gz": zipfile.ZIP_STORED,
+    }
+    assert compress_types({"paths": ["/testdir"], "compress_level": 1}) \
+        == compress_types({"paths": ["/testdir"]})
+    # level 0: deflate without compression
+    assert compress_size(0) > compress_size(9)
+    assert set(compress_types({"paths": ["/testdir"],
+                               "store": True}).values()) \
+        == {zipfile.ZIP_STORED}
+
+    response = client.post("/zip", headers=req_headers_oidc_auth,
+                           data={"paths": ["/testdir"],
+                                 "compress_level": 10})
+    assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mock_gfexport", [(b"", 0)], indirect=True)
+async def test_zip_export_abort(
+        mock_claims,
+        mock_size_not_file,
+        mock_gfexport):
+    class AbortingWriter(gfarm_http_gateway.ZipStreamWriter):
+        def write(self, data):
+            if not self._in_loop():
+                self.abort()  # the client has gone while writing a file
+            return super().write(data)
+
+    with patch("gfarm_http_gateway.gfls") as mock_gfls, \
+         patch("gfarm_http_gateway.ZipStreamWriter", AbortingWriter), \
+         patch.object(gfarm_http_gateway.logger, "debug") as mock_debug:
+        mock_exec_common(mock_gfls, expect_gfls_stdout_compress, b"", 0)
+        response = client.post("/zip", headers=req_headers_oidc_auth,
+                               data={"paths": ["/testdir"]})
+    messages = [str(args[0]) for args, _ in mock_debug.call_args_list]
+    assert any("zip aborted" in m for m in messages)
+    assert not any("zip create error" in m for m in messages)
+    assert response.status_code == 200
+
+
+expect_gfls_stdout_store = (
+    b"drwxr-xr-x 4 user group 0 Jul 25 04:13:58 2025 .\n"
+    b"drwxrwxr-x 5 user group 4 Jul 25 04:14:43 2025 ..\n"
+    b"-rw-r--r-- 1 user group 14 Mar 31 17:20:10 2025 a.txt\n"
+    b"-rw-r--r-- 1 user group 0 Jun 01 09:00:00 2024 empty\n"
+    b"-rw-r--r-- 1 user group 24 Jun 01 09:00:00 2024 shrunk.txt\n"
+    b"lrwxrwxrwx 1 user group 5 Jun 01 09:00:00 2024 link -> a.txt\n"
+    b"drwxr-xr-x 1 user group 0 Jun 01 09:00:00 2024 sub\n"
+    b"\n"
+    b"/testdir/sub:\n"
+    b"-rw-r--r-- 1 user group 18 Jun 01 09:00:00 2024 b.jpg\n"
+)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mock_gfexport", [(b"", 0)], indirect=True)
+async def test_zip_export_store(
+        mock_claims,
+        mock_size_not_file,
+        mock_gfexport):
+    # mock_gfexport outputs the path
+    def post(headers={}):
+        with patch("gfarm_http_gateway.gfls") as mock_gfls:
+            mock_exec_common(mock_gfls, expect_gfls_stdout_store, b"", 0)
+            return client.post(
+                "/zip", headers={**req_headers_oidc_auth, **headers},
+                data={"paths": ["/testdir"], "store": True})
+
+    response = post()
+    assert response.status_code == 200
+    assert response.headers["accept-ranges"] == "bytes"
+    content = response.content
+    assert int(response.headers["content-length"]) == len(content)
+    with zipfile.ZipFile(io.BytesIO(content)) as zf:
+        assert zf.testzip() is None  # CRC-32
+        assert zf.namelist() == [
+            "testdir/a.txt", "testdir/empty", "testdir/shrunk.txt",
+            "testdir/link", "testdir/sub/", "testdir/sub/b.jpg"]
+        assert {i.compress_type for i in zf.infolist()} \
+            == {zipfile.ZIP_STORED}
+        assert zf.read("testdir/a.txt") == b"/testdir/a.txt"
+        assert zf.read("testdir/sub/b.jpg") == b"/testdir/sub/b.jpg"
+        assert zf.read("testdir/empty") == b""
+        # the size from gfls
+        assert zf.read("testdir/shrunk.txt") == b"/testdir/shrunk.txt" \
+            + bytes(5)
+        assert zf.read("testdir/link") == b"a.txt"
+        link = zf.getinfo("testdir/link")
+        assert stat.S_ISLNK(link.external_attr >> 16)
+        assert zf.getinfo("testdir/sub/").is_dir()
+    # empty files are not exported
+    assert mock_gfexport.call_count == 3
+
+    etag = response.headers["etag"]
+    assert etag.startswith('W/"')
+    for value, start, end in (("bytes=5-40", 5, 41),
+                              ("bytes=-30", len(content) - 30, len(content)),
+                              ("bytes=100-", 100, len(content))):
+        response = post({"Range": value})
+        assert response.status_code == 206
+        assert response.headers["content-range"] \
+            == f"bytes {start}-{end - 1}/{len(content)}"
+        assert response.content == content[start:end]
+
+    response = post({"Range": "bytes=0-9,20-29"})
+    assert response.status_code == 206
+    assert response.headers["content-type"].startswith(
+        "multipart/byteranges")
+    assert content[20:30] in response.content
+    assert int(response.headers["content-length"]) \
+        == len(response.content)
+
+    # the weak ETag does not match If-Range: whole archive
+    for value in ('"other"', etag, etag.removeprefix("W/")):
+        response = post({"Range": "bytes=5-40", "If-Range": value})
+        assert response.status_code == 200
+        assert response.content == content
+
+    response = post({"Range": f"bytes={len(content)}-"})
+    assert response.status_code == 416
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mock_gfexport", [(b"", 0)], indirect=True)
+async def test_tar_export(
+        mock_claims,
+        mock_size_not_file,
+        mock_gfexport):
+    # mock_gfexport outputs the path
+    def post(data):
+        with patch("gfarm_http_gateway.gfls") as mock_gfls:
+            mock_exec_common(mock_gfls, expect_gfls_stdout_store, b"", 0)
+            return client.post("/tar", headers=req_headers_oidc_auth,
+                               data={"paths": ["/testdir"], **data})
+
+    def check(content, mode):
+        with tarfile.open(fileobj=io.BytesIO(content), mode=mode) as tf:
+            members = {m.name: m for m in tf.getmembers()}
+            assert list(members) == [
+                "testdir/a.txt", "testdir/empty", "testdir/shrunk.txt",
+                "testdir/link", "testdir/sub", "testdir/sub/b.jpg"]
+            a = members["testdir/a.txt"]
+            assert a.isreg() and a.mode == 0o644 and a.uname == "user"
+            assert a.mtime == int(time.mktime(time.strptime(
+                "Mar 31 17:20:10 2025", "%b %d %H:%M:%S %Y")))
+            assert tf.extractfile(a).read() == b"/testdir/a.txt"
+            assert tf.extractfile("testdir/sub/b.jpg").read() \
+                == b"/testdir/sub/b.jpg"
+            # the size from gfls
+            assert tf.extractfile("testdir/shrunk.txt").read() \
+                == b"/testdir/shrunk.txt" + bytes(5)
+            link = members["testdir/link"]
+            assert link.issym() and link.linkname == "a.txt"
+            assert link.mode == 0o777
+            sub = members["testdir/sub"]
+            assert sub.isdir() and sub.mode == 0o755
+
+    response = post({})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-tar"
+    assert response.headers["content-disposition"].endswith('.tar"')
+    assert len(response.content) % tarfile.RECORDSIZE == 0
+    check(response.content, "r:")
+
+    response = post({"compression": "gzip", "compress_level": 1})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/gzip"
+    assert response.headers["content-disposition"].endswith('.tar.gz"')
+    check(response.content, "r:gz")
+
+    response = post({"compression": "gzip", "compress_level": 10})
+    assert response.status_code == 400
+    response = post({"compression": "xz"})
+    assert response.status_code == 422
+
+    if shutil.which("zstd") is not None:
+        response = post({"compression": "zstd"})
+        assert response.status_code == 200
+        assert response.headers["content-disposition"].endswith(
+            '.tar.zst"')
+        tar = subprocess.run(["zstd", "-d", "-c"], input=response.content,
+                             stdout=subprocess.PIPE, check=True).stdout
+        check(tar, "r:")
+
+
+def test_stored_zip_zip64(tmp_path):
+    def entry(name, size, mode_str="-rw-r--r--"):
+        return gfarm_http_gateway.Gfls_Entry(
+            name, 1, "user", "group", size, "/d",
+            "Jun 01 09:00:00 2024", mode_str)
+
+    big = 5 * 1024 ** 3
+    stored = gfarm_http_gateway.StoredZip([
+        ("d/big", entry("big", big)),
+        ("d/small", entry("small", 10)),
+        ("d/sub/", entry("sub", 0, "drwxr-xr-x")),
+    ])
+    for m in stored.members:
+        m.crc = 0
+    assert stored.zip64
+    # a sparse file with the central directory only
+    path = tmp_path / "big.zip"
+    with open(path, "wb") as f:
+        f.seek(stored.cd_offset)
+        f.write(stored.central_directory())
+    assert os.path.getsize(path) == stored.size
+    with zipfile.ZipFile(path) as zf:
+        infos = zf.infolist()
+        assert [i.filename for i in infos] == ["d/big", "d/small", "d/sub/"]
+        assert infos[0].file_size == big
+        assert infos[1].header_offset == stored.members[1].offset > big
+        assert infos[1].file_size == 10
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mock_gfexport", [(b"", 0)], indirect=True)
+async def test_zip_prefetch(mock_gfexport):
+    # mock_gfexport outputs the path
+    def entry(path, mode_str):
+        return gfarm_http_gateway.Gfls_Entry(
+            os.path.basename(path), 1, "user", "group", 0,
+            os.path.dirname(path), "Jun 01 09:00:00 2024", mode_str)
+
+    async def walk():
+        yield entry("/d", "drwxr-xr-x")
+        for i in range(5):
+            yield entry(f"/d/f{i}", "-rw-r--r--")
+
+    async def get_env():
+        return {}
+
+    result = []
+    async with contextlib.aclosing(gfarm_http_gateway.prefetch_exports(
+            walk(), get_env, 2, 1)) as entries:
+        async for e, prefetch in entries:
+            if e.is_dir:
+                assert prefetch is None
+                continue
+            if e.path == "/d/f0":
+                # started ahead
+                await asyncio.sleep(0)
+                assert mock_gfexport.call_count >= 2
+            data = b"".join([d async for d in prefetch.chunks()])
+            assert await prefetch.wait() == 0
+            result.append(data)
+    assert result == [f"/d/f{i}".encode() for i in range(5)]
+
+
+@pytest.mark.asyncio
+async def test_zip_prefetch_stop():
+    # the consumer stops early (ex. client disconnected)
+    closed = False
+
+    async def walk():
+        nonlocal closed
+        try:
+            for i in range(100):
+                yield gfarm_http_gateway.Gfls_Entry(
+                    f"d{i}", 1, "user", "group", 0, "/",
+                    "Jun 01 09:00:00 2024", "drwxr-xr-x")
+        finally:
+            closed = True
+
+    async def get_env():
+        return {}
+
+    tasks = asyncio.all_tasks()
+    async with contextlib.aclosing(gfarm_http_gateway.prefetch_exports(
+            walk(), get_env, 4, 1)) as entries:
+        async for e, prefetch in entries:
+            await asyncio.sleep(0.01)  # the queue is full
+            break
+    assert closed
+    assert asyncio.all_tasks() == tasks
+
+
+@pytest.mark.asyncio
+async def test_prefetch_budget():
+    budget = gfarm_http_gateway.PrefetchBudget(10)
+    prefetch = Mock(active=False, buffered=0)
+    await budget.acquire(10, prefetch)
+    await budget.activate(prefetch)
+    await budget.release(10, prefetch)
+    # the active file: a chunk over the limit
+    await budget.acquire(100, prefetch)
+    acquire = asyncio.create_task(budget.acquire(100, prefetch))
+    await asyncio.sleep(0.01)
+    assert not acquire.done()
+    await budget.release(100, prefetch)
+    await acquire
+    assert budget.used == prefetch.buffered == 100
+
+
+@pytest.mark.asyncio
+async def test_zip_stream_writer_backpressure():
+    writer = gfarm_http_gateway.ZipStreamWriter(chunk_size=4, max_chunks=2)
+    data = bytes(range(50))
+    # in a thread like ZipFile writing entries
+    write = asyncio.create_task(asyncio.to_thread(writer.write, data))
+    await asyncio.sleep(0.1)
+    assert not write.done()  # paused for the slow client
+    assert len(writer._buffer) <= 2
+
+    async def drain():
+        await writer.drain()
+        return len(writer._buffer)
+
+    drained = asyncio.create_task(drain())
+    result = []
+    chunks = writer.get_chunks()
+    for _ in range(len(data) // 4):
+        result.append(await anext(chunks))
+        assert len(writer._buffer) <= 2
+        await asyncio.sleep(0.01)
+    assert await write == len(data)
+    assert await drained < 2
+    writer.write(b"xy")
+    writer.close()
+    result += [chunk async for chunk in chunks]
+    assert b"".join(result) == data + b"xy"
+    assert all(len(chunk) == 4 for chunk in result[:-1])
+
+    # the client has gone
+    writer = gfarm_http_gateway.ZipStreamWriter(chunk_size=4, max_chunks=1)
+    write = asyncio.create_task(asyncio.to_thread(writer.write, data))
+    chunks = writer.get_chunks()
+    await anext(chunks)
+    await chunks.aclose()
+    with pytest.raises(BrokenPipeError):
+        await write
+    with pytest.raises(BrokenPipeError):
+        await writer.drain()
+
+
 @pytest.mark.asyncio
 @pytest.mark.parametrize("mock_gfls",
                          [gfls_success_param3], indirect=True)
@@ -1172,6 +2489,142 @@ async def test_file_copy(
     assert any('"done": true' in line.lower() for line in lines)
 
 
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mock_gfexport", [(b"", 0)], indirect=True)
+@pytest.mark.parametrize("mock_exec", [expect_no_stdout], indirect=True)
+@pytest.mark.parametrize("mock_gfmv", [expect_no_stdout], indirect=True)
+@pytest.mark.parametrize("mock_gfrm", [expect_no_stdout], indirect=True)
+async def test_file_copy_checksum(
+    mock_claims,
+    mock_size_with_mtime,
+    mock_gfrm,
+    mock_gfmv,
+    mock_exec,
+    mock_gfexport
+):
+    # mock_gfexport outputs the path
+    src = "/dir1/file1.txt"
+    copy_data = {"source": src, "destination": "/dir2/file2.txt"}
+
+    def gfcksum(cksum):
+        async def side_effect(env, paths):
+            stdout = f"{cksum} (md5) 15 {paths[0]}\n".encode()
+            proc = mock_exec_common(Mock(), stdout, b"", 0).return_value
+            return proc, paths
+        return side_effect
+
+    with patch("gfarm_http_gateway.gfcksum") as mock_gfcksum:
+        mock_gfcksum.side_effect = gfcksum(hashlib.md5(src.encode())
+                                           .hexdigest())
+        response = client.post("/copy", json=copy_data,
+                               headers=req_headers_oidc_auth)
+        lines = [json.loads(line) for line in response.iter_lines()]
+        assert lines[-1] == {"copied": 15, "total": 1, "warn": None,
+                             "error": None, "done": True}
+        # once for the source
+        args, kwargs = mock_gfcksum.call_args
+        assert kwargs["paths"] == [src]
+        assert mock_gfcksum.call_count == 1
+        mock_gfmv.assert_called_once()
+        mock_gfrm.assert_not_called()
+
+        mock_gfcksum.side_effect = gfcksum("0" * 32)
+        response = client.post("/copy", json=copy_data,
+                               headers=req_headers_oidc_auth)
+        lines = [json.loads(line) for line in response.iter_lines()]
+        assert "checksum mismatch" in lines[-1]["error"]
+        mock_gfmv.assert_called_once()
+        mock_gfrm.assert_called_once()
+
+        # the temporary file is removed when the copy raises
+        mock_gfcksum.side_effect = RuntimeError("gfcksum")
+        with pytest.raises(RuntimeError):
+            client.post("/copy", json=copy_data,
+                        headers=req_headers_oidc_auth)
+        mock_gfmv.assert_called_once()
+        assert mock_gfrm.call_count == 2
+    # the reserved slots are released
+    assert gfarm_http_gateway.spawn_limiter.stats()["running"] == 0
+
+
+expect_gfls_stdout_tree = (
+    b"drwxr-xr-x 4 user group 0 Jul 25 04:13:58 2025 .\n"
+    b"drwxrwxr-x 5 user group 4 Jul 25 04:14:43 2025 ..\n"
+    b"-rw-r--r-- 1 user group 20 Mar 31 17:20:10 2025 file_a.txt\n"
+    b"drwxr-xr-x 1 user group 0 Jun 01 09:00:00 2024 test\n"
+    b"\n"
+    b"/testdir/test:\n"
+    b"drwxr-xr-x 1 user group 0 Jun 01 09:00:00 2024 test2\n"
+    b"lrwxrwxrwx 1 user group 6 Jun 01 09:00:00 2024 symlink -> ./test\n"
+    b"\n"
+    b"/testdir/test/test2:\n"
+    b"-rw-r--r-- 1 user group 30 May 20 15:30:00 2024 file_c.txt\n"
+)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mock_gfls", [(expect_gfls_stdout_tree, b"", 0)],
+                         indirect=True)
+@pytest.mark.parametrize("mock_gfexport", [(b"", 0)], indirect=True)
+@pytest.mark.parametrize("mock_exec", [expect_no_stdout], indirect=True)
+@pytest.mark.parametrize("mock_gfmv", [expect_no_stdout], indirect=True)
+async def test_file_copy_dir(
+    mock_claims,
+    mock_gfmv,
+    mock_exec,
+    mock_gfexport,
+    mock_gfls
+):
+    # mock_gfexport outputs the path
+    copy_data = {"source": "/testdir", "destination": "/dst"}
+    st = gfarm_http_gateway.Stat(Filetype="directory")
+    with patch("gfarm_http_gateway.file_size",
+               return_value=(True, False, 0, None)), \
+         patch("gfarm_http_gateway.file_stat", return_value=st), \
+         patch("gfarm_http_gateway.gfmkdir") as mock_gfmkdir, \
+         patch("gfarm_http_gateway.gfln") as mock_gfln:
+        mock_exec_common(mock_gfmkdir, b"", b"", 0)
+        mock_exec_common(mock_gfln, b"", b"", 0)
+        response = client.post("/copy", json=copy_data,
+                               headers=req_headers_oidc_auth)
+        assert response.status_code == 200
+        lines = [json.loads(line) for line in response.iter_lines()]
+        copied = len("/testdir/file_a.txt/testdir/test/test2/file_c.txt")
+        assert lines[-1] == {"files_copied": 3, "files_total": 3,
+                             "files_failed": 0, "copied": copied,
+                             "total": 50, "warn": lines[-1]["warn"],
+                             "error": None, "done": True}
+        # leaf directories only
+        args, kwargs = mock_gfmkdir.call_args
+        assert args[1:] == ("/dst", "/dst/test/test2")
+        assert kwargs == {"p": True}
+        args, kwargs = mock_gfln.call_args
+        assert args[1:] == ("./test", "/dst/test/symlink", True)
+        dests = sorted(args[2] for args, _ in mock_gfmv.call_args_list)
+        assert dests == ["/dst/file_a.txt", "/dst/test/test2/file_c.txt"]
+        assert gfarm_http_gateway.spawn_limiter.stats()["running"] == 0
+
+    mock_exec.reset_mock()
+    mock_gfmv.reset_mock()
+    with patch("gfarm_http_gateway.file_size",
+               return_value=(True, False, 0, None)), \
+         patch("gfarm_http_gateway.file_stat", return_value=st):
+        response = client.post("/copy?use_gfpcopy=1", json=copy_data,
+                               headers=req_headers_oidc_auth)
+        lines = [json.loads(line) for line in response.iter_lines()]
+        assert lines[-1]["done"] is True
+        assert lines[-1]["error"] is None
+        commands = [args for args, _ in mock_exec.call_args_list]
+        tmpdir = commands[0][1]
+        assert commands[0] == ("gfmkdir", tmpdir)
+        assert tmpdir.startswith("/gfarm-http.copy.dst.")
+        assert commands[1] == ("gfpcopy", "-j", "8", "gfarm:///testdir",
+                               f"gfarm://{tmpdir}")
+        assert commands[2] == ("gfrm", "-f", "-r", tmpdir)
+        args, _ = mock_gfmv.call_args
+        assert args[1:] == (f"{tmpdir}/testdir", "/dst")
+
+
 @pytest.mark.asyncio
 @pytest.mark.parametrize("mock_gfptar", [(b"creating...\n", b"", 0)],
                          indirect=True)
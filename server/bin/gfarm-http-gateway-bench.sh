@@ -0,0 +1,25 @@
+#!/bin/bash
+set -eu
+
+DIR=$(realpath $(dirname $0))
+source "${DIR}/gfarm-http-gateway-common.sh"
+
+export GFARM_HTTP_CONFIG_FILE=./gfarm-http-gateway.conf.default
+
+export GFARM_HTTP_SESSION_SECRET="qU70WDyIpXdSOT9/7l0hICy0597EPRs/aPb5Mj5Xniw="
+export GFARM_HTTP_OIDC_CLIENT_ID=TEST_CLIENT
+export GFARM_HTTP_OIDC_BASE_URL=http://keycloak.test/
+export PYTHONPATH="$API_DIR"
+
+# usage: gfarm-http-gateway-bench.sh [NAME [OPTIONS...]]
+#   NAME: api/bench/bench_NAME.py (default: run all benchmarks)
+if [ $# -ge 1 ]; then
+    NAME="$1"
+    shift
+    exec "$PYTHON3" "${API_DIR}/bench/bench_${NAME}.py" "$@"
+fi
+
+for BENCH in "${API_DIR}"/bench/bench_*.py; do
+    echo "=== $(basename "$BENCH")"
+    "$PYTHON3" "$BENCH"
+done